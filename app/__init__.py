@@ -2,39 +2,120 @@ from datetime import datetime
 import os
 import logging
 from pathlib import Path
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
-from flask_babel import Babel
-from flask_wtf.csrf import CSRFProtect
 from config import Config
+from app.database import RoutingSession, configure_database, init_engines
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
-migrate = Migrate()
-babel = Babel()
-csrf = CSRFProtect()
 
-def create_app():
+
+class LazyGroup(click.Group):
+    """Группа команд CLI, которая загружает свою реализацию при первом обращении"""
+
+    def __init__(self, name, loader, **kwargs):
+        super().__init__(name, **kwargs)
+        self._loader = loader
+        self._group = None
+
+    def _load(self) -> click.Group:
+        if self._group is None:
+            self._group = self._loader()
+        return self._group
+
+    def get_params(self, ctx):
+        return self._load().get_params(ctx)
+
+    def list_commands(self, ctx):
+        return self._load().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load().get_command(ctx, name)
+
+    def invoke(self, ctx):
+        # Обработчик самой группы (например, опции `flask db -d`) - у реализации
+        return self._load().invoke(ctx)
+
+
+def init_migrate(app) -> click.Group:
+    """
+    Подключает Flask-Migrate. Импорт Alembic - самая долгая часть запуска
+    после SQLAlchemy, а нужен он только командам `flask db`.
+
+    Returns:
+        click.Group: группа команд `flask db`
+    """
+    from flask_migrate import Migrate
+    from flask_migrate.cli import db as db_cli_group
+    if 'migrate' not in app.extensions:
+        Migrate(app, db)
+    return db_cli_group
+
+
+def create_app(lightweight=False):
+    """
+    Создает приложение.
+
+    lightweight=True - приложение без обработки HTTP-запросов для воркеров
+    Celery и команд обслуживания: без маршрутов, форм, CSRF, Babel и
+    обработчиков метрик и профилирования, импорт которых занимает заметную
+    часть холодного старта. Из командной строки:
+    flask --app "app:create_app(lightweight=True)" trash cleanup
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    configure_database(app)
     db.init_app(app)
+    init_engines(app, db)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
-    babel.init_app(app, locale_selector=get_locale)
-    csrf.init_app(app)
+    app.cli.add_command(LazyGroup(
+        'db', lambda: init_migrate(app),
+        help='Миграции базы данных (Flask-Migrate).'
+    ))
 
     login_manager.login_view = 'main.login'
     login_manager.login_message_category = 'danger'
     login_manager.login_message = 'Please log in to access this page.'
 
+    from app.cache import make_shared_cache
+    app.extensions['shared_cache'] = make_shared_cache(app.config)
+
     upload_path = Path(app.config['UPLOAD_FOLDER'])
     upload_path.mkdir(exist_ok=True, parents=True)
 
-    from app.routes import main as main_blueprint
-    app.register_blueprint(main_blueprint)
+    from app.backends import make_backend
+    from app.storage import BlobStore, storage_cli
+    app.extensions['blob_store'] = BlobStore(
+        upload_path,
+        backend=make_backend(app.config),
+        chunk_size=app.config['STORAGE_CHUNK_SIZE'],
+        codec=app.config['STORAGE_CODEC'],
+        level=app.config['STORAGE_CODEC_LEVEL']
+    )
+    app.cli.add_command(storage_cli)
+
+    from app.previews import PreviewCache, previews_cli
+    app.extensions['preview_cache'] = PreviewCache(
+        upload_path / 'previews',
+        max_bytes=app.config['PREVIEW_CACHE_MAX_BYTES']
+    )
+    app.cli.add_command(previews_cli)
+
+    from app.search import search_cli
+    app.cli.add_command(search_cli)
+
+    from app.quota import quota_cli
+    app.cli.add_command(quota_cli)
+
+    from app.trash import trash_cli
+    app.cli.add_command(trash_cli)
+
+    if not lightweight:
+        init_web(app)
 
     if not app.debug:
         logging.basicConfig(
@@ -46,6 +127,44 @@ def create_app():
             ]
         )
 
+    return app
+
+
+def init_web(app):
+    """Обработка HTTP-запросов: страницы, API, формы и их зависимости"""
+    from flask_babel import Babel
+    from flask_wtf.csrf import CSRFProtect
+    from app.ingest import StreamingRequest
+    from app.metrics import init_metrics
+    from app.profiling import init_profiling
+    from app.previews import preview_kind
+
+    app.request_class = StreamingRequest
+    if app.config['PROXY_FIX_X_FOR'] or app.config['PROXY_FIX_X_PROTO']:
+        # За прокси request.remote_addr - адрес прокси: лимиты попыток входа
+        # по IP действовали бы на всех клиентов сразу
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app,
+            x_for=app.config['PROXY_FIX_X_FOR'],
+            x_proto=app.config['PROXY_FIX_X_PROTO']
+        )
+    Babel(app, locale_selector=get_locale)
+    CSRFProtect(app)
+    # Раньше проверки CSRF: она разбирает форму вместе с файлом
+    from app.routes import check_upload_quota
+    app.before_request_funcs.setdefault(None, []).insert(0, check_upload_quota)
+    init_metrics(app, db)
+    init_profiling(app)
+    app.jinja_env.globals['preview_kind'] = preview_kind
+
+    from app.routes import main as main_blueprint
+    app.register_blueprint(main_blueprint)
+
+    from app.api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1', name='api_v1')
+    app.register_blueprint(api_blueprint)
+
     # Добавление фильтров
     @app.template_filter('datetimeformat')
     def datetimeformat(value, format='%d.%m.%Y %H:%M'):
@@ -66,8 +185,6 @@ def create_app():
     def inject_now():
         # Добавляет текущий год в футер
         return {'now': datetime.utcnow()}
-    
-    return app
 
 def get_locale():
     from flask import request, session
@@ -75,5 +192,5 @@ def get_locale():
 
 @login_manager.user_loader
 def load_user(user_id):
-    from app.models import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    from app.users import load_cached_user
+    return load_cached_user(int(user_id))
\ No newline at end of file
@@ -0,0 +1,1033 @@
+"""
+Модуль api.py - JSON API приложения FilesCloud.
+
+Содержит обработчики для:
+- Возобновляемой загрузки больших файлов по частям
+- Поиска по мере ввода
+- Списков файлов и корзины: выбор полей (fields), keyset-курсоры и
+  ETag по версии изменений пользователя
+- Пакетных операций над файлами (удаление, восстановление, очистка, доступ,
+  перенос в папку, скачивание ZIP-архивом)
+- Папок: создание, переименование и перенос поддерева, корзина, скачивание
+  архивом и общий доступ
+
+Блюпринт регистрируется дважды: /api/v1 - версионированный адрес, /api -
+прежний, для существующих клиентов. JSON-ответы сжимаются (compression.py).
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, current_app, url_for, abort, make_response
+from flask_login import login_required, current_user
+from sqlalchemy import bindparam, delete, insert, select, update
+from werkzeug.exceptions import HTTPException
+
+from app import db
+from app.archives import send_files_archive, send_folder_archive
+from app.compression import compress_response
+from app.database import read_only
+from app.folders import (
+    FolderError, get_folder, create_folder, rename_folder, move_folder, move_files,
+    trash_folder, restore_folder, adjust_folder_totals, detach_from_trashed_folders,
+    list_children, breadcrumbs, folder_json, trash_roots_clause, visible_in_trash_clause
+)
+from app.models import File, Folder, ShareLink, UploadSession, UploadChunk
+from app.pagination import keyset_paginate, decode_cursor, cached_count, invalidate_counts
+from app.previews import schedule_previews
+from app.quota import adjust_usage, has_room_for, reserve_space
+from app.search import match_clause, ranked_search
+from app.sharing import invalidate_shares
+from app.sniffing import SNIFF_SIZE, UploadRejected, inspect_upload, read_head
+from app.storage import blob_store, add_ref
+from app.trash import BULK_PURGE_BATCH, PURGE_COLUMNS, purge_folder, purge_rows, remove_purged
+from app.users import change_version, touch_user
+from app.utils import allowed_file, generate_secure_filename
+
+api = Blueprint('api', __name__, url_prefix='/api')
+api.after_request(compress_response)
+logger = logging.getLogger(__name__)
+
+# Предел количества файлов в одной пакетной операции по списку id
+BULK_MAX_IDS = 10000
+# Предел размера страницы списков
+LIST_MAX_LIMIT = 200
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _share_url(token):
+    return url_for('main.shared_download', token=token, _external=True) if token else None
+
+
+# Поля файла в списках: колонки, которые нужно выбрать, и значение в JSON
+FILE_FIELDS = {
+    'id': ((File.id,), lambda row: row.id),
+    'filename': ((File.filename,), lambda row: row.filename),
+    'size': ((File.size,), lambda row: row.size),
+    'mime_type': ((File.mime_type,), lambda row: row.mime_type),
+    'folder_id': ((File.folder_id,), lambda row: row.folder_id),
+    'uploaded_at': ((File.uploaded_at,), lambda row: _isoformat(row.uploaded_at)),
+    'deleted_at': ((File.deleted_at,), lambda row: _isoformat(row.deleted_at)),
+    'download_url': (
+        (File.filename,),
+        lambda row: url_for('main.download_file', filename=row.filename)
+    ),
+    'share_url': (
+        (select(ShareLink.token).where(ShareLink.file_id == File.id).limit(1)
+         .scalar_subquery().label('share_token'),),
+        lambda row: _share_url(row.share_token)
+    ),
+}
+LIST_FIELDS = ('id', 'filename', 'size', 'mime_type', 'folder_id', 'uploaded_at', 'download_url')
+TRASH_FIELDS = ('id', 'filename', 'size', 'folder_id', 'deleted_at')
+
+
+def json_error(message: str, status: int) -> tuple:
+    """Ответ с ошибкой в формате JSON"""
+    return jsonify(error=message), status
+
+
+@api.errorhandler(HTTPException)
+def http_error(error) -> tuple:
+    """Отдает HTTP-ошибки API в JSON вместо HTML-страниц"""
+    return json_error(error.description, error.code)
+
+
+def merge_ranges(chunks) -> list:
+    """
+    Объединяет принятые части в непрерывные диапазоны.
+
+    Args:
+        chunks: Пары (offset, length)
+
+    Returns:
+        list: Отсортированные диапазоны [start, end)
+    """
+    ranges = []
+    for offset, length in sorted(chunks):
+        end = offset + length
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return ranges
+
+
+def get_upload_session(upload_id: str, live: bool = True) -> UploadSession:
+    """Загрузка текущего пользователя; live=True - просроченная отменяется (410)"""
+    upload = UploadSession.query.filter_by(
+        id=upload_id,
+        user_id=current_user.id
+    ).first_or_404()
+    if live and upload.expires_at < datetime.utcnow():
+        discard_upload(upload)
+        abort(410, 'Срок загрузки истек')
+    return upload
+
+
+def received_ranges(upload: UploadSession) -> list:
+    chunks = db.session.execute(
+        select(UploadChunk.offset, UploadChunk.length)
+        .where(UploadChunk.session_id == upload.id)
+    ).all()
+    return merge_ranges(chunks)
+
+
+def delete_upload(upload: UploadSession) -> None:
+    """Удаляет сессию вместе с частями (без опоры на ON DELETE CASCADE в SQLite)"""
+    UploadChunk.query.filter_by(session_id=upload.id).delete(synchronize_session=False)
+    db.session.delete(upload)
+
+
+def remove_staging(upload: UploadSession) -> None:
+    """Удаляет staging-файл загрузки (после коммита)"""
+    blob_store().discard_staging(upload.id)
+
+
+def discard_upload(upload: UploadSession) -> None:
+    """Отменяет загрузку: удаляет сессию и staging-файл"""
+    delete_upload(upload)
+    db.session.commit()
+    remove_staging(upload)
+
+
+@api.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """
+    Начинает загрузку по частям.
+
+    Тело запроса: {"filename": str, "size": int, "folder_id": int}
+    (folder_id необязателен, без него файл попадет в корень). Под файл сразу
+    резервируется разреженный staging-файл нужного размера, в который
+    части записываются по своим смещениям в любом порядке.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = (data.get('filename') or '').strip()
+    size = data.get('size')
+
+    if not filename or not allowed_file(filename):
+        return json_error('Недопустимый файл', 400)
+    if not isinstance(size, int) or size < 0:
+        return json_error('Некорректный размер файла', 400)
+    if size > current_app.config['MAX_FILE_SIZE']:
+        return json_error('Файл слишком большой', 413)
+    if not has_room_for(current_user, size):
+        return json_error('Недостаточно места: превышена квота', 507)
+    folder_id = data.get('folder_id')
+    if folder_id is not None and get_folder(current_user.id, folder_id) is None:
+        return json_error('Папка не найдена', 404)
+
+    upload = UploadSession(
+        id=os.urandom(16).hex(),
+        user_id=current_user.id,
+        folder_id=folder_id,
+        filename=filename,
+        total_size=size,
+        expires_at=datetime.utcnow() + timedelta(
+            seconds=current_app.config['UPLOAD_SESSION_TTL']
+        )
+    )
+    try:
+        with open(blob_store().staging_path(upload.id), 'wb') as fh:
+            fh.truncate(size)
+        db.session.add(upload)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Upload session error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при создании загрузки', 500)
+
+    logger.info(f"User {current_user.id} started chunked upload {upload.id} ({size} bytes)")
+    return jsonify(
+        id=upload.id,
+        size=upload.total_size,
+        chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'],
+        expires_at=upload.expires_at.isoformat()
+    ), 201
+
+
+@api.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """
+    Принимает часть файла по смещению ?offset=N.
+
+    Тело запроса читается из request.stream блоками, минуя разбор формы,
+    в буфер (в памяти до UPLOAD_CHUNK_SIZE, больше - во временном файле) и
+    попадает в staging-файл, только когда часть принята целиком и, если
+    передан заголовок X-Chunk-SHA256, совпала контрольная сумма: оборванная
+    или испорченная передача не затирает уже принятые байты. Начало части
+    с нулевым смещением проверяется на соответствие типу файла; при
+    несовпадении загрузка отменяется (415).
+    """
+    upload = get_upload_session(upload_id)
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+
+    if offset is None or offset < 0:
+        return json_error('Не указано смещение части', 400)
+    if length is None:
+        return json_error('Требуется заголовок Content-Length', 411)
+    if offset + length > upload.total_size:
+        return json_error('Часть выходит за пределы файла', 416)
+
+    head = b''
+    if offset == 0:
+        head_size = min(SNIFF_SIZE, length)
+        while len(head) < head_size:
+            data = request.stream.read(head_size - len(head))
+            if not data:
+                break
+            head += data
+        try:
+            inspect_upload(upload.filename, head)
+        except UploadRejected as e:
+            discard_upload(upload)
+            return json_error(e.description, e.code)
+
+    expected = request.headers.get('X-Chunk-SHA256', '').strip().lower()
+    digest = hashlib.sha256(head)
+    remaining = length - len(head)
+    block_size = blob_store().chunk_size
+
+    with tempfile.SpooledTemporaryFile(current_app.config['UPLOAD_CHUNK_SIZE']) as buffer:
+        buffer.write(head)
+        while remaining:
+            data = request.stream.read(min(block_size, remaining))
+            if not data:
+                break
+            digest.update(data)
+            buffer.write(data)
+            remaining -= len(data)
+
+        if remaining:
+            return json_error('Часть передана не полностью', 400)
+        if expected and expected != digest.hexdigest():
+            return json_error('Контрольная сумма части не совпадает', 422)
+
+        buffer.seek(0)
+        try:
+            with blob_store().open_staging(upload.id) as fh:
+                fh.seek(offset)
+                shutil.copyfileobj(buffer, fh, block_size)
+        except FileNotFoundError:
+            return json_error('Загрузка уже завершается', 409)
+
+    try:
+        db.session.add(UploadChunk(
+            session_id=upload.id,
+            offset=offset,
+            length=length,
+            checksum=digest.hexdigest()
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Chunk upload error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при сохранении части', 500)
+
+    return jsonify(offset=offset, length=length, checksum=digest.hexdigest())
+
+
+@api.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Состояние загрузки: какие диапазоны байт уже приняты"""
+    upload = get_upload_session(upload_id)
+    ranges = received_ranges(upload)
+    return jsonify(
+        id=upload.id,
+        filename=upload.filename,
+        size=upload.total_size,
+        received=sum(end - start for start, end in ranges),
+        ranges=ranges,
+        expires_at=upload.expires_at.isoformat()
+    )
+
+
+@api.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """
+    Завершает загрузку по частям.
+
+    Проверяет, что приняты все байты, сверяет начало файла с его типом,
+    передает staging-файл хранилищу блобов (на локальном диске - жесткой
+    ссылкой, без копирования; или сжимает, если включено сжатие) и
+    создает запись File. На время завершения staging-файл забирается у
+    загрузки (freeze_staging): части, пришедшие параллельно, получают 409
+    и не могут изменить данные уже посчитанного хеша. Удаляется он только
+    после коммита, а при ошибке возвращается загрузке, и ее можно завершить
+    повторно. Необязательное поле {"sha256": str} в теле сверяется с хешем
+    всего файла.
+    """
+    upload = get_upload_session(upload_id)
+    ranges = received_ranges(upload)
+    if upload.total_size and ranges != [[0, upload.total_size]]:
+        return jsonify(error='Файл получен не полностью', ranges=ranges), 409
+
+    expected = ((request.get_json(silent=True) or {}).get('sha256') or '').lower()
+    store = blob_store()
+
+    try:
+        staging = store.freeze_staging(upload.id)
+    except FileNotFoundError:
+        return json_error('Загрузка уже завершается', 409)
+    try:
+        mime_type = inspect_upload(upload.filename, read_head(staging))
+        blob = store.adopt(staging)
+    except UploadRejected as e:
+        discard_upload(upload)
+        return json_error(e.description, e.code)
+    except Exception as e:
+        store.thaw_staging(upload.id)
+        logger.error(f"Upload complete error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при завершении загрузки', 500)
+
+    try:
+        delete_upload(upload)
+        if expected and expected != blob.digest:
+            db.session.commit()
+            remove_staging(upload)
+            store.unlink([blob.digest])
+            return json_error('Контрольная сумма файла не совпадает', 422)
+
+        if not reserve_space(current_user.id, blob.size):
+            db.session.commit()
+            remove_staging(upload)
+            store.unlink([blob.digest])
+            return json_error('Недостаточно места: превышена квота', 507)
+
+        add_ref(blob.digest, blob.size)
+        # Папку могли удалить, пока шла загрузка - тогда файл попадает в корень
+        folder = get_folder(current_user.id, upload.folder_id)
+        adjust_folder_totals(folder, 1, blob.size)
+        new_file = File(
+            filename=generate_secure_filename(upload.filename),
+            storage_path=blob.key,
+            content_hash=blob.digest,
+            size=blob.size,
+            stored_size=blob.stored_size,
+            codec=blob.codec,
+            mime_type=mime_type,
+            user_id=current_user.id,
+            folder_id=folder.id if folder else None
+        )
+        db.session.add(new_file)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Блоб без строки в blobs удаляется, staging-файл и сессия остаются
+        # для повторного завершения
+        store.unlink([blob.digest])
+        store.thaw_staging(upload.id)
+        logger.error(f"Upload complete error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при завершении загрузки', 500)
+
+    remove_staging(upload)
+    invalidate_counts(current_user.id)
+    schedule_previews(new_file)
+
+    logger.info(f"User {current_user.id} uploaded {new_file.filename} in chunks")
+    return jsonify(
+        id=new_file.id,
+        filename=new_file.filename,
+        size=new_file.size,
+        mime_type=new_file.mime_type,
+        sha256=blob.digest
+    ), 201
+
+
+@api.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload(upload_id):
+    """Отменяет загрузку и удаляет принятые части"""
+    upload = get_upload_session(upload_id, live=False)
+    discard_upload(upload)
+    return '', 204
+
+
+@api.route('/search')
+@login_required
+@read_only
+def search():
+    """
+    Поиск файлов по мере ввода.
+
+    Параметры: q - строка поиска (слова ищутся по префиксу),
+    limit - количество результатов (не более 50).
+    """
+    search_query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    files = ranked_search(current_user.id, search_query, limit)
+    return jsonify(results=[{
+        'id': file.id,
+        'filename': file.filename,
+        'size': file.size,
+        'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
+        'download_url': url_for('main.download_file', filename=file.filename)
+    } for file in files])
+
+
+def versioned(view):
+    """
+    ETag списка по версии изменений пользователя.
+
+    Совпавший If-None-Match получает 304 после одного чтения users по
+    первичному ключу, без запросов самого списка. Cache-Control: private,
+    no-cache - браузер хранит ответ, но перед каждым использованием
+    сверяет версию.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        etag = f'{current_user.id}-{change_version(current_user.id)}'
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapped
+
+
+def selected_fields(default: tuple) -> list:
+    """Поля из параметра fields (через запятую) или поля по умолчанию"""
+    raw = request.args.get('fields')
+    if not raw:
+        return list(default)
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in FILE_FIELDS]
+    if unknown or not fields:
+        abort(400, f'Неизвестные поля: {", ".join(unknown)}' if unknown else 'Пустой список полей')
+    return fields
+
+
+def list_files(criteria: list, fields: list, sort_column, count_key) -> dict:
+    """
+    Страница файлов с выбранными полями.
+
+    Из базы читаются только колонки выбранных полей (плюс ключ сортировки
+    для курсоров), а не строки File целиком.
+    """
+    columns = {File.id.key: File.id, sort_column.key: sort_column}
+    for name in fields:
+        for column in FILE_FIELDS[name][0]:
+            columns.setdefault(column.key, column)
+    query = db.session.query(*columns.values()).filter(*criteria)
+    limit = min(max(request.args.get('limit', current_app.config['ITEMS_PER_PAGE'], type=int), 1),
+                LIST_MAX_LIMIT)
+
+    page = keyset_paginate(
+        query, sort_column, File.id, limit,
+        after=decode_cursor(request.args.get('after')),
+        before=decode_cursor(request.args.get('before'))
+    )
+    result = {
+        'files': [{name: FILE_FIELDS[name][1](row) for name in fields} for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }
+    if current_app.config['LISTING_SHOW_TOTAL']:
+        result['total'] = cached_count(
+            current_user.id, count_key, File.query.filter(*criteria)
+        )
+    return result
+
+
+def first_page() -> bool:
+    return not (request.args.get('after') or request.args.get('before'))
+
+
+@api.route('/files')
+@login_required
+@read_only
+@versioned
+def api_list_files():
+    """
+    Файлы папки или результаты поиска, от новых к старым.
+
+    Параметры: folder_id (без него - корень), q - поиск по всем папкам,
+    fields - поля через запятую, limit, after/before - курсоры соседних
+    страниц. Первая страница папки содержит и ее подпапки.
+    """
+    search_query = request.args.get('q', '').strip()
+    folder_id = request.args.get('folder_id', type=int)
+    if folder_id is not None:
+        get_user_folder(folder_id)
+
+    criteria = [File.user_id == current_user.id, File.is_deleted == False]
+    if search_query:
+        criteria.append(match_clause(current_user.id, search_query))
+    else:
+        criteria.append(File.folder_id == folder_id)
+
+    result = list_files(
+        criteria, selected_fields(LIST_FIELDS), File.uploaded_at,
+        ('files', folder_id, search_query)
+    )
+    if not search_query and first_page():
+        result['folders'] = [folder_json(child) for child in list_children(current_user.id, folder_id)]
+    return jsonify(result)
+
+
+@api.route('/trash')
+@login_required
+@read_only
+@versioned
+def api_list_trash():
+    """
+    Содержимое корзины, от недавно удаленных к давним.
+
+    Параметры - как у /files, кроме folder_id и q. Файлы удаленных папок
+    показываются самими папками (поле folders на первой странице).
+    """
+    criteria = [
+        File.user_id == current_user.id, File.is_deleted == True, visible_in_trash_clause()
+    ]
+    result = list_files(criteria, selected_fields(TRASH_FIELDS), File.deleted_at, 'trash')
+    if first_page():
+        folders = Folder.query.filter(
+            Folder.user_id == current_user.id,
+            Folder.is_deleted == True,
+            trash_roots_clause()
+        ).order_by(Folder.deleted_at.desc()).all()
+        result['folders'] = [
+            {**folder_json(folder), 'deleted_at': _isoformat(folder.deleted_at)}
+            for folder in folders
+        ]
+    return jsonify(result)
+
+
+def bulk_criteria(data: dict, in_trash: bool) -> list:
+    """
+    Условия отбора файлов для пакетной операции.
+
+    Тело запроса содержит либо {"ids": [int, ...]}, либо
+    {"filter": {"q": str}} - все файлы, подходящие под поиск (пустая
+    строка - все файлы). Владелец и состояние файла (в корзине или нет)
+    всегда входят в WHERE, поэтому чужие id просто не затрагиваются.
+    """
+    criteria = [File.user_id == current_user.id, File.is_deleted == in_trash]
+    ids = data.get('ids')
+    search_filter = data.get('filter')
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids
+        ):
+            abort(400, 'Поле ids должно быть списком целых чисел')
+        if len(ids) > BULK_MAX_IDS:
+            abort(413, f'Не более {BULK_MAX_IDS} файлов за одну операцию')
+        criteria.append(File.id.in_(set(ids)))
+    elif isinstance(search_filter, dict):
+        search_query = str(search_filter.get('q') or '').strip()
+        if search_query:
+            criteria.append(match_clause(current_user.id, search_query))
+    else:
+        abort(400, 'Укажите ids или filter')
+    return criteria
+
+
+def update_files(criteria: list, **values) -> list:
+    """
+    Пакетный UPDATE файлов одним запросом (без коммита).
+
+    Returns:
+        list: Размеры измененных файлов - для пересчета счетчиков
+    """
+    stmt = update(File).where(*criteria).values(**values).execution_options(
+        synchronize_session=False
+    )
+    if db.engine.dialect.update_returning:
+        return db.session.execute(stmt.returning(File.size)).scalars().all()
+    sizes = db.session.scalars(select(File.size).where(*criteria)).all()
+    db.session.execute(stmt)
+    return sizes
+
+
+@api.route('/files/bulk/delete', methods=['POST'])
+@login_required
+def bulk_delete():
+    """Перемещает выбранные файлы в корзину"""
+    criteria = bulk_criteria(request.get_json(silent=True) or {}, in_trash=False)
+    try:
+        sizes = update_files(criteria, is_deleted=True, deleted_at=datetime.utcnow())
+        adjust_usage(current_user.id, file_count=-len(sizes),
+                     trash_bytes=sum(sizes), trash_count=len(sizes))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk delete error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при удалении файлов', 500)
+
+    invalidate_counts(current_user.id)
+    logger.info(f"User {current_user.id} moved {len(sizes)} files to trash")
+    return jsonify(affected=len(sizes))
+
+
+@api.route('/files/bulk/restore', methods=['POST'])
+@login_required
+def bulk_restore():
+    """Восстанавливает выбранные файлы из корзины"""
+    criteria = bulk_criteria(request.get_json(silent=True) or {}, in_trash=True)
+    try:
+        # Файлы из удаленных папок восстанавливаются в корень
+        detach_from_trashed_folders(criteria)
+        sizes = update_files(criteria, is_deleted=False, deleted_at=None)
+        adjust_usage(current_user.id, file_count=len(sizes),
+                     trash_bytes=-sum(sizes), trash_count=-len(sizes))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk restore error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при восстановлении файлов', 500)
+
+    invalidate_counts(current_user.id)
+    logger.info(f"User {current_user.id} restored {len(sizes)} files")
+    return jsonify(affected=len(sizes))
+
+
+@api.route('/files/bulk/purge', methods=['POST'])
+@login_required
+def bulk_purge():
+    """
+    Окончательно удаляет выбранные файлы из корзины.
+
+    Строки выбираются окнами по первичному ключу по BULK_PURGE_BATCH, как
+    в cleanup_expired: фильтр по всей корзине не загружает все строки
+    в память и не упирается в лимит параметров запроса SQLite. Каждая
+    пачка коммитится отдельно, файлы с диска удаляются после коммита
+    в фоновом потоке хранилища. При ошибке уже удаленные пачки остаются
+    удаленными, повторный запрос доудалит остальное.
+    """
+    criteria = bulk_criteria(request.get_json(silent=True) or {}, in_trash=True)
+    affected = purged_bytes = 0
+    last_id = 0
+    while True:
+        try:
+            rows = db.session.execute(
+                select(*PURGE_COLUMNS)
+                .where(*criteria, File.id > last_id)
+                .order_by(File.id)
+                .limit(BULK_PURGE_BATCH)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            batch = purge_rows(rows, File.user_id == current_user.id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulk purge error (ids after {last_id}): {str(e)}", exc_info=True)
+            if affected:
+                invalidate_counts(current_user.id)
+            return json_error('Ошибка при удалении файлов', 500)
+
+        remove_purged(batch, background=True)
+        affected += len(batch.rows)
+        purged_bytes += batch.bytes
+
+    invalidate_counts(current_user.id)
+    logger.info(f"User {current_user.id} purged {affected} files")
+    return jsonify(affected=affected, bytes=purged_bytes)
+
+
+def share_settings(data: dict) -> dict:
+    """
+    Настройки общей ссылки из тела запроса.
+
+    Поля: expiration (секунды, 0 - бессрочно), password,
+    download_limit (0 - без ограничений).
+    """
+    expiration = data.get('expiration', 0)
+    download_limit = data.get('download_limit', 0)
+    password = data.get('password') or None
+    if not isinstance(expiration, int) or expiration < 0:
+        abort(400, 'Некорректный срок действия')
+    if not isinstance(download_limit, int) or download_limit < 0:
+        abort(400, 'Некорректный лимит скачиваний')
+    if password is not None and (not isinstance(password, str) or len(password) > 128):
+        abort(400, 'Некорректный пароль')
+
+    return {
+        'expiration': datetime.utcnow() + timedelta(seconds=expiration) if expiration else None,
+        'password': password,
+        'download_limit': download_limit,
+    }
+
+
+@api.route('/files/bulk/download', methods=['POST'])
+@login_required
+def bulk_download():
+    """
+    Скачивает выбранные файлы одним ZIP-архивом.
+
+    Тело - как у остальных пакетных операций. Архив отдается потоком по
+    мере чтения файлов, размер ответа заранее неизвестен.
+    """
+    data = request.get_json(silent=True) or {}
+    return send_files_archive(bulk_criteria(data, in_trash=False))
+
+
+@api.route('/files/bulk/share', methods=['POST'])
+@login_required
+def bulk_share():
+    """
+    Создает или обновляет общие ссылки для выбранных файлов.
+
+    Дополнительные поля тела: expiration (секунды, 0 - бессрочно),
+    password, download_limit (0 - без ограничений). Как и при настройке
+    одного файла, каждой ссылке выдается новый токен.
+    """
+    data = request.get_json(silent=True) or {}
+    criteria = bulk_criteria(data, in_trash=False)
+    settings = share_settings(data)
+
+    try:
+        file_ids = db.session.scalars(
+            select(File.id).where(*criteria).order_by(File.id).limit(BULK_MAX_IDS + 1)
+        ).all()
+        if len(file_ids) > BULK_MAX_IDS:
+            return json_error(f'Не более {BULK_MAX_IDS} файлов за одну операцию', 413)
+
+        existing = {}
+        old_tokens = []
+        for file_id, link_id, token in db.session.execute(
+            select(ShareLink.file_id, ShareLink.id, ShareLink.token)
+            .where(ShareLink.file_id.in_(file_ids))
+        ):
+            existing[file_id] = link_id
+            old_tokens.append(token)
+        tokens = {file_id: os.urandom(16).hex() for file_id in file_ids}
+
+        links = ShareLink.__table__
+        if existing:
+            db.session.execute(
+                update(links).where(links.c.id == bindparam('link_id')).values(
+                    token=bindparam('new_token'),
+                    expiration=bindparam('new_expiration'),
+                    password=bindparam('new_password'),
+                    download_limit=bindparam('new_download_limit')
+                ),
+                [{
+                    'link_id': link_id,
+                    'new_token': tokens[file_id],
+                    'new_expiration': settings['expiration'],
+                    'new_password': settings['password'],
+                    'new_download_limit': settings['download_limit'],
+                } for file_id, link_id in existing.items()]
+            )
+        created = [file_id for file_id in file_ids if file_id not in existing]
+        if created:
+            db.session.execute(insert(ShareLink), [
+                {'file_id': file_id, 'token': tokens[file_id], **settings}
+                for file_id in created
+            ])
+        touch_user(current_user.id)
+        db.session.commit()
+        invalidate_shares(old_tokens)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk share error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при настройке доступа', 500)
+
+    logger.info(f"User {current_user.id} shared {len(file_ids)} files")
+    return jsonify(links=[{
+        'file_id': file_id,
+        'token': tokens[file_id],
+        'url': url_for('main.shared_download', token=tokens[file_id], _external=True)
+    } for file_id in file_ids])
+
+
+@api.route('/files/bulk/unshare', methods=['POST'])
+@login_required
+def bulk_unshare():
+    """Удаляет общие ссылки выбранных файлов"""
+    criteria = bulk_criteria(request.get_json(silent=True) or {}, in_trash=False)
+    selected = select(File.id).where(*criteria).scalar_subquery()
+    try:
+        tokens = db.session.scalars(
+            select(ShareLink.token).where(ShareLink.file_id.in_(selected))
+        ).all()
+        if tokens:
+            db.session.execute(
+                delete(ShareLink).where(ShareLink.file_id.in_(selected))
+                .execution_options(synchronize_session=False)
+            )
+            touch_user(current_user.id)
+        db.session.commit()
+        invalidate_shares(tokens)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk unshare error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при отключении доступа', 500)
+
+    logger.info(f"User {current_user.id} unshared {len(tokens)} files")
+    return jsonify(affected=len(tokens))
+
+
+@api.route('/files/bulk/move', methods=['POST'])
+@login_required
+def bulk_move():
+    """
+    Переносит выбранные файлы в папку.
+
+    Дополнительное поле тела: folder_id (null - корень). Файлы
+    переносятся одним UPDATE, агрегаты папок пересчитываются по разнице.
+    """
+    data = request.get_json(silent=True) or {}
+    criteria = bulk_criteria(data, in_trash=False)
+    folder_id = data.get('folder_id')
+    target = get_folder(current_user.id, folder_id)
+    if folder_id is not None and target is None:
+        return json_error('Папка не найдена', 404)
+
+    try:
+        moved = move_files(criteria, target)
+        touch_user(current_user.id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk move error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при переносе файлов', 500)
+
+    invalidate_counts(current_user.id)
+    logger.info(f"User {current_user.id} moved {moved} files to folder {folder_id}")
+    return jsonify(affected=moved)
+
+
+def get_user_folder(folder_id: int, is_deleted: bool = False):
+    folder = get_folder(current_user.id, folder_id, is_deleted)
+    if folder is None:
+        abort(404, 'Папка не найдена')
+    return folder
+
+
+@api.route('/folders', methods=['POST'])
+@login_required
+def api_create_folder():
+    """Создает папку. Тело запроса: {"name": str, "parent_id": int | null}"""
+    data = request.get_json(silent=True) or {}
+    parent_id = data.get('parent_id')
+    parent = get_user_folder(parent_id) if parent_id is not None else None
+    try:
+        folder = create_folder(current_user.id, data.get('name'), parent)
+        db.session.commit()
+    except FolderError as e:
+        db.session.rollback()
+        return json_error(str(e), 409)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder create error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при создании папки', 500)
+    return jsonify(folder_json(folder)), 201
+
+
+@api.route('/folders/<int:folder_id>', methods=['GET'])
+@login_required
+@read_only
+@versioned
+def api_get_folder(folder_id):
+    """Папка с агрегатами по поддереву, ее подпапки и путь от корня"""
+    folder = get_user_folder(folder_id)
+    return jsonify(
+        **folder_json(folder),
+        children=[folder_json(child) for child in list_children(current_user.id, folder.id)],
+        breadcrumbs=[{'id': item.id, 'name': item.name} for item in breadcrumbs(folder)]
+    )
+
+
+@api.route('/folders/<int:folder_id>', methods=['PATCH'])
+@login_required
+def api_update_folder(folder_id):
+    """
+    Переименовывает и/или переносит папку.
+
+    Тело запроса: {"name": str} и/или {"parent_id": int | null}.
+    Перенос поддерева любого размера - один UPDATE путей.
+    """
+    data = request.get_json(silent=True) or {}
+    folder = get_user_folder(folder_id)
+    try:
+        if 'parent_id' in data:
+            parent_id = data['parent_id']
+            move_folder(folder, get_user_folder(parent_id) if parent_id is not None else None)
+        if 'name' in data:
+            rename_folder(folder, data['name'])
+        db.session.commit()
+    except FolderError as e:
+        db.session.rollback()
+        return json_error(str(e), 409)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder update error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при изменении папки', 500)
+    return jsonify(folder_json(folder))
+
+
+@api.route('/folders/<int:folder_id>', methods=['DELETE'])
+@login_required
+def api_delete_folder(folder_id):
+    """Перемещает папку со всем содержимым в корзину"""
+    folder = get_user_folder(folder_id)
+    try:
+        count = trash_folder(folder)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder delete error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при удалении папки', 500)
+    invalidate_counts(current_user.id)
+    return jsonify(affected=count)
+
+
+@api.route('/folders/<int:folder_id>/download', methods=['GET'])
+@login_required
+def api_download_folder(folder_id):
+    """Скачивает папку со всем содержимым ZIP-архивом"""
+    return send_folder_archive(get_user_folder(folder_id))
+
+
+@api.route('/folders/<int:folder_id>/share', methods=['POST'])
+@login_required
+def api_share_folder(folder_id):
+    """
+    Создает или обновляет общую ссылку на папку.
+
+    Поля тела - как у /files/bulk/share. По ссылке папка скачивается
+    ZIP-архивом; каждый вызов выдает новый токен.
+    """
+    folder = get_user_folder(folder_id)
+    settings = share_settings(request.get_json(silent=True) or {})
+    try:
+        share_link = ShareLink.query.filter_by(folder_id=folder.id).first()
+        old_token = share_link.token if share_link else None
+        if not share_link:
+            share_link = ShareLink(folder_id=folder.id)
+            db.session.add(share_link)
+        for name, value in settings.items():
+            setattr(share_link, name, value)
+        share_link.token = os.urandom(16).hex()
+        touch_user(current_user.id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder share error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при настройке доступа', 500)
+    if old_token:
+        invalidate_shares([old_token])
+
+    return jsonify(
+        folder_id=folder.id,
+        token=share_link.token,
+        url=url_for('main.shared_download', token=share_link.token, _external=True)
+    )
+
+
+@api.route('/folders/<int:folder_id>/restore', methods=['POST'])
+@login_required
+def api_restore_folder(folder_id):
+    """Восстанавливает папку из корзины"""
+    folder = get_user_folder(folder_id, is_deleted=True)
+    try:
+        count = restore_folder(folder)
+        db.session.commit()
+    except FolderError as e:
+        db.session.rollback()
+        return json_error(str(e), 409)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder restore error: {str(e)}", exc_info=True)
+        return json_error('Ошибка при восстановлении папки', 500)
+    invalidate_counts(current_user.id)
+    return jsonify(affected=count)
+
+
+@api.route('/folders/<int:folder_id>/purge', methods=['POST'])
+@login_required
+def api_purge_folder(folder_id):
+    """Окончательно удаляет папку из корзины"""
+    folder = get_user_folder(folder_id, is_deleted=True)
+    try:
+        affected, purged_bytes = purge_folder(folder)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder purge error: {str(e)}", exc_info=True)
+        # Часть пачек могла быть удалена до ошибки
+        invalidate_counts(current_user.id)
+        return json_error('Ошибка при удалении папки', 500)
+    invalidate_counts(current_user.id)
+    return jsonify(affected=affected, bytes=purged_bytes)
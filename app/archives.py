@@ -0,0 +1,238 @@
+"""
+Модуль archives.py - скачивание нескольких файлов или папки одним ZIP.
+
+Архив собирается на лету и отдается потоком:
+- ZipFile пишет в буфер без seek, поэтому размеры и CRC каждого файла
+  идут в дескрипторе данных после его содержимого, а файлы больше 4 ГБ
+  и архивы больше 65535 файлов записываются в формате ZIP64
+- данные блобов читаются последовательно блоками STORAGE_CHUNK_SIZE,
+  и после каждого блока готовые байты сразу уходят клиенту, так что
+  память не зависит от размера файлов (в памяти остаются только записи
+  центрального каталога, порядка сотни байт на файл)
+- уже сжатые данные (jpg, zip, видео) записываются без повторного сжатия
+  (ZIP_STORED); решение принимается по тому же признаку, что и при
+  сжатии блобов в хранилище
+- список файлов читается окнами по первичному ключу, и первые байты
+  отправляются до того, как выбраны все файлы
+- совпадающие имена в одном каталоге архива (в том числе с вложенной
+  папкой) получают суффикс: name (1).ext, name (2).ext
+"""
+
+import logging
+import posixpath
+import zipfile
+from datetime import datetime
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select
+
+from app import db
+from app.codecs import SAMPLE_SIZE, is_compressible
+from app.downloads import _disposition_names
+from app.folders import subtree_clause, subtree_ids
+from app.models import File, Folder
+from app.storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+# Количество файлов, выбираемых из базы одним запросом
+ARCHIVE_BATCH_SIZE = 500
+
+# Самая ранняя дата, которую можно записать в заголовок ZIP
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+# Файлы больше этого размера пишутся сразу в формате ZIP64
+ZIP64_THRESHOLD = (1 << 31) - 1
+
+# ZipInfo.compress_level - с Python 3.13; раньше уровень сжатия записи
+# хранится только в закрытом атрибуте _compresslevel
+ENTRY_COMPRESS_LEVEL = hasattr(zipfile.ZipInfo, 'compress_level')
+
+ARCHIVE_COLUMNS = (
+    File.id,
+    File.filename,
+    File.storage_path,
+    File.content_hash,
+    File.codec,
+    File.size,
+    File.uploaded_at,
+    File.folder_id,
+)
+
+
+class _ZipSink:
+    """Поток только для записи: накапливает байты до следующей отправки"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _date_time(value: datetime) -> tuple:
+    return max(value or ZIP_EPOCH, ZIP_EPOCH).timetuple()[:6]
+
+
+def _unique_name(name: str, used: set) -> str:
+    """
+    Имя записи, не совпадающее с уже использованными в архиве.
+
+    Сравнение без учета регистра: при распаковке в Windows и macOS
+    такие файлы перезаписали бы друг друга.
+    """
+    candidate = name
+    directory, base = posixpath.split(name)
+    stem, ext = posixpath.splitext(base)
+    number = 0
+    while candidate.casefold() in used:
+        number += 1
+        candidate = posixpath.join(directory, f'{stem} ({number}){ext}')
+    used.add(candidate.casefold())
+    return candidate
+
+
+def iter_archive_rows(*criteria, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """
+    Строки файлов, подходящих под criteria, окнами по первичному ключу.
+
+    После каждого окна читающая транзакция завершается, чтобы не держать
+    снимок базы все время, пока клиент скачивает архив.
+    """
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(*ARCHIVE_COLUMNS)
+            .where(*criteria, File.id > last_id)
+            .order_by(File.id)
+            .limit(batch_size)
+        ).all()
+        db.session.commit()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def zip_stream(entries, directories=()):
+    """
+    Генератор байтов ZIP-архива.
+
+    Args:
+        entries: Итератор пар (имя в архиве, строка файла)
+        directories: Имена каталогов, добавляемых в архив явно
+                     (чтобы сохранить пустые папки)
+    """
+    store = blob_store()
+    block_size = current_app.config['STORAGE_CHUNK_SIZE']
+    level = current_app.config['ARCHIVE_COMPRESS_LEVEL']
+    sink = _ZipSink()
+    used = set()
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=level, allowZip64=True) as archive:
+        for name in directories:
+            used.add(name.casefold())
+            archive.writestr(zipfile.ZipInfo(f'{name}/'), b'')
+        data = sink.drain()
+        if data:
+            yield data
+
+        for name, row in entries:
+            try:
+                source = store.open_plain(row)
+            except FileNotFoundError:
+                logger.warning(f"Archive: file {row.id} is missing in storage")
+                continue
+            with source:
+                chunk = source.read(block_size)
+                # Блоб, сжатый в хранилище, заведомо сжимаем; несжатый
+                # оцениваем по началу содержимого
+                compressible = row.codec is not None or is_compressible(
+                    chunk[:SAMPLE_SIZE], row.size
+                )
+                archive.compression = zipfile.ZIP_DEFLATED if compressible else zipfile.ZIP_STORED
+                name = _unique_name(name, used)
+                # Запись описывается явно, чтобы дата и сжатие не зависели от версии Python
+                entry = zipfile.ZipInfo(name, _date_time(row.uploaded_at))
+                entry.compress_type = archive.compression
+                if ENTRY_COMPRESS_LEVEL:
+                    entry.compress_level = archive.compresslevel
+                else:
+                    # Так же уровень выставляет ZipFile.open(name, 'w')
+                    entry._compresslevel = archive.compresslevel
+                with archive.open(entry, 'w', force_zip64=row.size > ZIP64_THRESHOLD) as dest:
+                    while chunk:
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                        chunk = source.read(block_size)
+            data = sink.drain()
+            if data:
+                yield data
+
+    yield sink.drain()
+
+
+def _folder_names(folder: Folder) -> dict:
+    """Пути папок поддерева внутри архива: {id: 'A/B/C'}"""
+    rows = db.session.execute(
+        select(Folder.id, Folder.name, Folder.path).where(
+            Folder.user_id == folder.user_id,
+            subtree_clause(folder.path),
+            Folder.is_deleted == False
+        )
+    ).all()
+    names = {row.id: row.name for row in rows}
+    paths = {}
+    for row in rows:
+        # Путь от самой папки folder, без ее предков
+        ids = [int(part) for part in row.path.strip('/').split('/')][folder.depth - 1:]
+        if all(i in names for i in ids):
+            paths[row.id] = posixpath.join(*(names[i] for i in ids))
+    return paths
+
+
+def send_zip(body, download_name: str) -> Response:
+    """Потоковый ответ с архивом (длина заранее неизвестна)"""
+    response = Response(
+        stream_with_context(body), mimetype='application/zip', direct_passthrough=True
+    )
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    response.headers.set('Content-Disposition', 'attachment', **_disposition_names(download_name))
+    return response
+
+
+def send_files_archive(criteria: list, download_name: str = 'files.zip') -> Response:
+    """Архив выбранных файлов, все в корне архива"""
+    entries = ((row.filename, row) for row in iter_archive_rows(*criteria))
+    return send_zip(zip_stream(entries), download_name)
+
+
+def send_folder_archive(folder: Folder) -> Response:
+    """Архив папки со всеми вложенными папками и файлами"""
+    paths = _folder_names(folder)
+    rows = iter_archive_rows(
+        File.user_id == folder.user_id,
+        File.is_deleted == False,
+        File.folder_id.in_(subtree_ids(folder, Folder.is_deleted == False))
+    )
+    entries = (
+        (f'{paths[row.folder_id]}/{row.filename}', row)
+        for row in rows if row.folder_id in paths
+    )
+    return send_zip(zip_stream(entries, paths.values()), f'{folder.name}.zip')
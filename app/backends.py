@@ -0,0 +1,379 @@
+"""
+Модуль backends.py - бэкенды хранения данных файлов.
+
+Записи File хранят не абсолютный путь, а ключ относительно бэкенда
+(например, blobs/ab/cd/<sha256>). Бэкенд отвечает только за байты:
+положить локальный файл под ключом, прочитать, проверить, удалить.
+Хеширование, сжатие и учет ссылок остаются в BlobStore и от бэкенда
+не зависят.
+
+Бэкенды:
+- local: один каталог (UPLOAD_FOLDER)
+- sharded: несколько точек монтирования, ключ закрепляется за одной из
+  них рандеву-хешированием
+- s3: S3-совместимое хранилище (AWS, MinIO); требует пакета boto3.
+  Большие файлы загружаются multipart-частями, скачивание может
+  выполняться по подписанной ссылке напрямую из хранилища
+"""
+
+import io
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# Максимум ключей в одном запросе DeleteObjects
+S3_DELETE_BATCH = 1000
+
+
+class ObjectInfo:
+    """
+    Метаданные объекта в хранилище.
+
+    Атрибуты:
+        size (int): Размер в байтах
+        mtime_ns (int): Время изменения, наносекунды от эпохи
+    """
+
+    def __init__(self, size: int, mtime_ns: int):
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+
+class LocalBackend:
+    """Файлы в одном каталоге локальной файловой системы"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, key: str) -> Path:
+        """Путь к файлу на диске (None у бэкендов без локальных файлов)"""
+        return self.root / key
+
+    def accel_path(self, key: str) -> str:
+        """Путь для X-Accel-Redirect относительно DOWNLOAD_ACCEL_PREFIX"""
+        return key
+
+    def exists(self, key: str) -> bool:
+        return self.local_path(key).exists()
+
+    def stat(self, key: str) -> ObjectInfo:
+        """Метаданные объекта; FileNotFoundError, если его нет"""
+        stat = os.stat(self.local_path(key))
+        return ObjectInfo(stat.st_size, stat.st_mtime_ns)
+
+    def open(self, key: str):
+        """Файлоподобный объект для чтения (с поддержкой seek)"""
+        return open(self.local_path(key), 'rb')
+
+    def put_file(self, key: str, source, move: bool = False) -> None:
+        """
+        Кладет локальный файл source под ключ key.
+
+        В пределах одной файловой системы данные не копируются: файл
+        переносится (move=True) или на него ставится жесткая ссылка.
+        """
+        target = self.local_path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if move:
+                os.replace(source, target)
+            else:
+                os.link(source, target)
+            return
+        except FileExistsError:
+            # Жесткая ссылка уже есть: содержимое по ключу идентично
+            return
+        except OSError:
+            pass
+
+        # Другая файловая система - копия через временный файл рядом с целью
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix='.put-')
+        try:
+            with os.fdopen(fd, 'wb') as out, open(source, 'rb') as fh:
+                shutil.copyfileobj(fh, out, 1024 * 1024)
+            os.replace(tmp_path, target)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        if move:
+            os.remove(source)
+
+    def delete(self, keys, workers: int = 1) -> int:
+        """
+        Удаляет объекты, при workers > 1 - параллельно в пуле потоков.
+
+        Отсутствующие объекты не считаются ошибкой, поэтому повторный вызов
+        с теми же ключами безопасен.
+
+        Returns:
+            int: Количество реально удаленных объектов
+        """
+        def remove(key) -> bool:
+            try:
+                os.remove(self.local_path(key))
+                return True
+            except FileNotFoundError:
+                return False
+            except OSError as e:
+                logger.error(f"Unlink error {key}: {str(e)}")
+                return False
+
+        keys = list(keys)
+        if workers <= 1 or len(keys) <= 1:
+            return sum(map(remove, keys))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(remove, keys))
+
+    def presigned_url(self, key: str, **response_headers):
+        """Подписанная ссылка на скачивание; локальный диск их не выдает"""
+        return None
+
+
+class ShardedLocalBackend:
+    """
+    Файлы, распределенные по нескольким точкам монтирования.
+
+    Каждый ключ закрепляется за одним каталогом рандеву-хешированием
+    (наибольший crc32(каталог + ключ)), поэтому при добавлении каталога
+    переезжает только его доля ключей. Объект, который еще не перенесли
+    на новое место, ищется и в остальных каталогах.
+    """
+
+    name = 'sharded'
+
+    def __init__(self, roots):
+        self.shards = [LocalBackend(root) for root in roots]
+
+    def _primary(self, key: str) -> int:
+        return max(
+            range(len(self.shards)),
+            key=lambda i: zlib.crc32(f'{self.shards[i].root}\0{key}'.encode())
+        )
+
+    def _find(self, key: str) -> int:
+        """Индекс каталога, где лежит объект (основной, если его нет нигде)"""
+        primary = self._primary(key)
+        if self.shards[primary].exists(key):
+            return primary
+        for index, shard in enumerate(self.shards):
+            if index != primary and shard.exists(key):
+                return index
+        return primary
+
+    def local_path(self, key: str) -> Path:
+        return self.shards[self._find(key)].local_path(key)
+
+    def accel_path(self, key: str) -> str:
+        # nginx: отдельный internal location на каждый каталог, /<префикс>/<номер>/
+        return f'{self._find(key)}/{key}'
+
+    def exists(self, key: str) -> bool:
+        return any(shard.exists(key) for shard in self.shards)
+
+    def stat(self, key: str) -> ObjectInfo:
+        return self.shards[self._find(key)].stat(key)
+
+    def open(self, key: str):
+        return self.shards[self._find(key)].open(key)
+
+    def put_file(self, key: str, source, move: bool = False) -> None:
+        self.shards[self._primary(key)].put_file(key, source, move)
+
+    def delete(self, keys, workers: int = 1) -> int:
+        keys = list(keys)
+        return sum(shard.delete(keys, workers) for shard in self.shards)
+
+    def presigned_url(self, key: str, **response_headers):
+        return None
+
+
+class S3Reader(io.RawIOBase):
+    """
+    Чтение объекта S3 как файла.
+
+    Данные читаются потоком одного GET-запроса; seek на другую позицию
+    закрывает текущий поток, и следующее чтение начинается запросом с
+    заголовком Range.
+    """
+
+    def __init__(self, client, bucket: str, key: str):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._body = None
+        self._position = 0
+        self._size = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        else:
+            if self._size is None:
+                self._size = self._client.head_object(
+                    Bucket=self._bucket, Key=self._key
+                )['ContentLength']
+            position = self._size + offset
+        if position != self._position:
+            self._close_body()
+            self._position = max(position, 0)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._body is None:
+            params = {'Bucket': self._bucket, 'Key': self._key}
+            if self._position:
+                params['Range'] = f'bytes={self._position}-'
+            try:
+                self._body = self._client.get_object(**params)['Body']
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'InvalidRange':
+                    return 0
+                raise
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _close_body(self) -> None:
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self) -> None:
+        self._close_body()
+        super().close()
+
+
+class S3Backend:
+    """Объекты в бакете S3-совместимого хранилища"""
+
+    name = 's3'
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = None,
+                 region: str = None, multipart_threshold: int = 64 * 1024 * 1024,
+                 multipart_chunksize: int = 16 * 1024 * 1024, presign_ttl: int = 300):
+        if boto3 is None:
+            raise RuntimeError('Для бэкенда хранения s3 нужен пакет boto3')
+        if not bucket:
+            raise RuntimeError('Для бэкенда хранения s3 не задан S3_BUCKET')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_ttl = presign_ttl
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize
+        )
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}{key}'
+
+    def local_path(self, key: str):
+        return None
+
+    def accel_path(self, key: str):
+        return None
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stat(self, key: str) -> ObjectInfo:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(key) from None
+            raise
+        return ObjectInfo(head['ContentLength'], int(head['LastModified'].timestamp() * 1e9))
+
+    def open(self, key: str):
+        return S3Reader(self.client, self.bucket, self._key(key))
+
+    def put_file(self, key: str, source, move: bool = False) -> None:
+        """Загружает файл, большие файлы - параллельными multipart-частями"""
+        self.client.upload_file(str(source), self.bucket, self._key(key), Config=self.transfer)
+        if move:
+            os.remove(source)
+
+    def delete(self, keys, workers: int = 1) -> int:
+        keys = [self._key(key) for key in keys]
+        deleted = 0
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            batch = keys[start:start + S3_DELETE_BATCH]
+            result = self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in batch],
+                'Quiet': True
+            })
+            for error in result.get('Errors', []):
+                logger.error(f"S3 delete error {error['Key']}: {error['Message']}")
+            deleted += len(batch) - len(result.get('Errors', []))
+        return deleted
+
+    def presigned_url(self, key: str, **response_headers) -> str:
+        """
+        Подписанная ссылка на скачивание объекта напрямую из хранилища.
+
+        Args:
+            **response_headers: Переопределения заголовков ответа S3
+                                (ResponseContentDisposition, ResponseContentType, ...)
+        """
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._key(key), **response_headers},
+            ExpiresIn=self.presign_ttl
+        )
+
+
+def make_backend(config):
+    """Создает бэкенд по настройке STORAGE_BACKEND"""
+    kind = config['STORAGE_BACKEND']
+    if kind == 'local':
+        return LocalBackend(config['UPLOAD_FOLDER'])
+    if kind == 'sharded':
+        return ShardedLocalBackend(config['STORAGE_ROOTS'] or [config['UPLOAD_FOLDER']])
+    if kind == 's3':
+        return S3Backend(
+            bucket=config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+            multipart_chunksize=config['S3_MULTIPART_CHUNKSIZE'],
+            presign_ttl=config['S3_PRESIGN_TTL']
+        )
+    raise RuntimeError(f'Неизвестный бэкенд хранения: {kind}')
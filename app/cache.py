@@ -0,0 +1,122 @@
+"""
+Модуль cache.py - кэши приложения.
+
+TTLCache хранит ограниченное число записей (вытесняет давно не
+использованные) и забывает каждую запись через заданное время.
+Подходит для данных, которые допустимо показывать слегка устаревшими:
+счетчиков, результатов частых запросов.
+
+RedisCache - общий для всех процессов кэш с тем же интерфейсом в Redis
+или совместимом сервере (KeyDB, Valkey); требует пакета redis. Если
+CACHE_REDIS_URL не задан, его роль выполняет внутрипроцессный TTLCache.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с временем жизни записей"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def get_or_set(self, key, factory, ttl: float = None):
+        """Возвращает значение из кэша или вычисляет и сохраняет его"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Кэш в Redis: значения сериализуются в JSON, ключи получают общий префикс.
+
+    Недоступность сервера не считается ошибкой: чтение возвращает промах,
+    запись и удаление пропускаются, а данные берутся из базы.
+    """
+
+    def __init__(self, url: str, prefix: str = 'filescloud:', ttl: float = 60.0):
+        if redis is None:
+            raise RuntimeError('Для CACHE_REDIS_URL нужен пакет redis')
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(f'{self.prefix}{key}')
+        except redis.RedisError as e:
+            logger.warning(f"Redis get error: {str(e)}")
+            return default
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl: float = None) -> None:
+        try:
+            self.client.set(
+                f'{self.prefix}{key}', json.dumps(value),
+                px=int((self.ttl if ttl is None else ttl) * 1000)
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Redis set error: {str(e)}")
+
+    def delete(self, key) -> None:
+        try:
+            self.client.delete(f'{self.prefix}{key}')
+        except redis.RedisError as e:
+            logger.warning(f"Redis delete error: {str(e)}")
+
+
+def make_shared_cache(config):
+    """Общий кэш процессов: Redis по CACHE_REDIS_URL или внутрипроцессная замена"""
+    if config['CACHE_REDIS_URL']:
+        return RedisCache(config['CACHE_REDIS_URL'], prefix=config['CACHE_KEY_PREFIX'])
+    return TTLCache(maxsize=100000)
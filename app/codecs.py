@@ -0,0 +1,126 @@
+"""
+Модуль codecs.py - сжатие блобов на диске.
+
+Кодек выбирается настройкой STORAGE_CODEC ('zstd', 'gzip' или None).
+Решение, сжимать ли конкретный файл, принимается по первым SAMPLE_SIZE
+байтам: для уже сжатых данных (jpg, png, pdf, docx/xlsx - это zip)
+энтропия близка к 8 бит/байт, и такие файлы хранятся как есть.
+
+zstd требует пакета zstandard; без него используется gzip из
+стандартной библиотеки.
+"""
+
+import gzip
+import logging
+import math
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Объем данных для оценки сжимаемости
+SAMPLE_SIZE = 64 * 1024
+# Файлы меньше этого размера не сжимаются: выигрыш меньше заголовков
+MIN_COMPRESS_SIZE = 1024
+# Порог энтропии (бит на байт), выше которого данные считаются сжатыми
+ENTROPY_THRESHOLD = 7.5
+
+
+class _GzipReader(gzip.GzipFile):
+    """GzipFile, который закрывает и переданный ему поток"""
+
+    def __init__(self, fh):
+        super().__init__(fileobj=fh, mode='rb')
+        self._source = fh
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+class GzipCodec:
+    name = 'gzip'
+    encoding = 'gzip'  # значение Content-Encoding
+    suffix = '.gz'
+
+    def compressor(self, level: int):
+        """Объект с методами compress(data) и flush()"""
+        return zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def open(self, fh):
+        """
+        Файлоподобный объект с распакованным содержимым (seek только вперед).
+
+        Закрывает fh вместе с собой.
+        """
+        return _GzipReader(fh)
+
+
+class ZstdCodec:
+    name = 'zstd'
+    encoding = 'zstd'
+    suffix = '.zst'
+
+    def compressor(self, level: int):
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    def open(self, fh):
+        return zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+
+
+CODECS = {'gzip': GzipCodec()}
+if zstandard is not None:
+    CODECS['zstd'] = ZstdCodec()
+
+
+# Суффиксы файлов блобов для всех кодеков, включая недоступные в этой
+# установке: блоб, записанный другим процессом, все равно нужно найти и удалить
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def get_codec(name: str):
+    """
+    Кодек сохраненного блоба по имени.
+
+    Returns:
+        Кодек или None для блобов без сжатия
+    """
+    if not name:
+        return None
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise RuntimeError(f'Кодек хранилища {name} недоступен') from None
+
+
+def storage_codec(name: str):
+    """Кодек для новых блобов по настройке STORAGE_CODEC"""
+    if name == 'zstd' and name not in CODECS:
+        logger.warning("zstandard is not installed, falling back to gzip")
+        name = 'gzip'
+    return get_codec(name)
+
+
+def entropy(sample: bytes) -> float:
+    """Энтропия Шеннона в битах на байт"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(
+        count / total * math.log2(count / total)
+        for count in Counter(sample).values()
+    )
+
+
+def is_compressible(sample: bytes, total_size: int = None) -> bool:
+    """Стоит ли сжимать файл, начало которого - sample"""
+    if (total_size if total_size is not None else len(sample)) < MIN_COMPRESS_SIZE:
+        return False
+    return entropy(sample[:SAMPLE_SIZE]) < ENTROPY_THRESHOLD
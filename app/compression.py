@@ -0,0 +1,58 @@
+"""
+Модуль compression.py - сжатие JSON-ответов API.
+
+Списки файлов в JSON хорошо сжимаются (повторяющиеся ключи и пути),
+поэтому ответы от COMPRESS_MIN_SIZE байт отдаются в brotli или gzip -
+что клиент указал в Accept-Encoding. Для brotli нужен пакет brotli,
+без него используется gzip. Потоковые ответы (архивы, файлы) и уже
+закодированные ответы не трогаются.
+"""
+
+import gzip
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Меньшие ответы помещаются в один пакет и без сжатия
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+# Качество 5 - близко к gzip -9 по размеру при скорости gzip -6
+BROTLI_QUALITY = 5
+
+
+def _encoding() -> str:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] > 0:
+        return 'br'
+    if accepted['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """Сжимает JSON-ответ, если клиент это поддерживает (after_request)"""
+    if not current_app.config['API_COMPRESSION']:
+        return response
+    if (response.is_streamed or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = _encoding()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,213 @@
+"""
+Модуль database.py - настройка подключений к базе данных.
+
+SQLite:
+- журнал WAL: читатели не блокируют писателя и наоборот, запись
+  конкурирует только с другой записью
+- synchronous=NORMAL: в режиме WAL fsync выполняется при контрольной
+  точке, а не при каждом коммите; после сбоя питания могут потеряться
+  последние транзакции, но база остается целостной
+- busy_timeout: соединение ждет освобождения блокировки записи вместо
+  немедленной ошибки "database is locked"
+- mmap: чтение страниц базы без копирования через отображение в память
+
+PostgreSQL: размер пула и переполнения, проверка соединения перед выдачей
+из пула (pre-ping) и пересоздание старых соединений, которые мог закрыть
+PgBouncer или балансировщик.
+
+Если задан DATABASE_REPLICA_URL, SELECT-запросы маршрутов, помеченных
+декоратором read_only, идут на реплику. Пользователь, который только что
+что-то записал, DB_REPLICA_STICKY секунд читает с основной базы, чтобы
+после загрузки сразу увидеть свой файл несмотря на отставание реплики.
+
+Буферы отложенной записи (счетчики скачиваний, время входа) сбрасываются
+в базу фоновым потоком BufferFlusher.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# Ключ реплики в SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+def _normalize_url(url: str) -> str:
+    # Heroku и многие панели выдают схему postgres://, которую SQLAlchemy 2 не принимает
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(config, url: str) -> dict:
+    """Параметры create_engine для базы по адресу url"""
+    if make_url(url).get_backend_name() == 'sqlite':
+        # Пулом SQLite управляет Flask-SQLAlchemy, тонкая настройка - PRAGMA
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas(config) -> list:
+    """PRAGMA, выполняемые на каждом новом соединении SQLite"""
+    pragmas = []
+    if config['SQLITE_JOURNAL_MODE']:
+        pragmas.append(('journal_mode', config['SQLITE_JOURNAL_MODE']))
+    if config['SQLITE_SYNCHRONOUS']:
+        pragmas.append(('synchronous', config['SQLITE_SYNCHRONOUS']))
+    pragmas.append(('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT'] * 1000)))
+    if config['SQLITE_MMAP_SIZE']:
+        pragmas.append(('mmap_size', config['SQLITE_MMAP_SIZE']))
+    return pragmas
+
+
+def configure_database(app) -> None:
+    """
+    Заполняет параметры Flask-SQLAlchemy из настроек DB_* и SQLITE_*.
+
+    Вызывается до db.init_app.
+    """
+    config = app.config
+    config['SQLALCHEMY_DATABASE_URI'] = _normalize_url(config['SQLALCHEMY_DATABASE_URI'])
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(config, config['SQLALCHEMY_DATABASE_URI']),
+        **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+
+    replica_url = _normalize_url(config['DATABASE_REPLICA_URL'])
+    if replica_url:
+        config['SQLALCHEMY_BINDS'] = {
+            **config.get('SQLALCHEMY_BINDS', {}),
+            REPLICA_BIND: {'url': replica_url, **engine_options(config, replica_url)},
+        }
+
+        @app.after_request
+        def remember_write(response):
+            if g.get('db_wrote'):
+                session['db_primary_until'] = time.time() + config['DB_REPLICA_STICKY']
+            return response
+
+
+def init_engines(app, db) -> None:
+    """Подключает PRAGMA к созданным движкам SQLite; вызывается после db.init_app"""
+    pragmas = sqlite_pragmas(app.config)
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # Для базы в памяти WAL и mmap не имеют смысла
+            if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+                event.listen(engine, 'connect', on_connect)
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая чтение маршрутов read_only на реплику"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                if getattr(clause, 'is_select', False):
+                    if g.get('db_read_only'):
+                        return replica
+                else:
+                    # Сброс изменений и UPDATE/DELETE/INSERT
+                    g.db_wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """
+    Декоратор маршрута, который только читает из базы.
+
+    Его SELECT-запросы выполняются на реплике, если она настроена и
+    пользователь недавно ничего не записывал.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.db_read_only = session.get('db_primary_until', 0) < time.time()
+        return view(*args, **kwargs)
+    return wrapped
+
+
+class BufferFlusher:
+    """
+    Фоновая запись буфера в базу: раз в interval секунд и при завершении
+    процесса (atexit).
+
+    Поток запускается при первом обращении к буферу в процессе, то есть
+    уже после fork воркера gunicorn, и работает в контексте приложения,
+    из которого был запущен. Данные теряются только при аварийной
+    остановке процесса - не больше, чем накопилось за один интервал.
+    """
+
+    def __init__(self, flush, name: str):
+        self._flush = flush
+        self._name = name
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pid = None
+        self._app = None
+        self._at_exit = False
+
+    def start(self, app, interval: float) -> None:
+        """Запускает поток в текущем процессе, если он еще не запущен"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._app = app
+            self._stopped = threading.Event()
+            threading.Thread(
+                target=self._run, args=(interval, self._stopped),
+                name=self._name, daemon=True
+            ).start()
+            if not self._at_exit:
+                atexit.register(self.stop)
+                self._at_exit = True
+
+    def _run(self, interval: float, stopped: threading.Event) -> None:
+        while not stopped.wait(interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Записывает буфер сейчас"""
+        if self._app is None:
+            return
+        try:
+            with self._app.app_context():
+                self._flush()
+        except Exception as e:
+            logger.error(f"{self._name} flush error: {str(e)}")
+
+    def stop(self) -> None:
+        """Останавливает поток и записывает остаток буфера"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._stopped.set()
+            self._pid = None
+        self.flush()
+        self._app = None
@@ -0,0 +1,342 @@
+"""
+Модуль downloads.py - отдача сохраненных файлов клиенту.
+
+Поддерживает:
+- Частичные запросы Range/If-Range, включая несколько диапазонов
+  (multipart/byteranges)
+- Строгие ETag на основе хеша содержимого и ответы 304 на
+  If-None-Match/If-Modified-Since
+- Передачу отдачи байтов обратному прокси через X-Accel-Redirect (nginx)
+  или X-Sendfile (Apache, lighttpd), чтобы воркер не занимался копированием
+- Для бэкенда S3 - перенаправление на подписанную ссылку, чтобы байты
+  шли клиенту напрямую из хранилища
+- Сжатые на диске блобы: как есть с Content-Encoding или с распаковкой на лету,
+  всегда целиком (Accept-Ranges: none) - диапазон пришлось бы распаковывать
+  с начала блоба
+- Content-Type из File.mime_type, определенного по содержимому при загрузке
+"""
+
+import mimetypes
+import os
+import unicodedata
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request, current_app, abort, redirect
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+from app.backends import ObjectInfo
+from app.codecs import get_codec
+from app.models import File
+from app.storage import blob_store
+
+# Больше диапазонов в одном запросе не обрабатываем и отдаем файл целиком:
+# RFC 9110 разрешает игнорировать Range, а тысячи мелких диапазонов - это
+# способ заставить сервер делать много мелких чтений
+MAX_RANGES = 16
+
+
+def _file_etag(file: File, info: ObjectInfo) -> str:
+    if file.content_hash:
+        return file.content_hash
+    return f'{info.mtime_ns:x}-{info.size:x}'
+
+
+def _last_modified(file: File, info: ObjectInfo) -> datetime:
+    if file.uploaded_at:
+        value = file.uploaded_at.replace(tzinfo=timezone.utc)
+    else:
+        value = datetime.fromtimestamp(info.mtime, timezone.utc)
+    # HTTP-даты имеют точность до секунды
+    return value.replace(microsecond=0)
+
+
+def _disposition_names(download_name: str) -> dict:
+    """Параметры Content-Disposition с поддержкой не-ASCII имен (RFC 6266)"""
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name)
+        simple = simple.encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(download_name, safe="!#$&+^`|~")
+        return {'filename': simple, 'filename*': f"UTF-8''{quoted}"}
+    return {'filename': download_name}
+
+
+def parse_byte_ranges(header: str, size: int):
+    """
+    Разбирает значение заголовка Range для файла размером size.
+
+    В отличие от werkzeug.http.parse_range_header допускает диапазоны
+    в произвольном порядке и с перекрытиями, как разрешает RFC 9110.
+
+    Returns:
+        list: выполнимые диапазоны [(start, stop), ...] в исходном порядке
+        None: заголовок синтаксически некорректен и должен игнорироваться
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+
+    spans = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start, stop = max(size - suffix, 0), size
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else size
+                if start < 0 or (last and stop <= start):
+                    return None
+                stop = min(stop, size)
+        except ValueError:
+            return None
+        if start < stop:
+            spans.append((start, stop))
+    return spans
+
+
+def requested_ranges(size: int, etag: str, last_modified: datetime):
+    """
+    Разбирает заголовки Range/If-Range текущего запроса.
+
+    Returns:
+        None: отдать файл целиком
+        list: непересекающиеся диапазоны [(start, stop), ...] по возрастанию;
+              пустой список - ни один диапазон не выполним (416)
+    """
+    if request.method not in ('GET', 'HEAD') or 'Range' not in request.headers or not size:
+        return None
+
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and last_modified > if_range.date:
+        return None
+
+    spans = parse_byte_ranges(request.headers['Range'], size)
+    if spans is None:
+        return None
+
+    merged = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def is_download_start(response: Response, size: int) -> bool:
+    """
+    Начинает ли ответ новое скачивание (для учета скачиваний общих ссылок).
+
+    Засчитываются полная отдача файла и первый запрос докачки - диапазон с
+    нулевого байта. HEAD, 304, 416 и продолжение скачивания с середины
+    файла (докачка, параллельные диапазоны) не засчитываются. При отдаче
+    через прокси или подписанную ссылку Range обрабатывает не приложение,
+    поэтому он разбирается здесь.
+    """
+    if request.method == 'HEAD' or response.status_code not in (200, 206, 302):
+        return False
+    delegated = response.status_code == 302 or 'X-Accel-Redirect' in response.headers \
+        or 'X-Sendfile' in response.headers
+    if response.status_code == 200 and not delegated:
+        return True
+    spans = parse_byte_ranges(request.headers['Range'], size) \
+        if 'Range' in request.headers else None
+    if spans is None:
+        return True
+    return any(start == 0 for start, _ in spans)
+
+
+def _read_span(fh, start: int, stop: int, block_size: int):
+    fh.seek(start)
+    remaining = stop - start
+    while remaining:
+        data = fh.read(min(block_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _single_range_body(opener, start: int, stop: int, block_size: int):
+    with opener() as fh:
+        yield from _read_span(fh, start, stop, block_size)
+
+
+def _multi_range_body(opener, parts: list, closing: bytes, block_size: int):
+    # Диапазоны идут по возрастанию: файл читается только вперед
+    with opener() as fh:
+        for header, (start, stop) in parts:
+            yield header
+            yield from _read_span(fh, start, stop, block_size)
+            yield b'\r\n'
+    yield closing
+
+
+def _offload(response: Response, backend, key: str) -> bool:
+    """Передает отдачу файла обратному прокси, если это включено в конфиге"""
+    mode = current_app.config['DOWNLOAD_OFFLOAD']
+    if mode == 'x-accel' and backend.accel_path(key) is not None:
+        prefix = current_app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{prefix}/{backend.accel_path(key)}'
+        return True
+    if mode == 'x-sendfile' and backend.local_path(key) is not None:
+        response.headers['X-Sendfile'] = str(backend.local_path(key))
+        return True
+    return False
+
+
+def _presigned_redirect(response: Response, backend, key: str):
+    """
+    Перенаправление на подписанную ссылку бэкенда, если он их выдает.
+
+    Заголовки, которые иначе поставили бы мы сами, передаются хранилищу
+    параметрами подписи, чтобы клиент получил тот же ответ.
+    """
+    if not current_app.config['S3_PRESIGNED_DOWNLOADS']:
+        return None
+    headers = {
+        'ResponseContentType': response.mimetype,
+        'ResponseContentDisposition': response.headers['Content-Disposition'],
+        'ResponseCacheControl': response.headers['Cache-Control'],
+    }
+    if response.content_encoding:
+        headers['ResponseContentEncoding'] = response.content_encoding
+    url = backend.presigned_url(key, **headers)
+    if url is None:
+        return None
+    location = redirect(url, 302)
+    location.cache_control.private = True
+    location.cache_control.no_store = True
+    return location
+
+
+def send_stored_file(file: File, download_name: str, as_attachment: bool = True) -> Response:
+    """
+    Отдает содержимое файла с поддержкой условных и частичных запросов.
+
+    Args:
+        file (File): Запись о файле
+        download_name (str): Имя файла для Content-Disposition
+        as_attachment (bool): Скачивание (True) или показ в браузере
+
+    Returns:
+        Response: 200, 206, 302, 304 или 416
+    """
+    key = file.storage_path
+    backend = blob_store().backend_for(file)
+    try:
+        info = backend.stat(key)
+    except FileNotFoundError:
+        abort(404)
+
+    # Сжатый блоб отдается как есть с Content-Encoding, если клиент его
+    # принимает, иначе распаковывается на лету. Range для него игнорируется
+    # (RFC 9110 это разрешает): диапазон из середины потребовал бы
+    # распаковки блоба с нулевого байта на каждый запрос докачки
+    codec = get_codec(file.codec)
+    encoded = codec is not None and request.accept_encodings[codec.encoding] > 0
+
+    size = file.size if codec is not None and not encoded else info.size
+    etag = _file_etag(file, info)
+    if encoded:
+        etag = f'{etag}-{codec.encoding}'
+    last_modified = _last_modified(file, info)
+    # Тип определен по содержимому при загрузке; для старых файлов - по имени
+    mimetype = file.mime_type or mimetypes.guess_type(download_name)[0] \
+        or 'application/octet-stream'
+
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.accept_ranges = 'bytes' if codec is None else 'none'
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    # Браузер не должен переопределять тип, проверенный при загрузке
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers.set(
+        'Content-Disposition',
+        'attachment' if as_attachment else 'inline',
+        **_disposition_names(download_name)
+    )
+    if codec is not None:
+        response.vary.add('Accept-Encoding')
+    if encoded:
+        response.content_encoding = codec.encoding
+
+    if request.method in ('GET', 'HEAD') and not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        response.status_code = 304
+        return response
+
+    # Диапазоны и повторные проверки в режиме offload и при переходе по
+    # подписанной ссылке выполняет прокси или хранилище; сжатые блобы
+    # они не распакуют и отдали бы диапазон сжатых байтов, такие запросы
+    # обслуживаем сами
+    if codec is None or (encoded and 'Range' not in request.headers):
+        location = _presigned_redirect(response, backend, key)
+        if location is not None:
+            return location
+    if codec is None and _offload(response, backend, key):
+        return response
+
+    if codec is None or encoded:
+        def opener():
+            return backend.open(key)
+    else:
+        def opener():
+            return codec.open(backend.open(key))
+
+    block_size = current_app.config['STORAGE_CHUNK_SIZE']
+    ranges = requested_ranges(size, etag, last_modified) if codec is None else None
+
+    if ranges is None:
+        response.response = wrap_file(request.environ, opener(), block_size)
+        response.content_length = size
+        return response
+
+    if not ranges:
+        response.status_code = 416
+        response.content_range = ContentRange('bytes', None, None, size)
+        return response
+
+    response.status_code = 206
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response.response = _single_range_body(opener, start, stop, block_size)
+        response.content_range = ContentRange('bytes', start, stop, size)
+        response.content_length = stop - start
+        return response
+
+    boundary = os.urandom(16).hex()
+    parts = []
+    length = 0
+    for start, stop in ranges:
+        header = (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+        ).encode('latin-1')
+        parts.append((header, (start, stop)))
+        length += len(header) + (stop - start) + 2
+    closing = f'--{boundary}--\r\n'.encode('latin-1')
+
+    response.response = _multi_range_body(opener, parts, closing, block_size)
+    response.content_type = f'multipart/byteranges; boundary={boundary}'
+    response.content_length = length + len(closing)
+    return response
@@ -0,0 +1,405 @@
+"""
+Модуль folders.py - папки пользователей и операции над поддеревьями.
+
+Папка хранит материализованный путь из идентификаторов (/1/5/9/), поэтому:
+- поддерево - это диапазон path >= '/1/5/' AND path < '/1/50' по индексу
+- перенос поддерева - один UPDATE, переписывающий префикс path у всех
+  потомков; переименование меняет одну строку
+- предки папки известны из ее path без рекурсивных запросов, и агрегаты
+  (file_count, total_size) обновляются одним UPDATE ... WHERE id IN (предки)
+- удаление в корзину и восстановление поддерева - по одному UPDATE на
+  таблицы folders и files
+
+Агрегаты, как и bytes_used пользователя, учитывают файлы в корзине, так
+что меняются только при появлении, переносе и окончательном удалении
+файлов. Все удаленное вместе поддерево получает общий deleted_at, по
+которому восстановление отличает его от удаленного раньше по отдельности.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, case, delete, exists, func, literal, select, update
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import File, Folder
+from app.quota import adjust_usage
+from app.users import touch_user
+from app.sharing import delete_folder_shares
+
+# Предел вложенности: длина path ограничена размером колонки
+FOLDER_MAX_DEPTH = 32
+# Папок, удаляемых одним запросом (ограничение на число параметров)
+DELETE_BATCH_SIZE = 500
+
+
+class FolderError(ValueError):
+    """Операция с папкой невозможна; текст ошибки показывается пользователю"""
+
+
+def subtree_clause(path: str, column=Folder.path):
+    """Условие "column лежит в поддереве с путем path" (включая саму папку)"""
+    # Символ '0' идет сразу за '/', так что верхняя граница отсекает
+    # соседние ветки вроде /1/50/ при path = /1/5/
+    return and_(column >= path, column < path[:-1] + '0')
+
+
+def subtree_ids(folder: Folder, *criteria):
+    """Подзапрос идентификаторов папок поддерева"""
+    return select(Folder.id).where(
+        Folder.user_id == folder.user_id, subtree_clause(folder.path), *criteria
+    )
+
+
+def get_folder(user_id: int, folder_id, is_deleted: bool = False):
+    """Папка пользователя или None (в том числе для folder_id=None - корня)"""
+    if folder_id is None:
+        return None
+    return Folder.query.filter_by(
+        id=folder_id, user_id=user_id, is_deleted=is_deleted
+    ).first()
+
+
+def list_children(user_id: int, parent_id=None) -> list:
+    """Подпапки одной папки по индексу ix_folders_children"""
+    return Folder.query.filter_by(
+        user_id=user_id, parent_id=parent_id, is_deleted=False
+    ).order_by(Folder.name).all()
+
+
+def breadcrumbs(folder) -> list:
+    """Цепочка папок от корня до folder включительно"""
+    if folder is None:
+        return []
+    ancestors = Folder.query.filter(Folder.id.in_(folder.ancestor_ids)).all()
+    return sorted(ancestors, key=lambda item: item.depth) + [folder]
+
+
+def _check_name(user_id: int, parent_id, name: str, exclude_id: int = None) -> str:
+    name = (name or '').strip()
+    if not name or '/' in name or len(name) > 256:
+        raise FolderError('Недопустимое имя папки')
+    query = Folder.query.filter_by(
+        user_id=user_id, parent_id=parent_id, name=name, is_deleted=False
+    )
+    if exclude_id is not None:
+        query = query.filter(Folder.id != exclude_id)
+    if query.first() is not None:
+        raise FolderError('Папка с таким именем уже существует')
+    return name
+
+
+def create_folder(user_id: int, name: str, parent: Folder = None) -> Folder:
+    """Создает папку (без коммита)"""
+    depth = parent.depth + 1 if parent else 1
+    if depth > FOLDER_MAX_DEPTH:
+        raise FolderError('Слишком глубокая вложенность папок')
+    folder = Folder(
+        user_id=user_id,
+        parent_id=parent.id if parent else None,
+        name=_check_name(user_id, parent.id if parent else None, name),
+        path='',
+        depth=depth
+    )
+    db.session.add(folder)
+    db.session.flush()
+    folder.path = f'{parent.path if parent else "/"}{folder.id}/'
+    db.session.flush()
+    touch_user(user_id)
+    return folder
+
+
+def rename_folder(folder: Folder, name: str) -> None:
+    """Переименовывает папку; потомков это не затрагивает (путь состоит из id)"""
+    folder.name = _check_name(folder.user_id, folder.parent_id, name, exclude_id=folder.id)
+    touch_user(folder.user_id)
+
+
+def _chain(folder) -> list:
+    return folder.ancestor_ids + [folder.id] if folder is not None else []
+
+
+def adjust_folder_totals(folder, file_count: int, total_size: int) -> None:
+    """Изменяет агрегаты папки и всех ее предков одним UPDATE"""
+    ids = _chain(folder)
+    if not ids or not (file_count or total_size):
+        return
+    db.session.execute(
+        update(Folder).where(Folder.id.in_(ids)).values(
+            file_count=Folder.file_count + file_count,
+            total_size=Folder.total_size + total_size
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def adjust_folder_totals_many(deltas: dict) -> None:
+    """
+    Пакетный вариант adjust_folder_totals.
+
+    Args:
+        deltas (dict): folder_id -> (изменение file_count, изменение total_size)
+                       для файлов, лежащих непосредственно в папке
+    """
+    deltas = {folder_id: delta for folder_id, delta in deltas.items() if folder_id is not None}
+    if not deltas:
+        return
+    totals = defaultdict(lambda: [0, 0])
+    for folder_id, path in db.session.execute(
+        select(Folder.id, Folder.path).where(Folder.id.in_(deltas))
+    ):
+        count, size = deltas[folder_id]
+        for ancestor_id in path.strip('/').split('/'):
+            totals[int(ancestor_id)][0] += count
+            totals[int(ancestor_id)][1] += size
+
+    params = [{'folder_id': folder_id, 'd_count': count, 'd_size': size}
+              for folder_id, (count, size) in totals.items() if count or size]
+    if not params:
+        return
+    folders = Folder.__table__
+    db.session.execute(
+        update(folders).where(folders.c.id == bindparam('folder_id')).values(
+            file_count=folders.c.file_count + bindparam('d_count'),
+            total_size=folders.c.total_size + bindparam('d_size')
+        ),
+        params
+    )
+
+
+def file_totals_by_folder(*criteria) -> dict:
+    """Количество и объем файлов, подходящих под criteria, по их папкам"""
+    return {
+        folder_id: (count, size)
+        for folder_id, count, size in db.session.execute(
+            select(File.folder_id, func.count(), func.coalesce(func.sum(File.size), 0))
+            .where(*criteria).group_by(File.folder_id)
+        )
+    }
+
+
+def move_files(criteria: list, target: Folder = None) -> int:
+    """
+    Переносит файлы в папку target (None - в корень) без коммита.
+
+    Returns:
+        int: Количество перенесенных файлов
+    """
+    target_id = target.id if target else None
+    criteria = list(criteria) + [
+        File.folder_id.is_not(None) if target_id is None else
+        (File.folder_id.is_(None) | (File.folder_id != target_id))
+    ]
+    moved = file_totals_by_folder(*criteria)
+    if not moved:
+        return 0
+    db.session.execute(
+        update(File).where(*criteria).values(folder_id=target_id)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_folder_totals_many({
+        folder_id: (-count, -size) for folder_id, (count, size) in moved.items()
+    })
+    count = sum(count for count, _ in moved.values())
+    adjust_folder_totals(target, count, sum(size for _, size in moved.values()))
+    return count
+
+
+def move_folder(folder: Folder, target: Folder = None) -> None:
+    """
+    Переносит папку со всем поддеревом в target (None - в корень).
+
+    Пути и глубина всех потомков переписываются одним UPDATE по
+    диапазону path, файлы не затрагиваются вовсе.
+    """
+    if target is not None and target.path.startswith(folder.path):
+        raise FolderError('Нельзя переместить папку внутрь самой себя')
+    target_id = target.id if target else None
+    if target_id == folder.parent_id:
+        return
+    _check_name(folder.user_id, target_id, folder.name, exclude_id=folder.id)
+
+    depth_delta = (target.depth + 1 if target else 1) - folder.depth
+    deepest = db.session.scalar(
+        select(func.max(Folder.depth)).where(
+            Folder.user_id == folder.user_id, subtree_clause(folder.path)
+        )
+    )
+    if deepest + depth_delta > FOLDER_MAX_DEPTH:
+        raise FolderError('Слишком глубокая вложенность папок')
+
+    # Агрегаты: поддерево уходит из старой цепочки предков и добавляется в новую
+    old_parent_ids = folder.ancestor_ids
+    if old_parent_ids:
+        db.session.execute(
+            update(Folder).where(Folder.id.in_(old_parent_ids)).values(
+                file_count=Folder.file_count - folder.file_count,
+                total_size=Folder.total_size - folder.total_size
+            ).execution_options(synchronize_session=False)
+        )
+    adjust_folder_totals(target, folder.file_count, folder.total_size)
+
+    old_prefix = folder.path
+    new_prefix = f'{target.path if target else "/"}{folder.id}/'
+    db.session.execute(
+        update(Folder).where(
+            Folder.user_id == folder.user_id, subtree_clause(old_prefix)
+        ).values(
+            path=literal(new_prefix) + func.substr(Folder.path, len(old_prefix) + 1),
+            depth=Folder.depth + depth_delta,
+            parent_id=case((Folder.id == folder.id, target_id), else_=Folder.parent_id)
+        ).execution_options(synchronize_session=False)
+    )
+    touch_user(folder.user_id)
+    db.session.expire(folder)
+
+
+def _update_files_returning_sizes(criteria: list, **values) -> list:
+    stmt = update(File).where(*criteria).values(**values).execution_options(
+        synchronize_session=False
+    )
+    if db.engine.dialect.update_returning:
+        return db.session.execute(stmt.returning(File.size)).scalars().all()
+    sizes = db.session.scalars(select(File.size).where(*criteria)).all()
+    db.session.execute(stmt)
+    return sizes
+
+
+def trash_folder(folder: Folder) -> int:
+    """
+    Перемещает папку со всем содержимым в корзину (без коммита).
+
+    Returns:
+        int: Количество файлов, перемещенных в корзину
+    """
+    now = datetime.utcnow()
+    live = subtree_ids(folder, Folder.is_deleted == False)
+    sizes = _update_files_returning_sizes(
+        [File.user_id == folder.user_id, File.folder_id.in_(live), File.is_deleted == False],
+        is_deleted=True, deleted_at=now
+    )
+    db.session.execute(
+        update(Folder).where(
+            Folder.user_id == folder.user_id,
+            subtree_clause(folder.path),
+            Folder.is_deleted == False
+        ).values(is_deleted=True, deleted_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_usage(folder.user_id, file_count=-len(sizes),
+                 trash_bytes=sum(sizes), trash_count=len(sizes))
+    db.session.expire(folder)
+    return len(sizes)
+
+
+def restore_folder(folder: Folder) -> int:
+    """
+    Восстанавливает папку из корзины вместе с тем, что было удалено с ней.
+
+    Файлы и подпапки, удаленные раньше по отдельности, остаются в корзине.
+    Если родительская папка тоже в корзине, папка восстанавливается в корень.
+
+    Returns:
+        int: Количество восстановленных файлов
+    """
+    stamp = folder.deleted_at
+    if folder.parent_id is not None and get_folder(folder.user_id, folder.parent_id) is None:
+        move_folder(folder, None)
+
+    trashed_with = subtree_ids(folder, Folder.is_deleted == True, Folder.deleted_at == stamp)
+    sizes = _update_files_returning_sizes(
+        [File.user_id == folder.user_id, File.folder_id.in_(trashed_with),
+         File.is_deleted == True, File.deleted_at == stamp],
+        is_deleted=False, deleted_at=None
+    )
+    db.session.execute(
+        update(Folder).where(
+            Folder.user_id == folder.user_id,
+            subtree_clause(folder.path),
+            Folder.is_deleted == True,
+            Folder.deleted_at == stamp
+        ).values(is_deleted=False, deleted_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_usage(folder.user_id, file_count=len(sizes),
+                 trash_bytes=-sum(sizes), trash_count=-len(sizes))
+    db.session.expire(folder)
+    return len(sizes)
+
+
+def detach_from_trashed_folders(criteria: list) -> None:
+    """
+    Переносит в корень файлы из папок в корзине перед их восстановлением.
+
+    Иначе восстановленный файл оказался бы внутри удаленной папки и
+    пропал бы из обоих списков.
+    """
+    trashed = select(Folder.id).where(Folder.is_deleted == True)
+    move_files(list(criteria) + [File.folder_id.in_(trashed)], None)
+
+
+def trash_roots_clause():
+    """Условие для папок корзины, удаленных самостоятельно, а не вместе с родителем"""
+    parent = aliased(Folder)
+    return ~exists().where(
+        parent.id == Folder.parent_id,
+        parent.is_deleted == True,
+        parent.deleted_at == Folder.deleted_at
+    )
+
+
+def visible_in_trash_clause():
+    """Условие для файлов корзины, удаленных не вместе со своей папкой"""
+    return ~exists().where(
+        Folder.id == File.folder_id,
+        Folder.is_deleted == True,
+        Folder.deleted_at == File.deleted_at
+    )
+
+
+def delete_empty_trashed_folders(*criteria) -> int:
+    """
+    Удаляет папки корзины, в поддереве которых не осталось файлов.
+
+    Вызывается после окончательного удаления файлов (без коммита). Пустые
+    папки удаляются без изменения счетчиков занятого места, поэтому версия
+    изменений владельцев увеличивается здесь.
+
+    Returns:
+        int: Количество удаленных папок
+    """
+    inner = aliased(Folder)
+    has_files = exists().where(
+        File.folder_id == inner.id,
+        inner.user_id == Folder.user_id,
+        inner.path >= Folder.path,
+        inner.path < func.substr(Folder.path, 1, func.length(Folder.path) - 1) + '0'
+    )
+    rows = db.session.execute(
+        select(Folder.id, Folder.user_id).where(Folder.is_deleted == True, ~has_files, *criteria)
+    ).all()
+    folder_ids = [row.id for row in rows]
+    # Ссылки удаляются явно: без каскада в SQLite освободившийся id
+    # новой папки открыл бы ее по старой ссылке
+    for start in range(0, len(folder_ids), DELETE_BATCH_SIZE):
+        batch = folder_ids[start:start + DELETE_BATCH_SIZE]
+        delete_folder_shares(batch)
+        db.session.execute(
+            delete(Folder).where(Folder.id.in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+    touch_user(*{row.user_id for row in rows})
+    return len(folder_ids)
+
+
+def folder_json(folder: Folder) -> dict:
+    """Представление папки в JSON API"""
+    return {
+        'id': folder.id,
+        'name': folder.name,
+        'parent_id': folder.parent_id,
+        'path': folder.path,
+        'file_count': folder.file_count,
+        'total_size': folder.total_size,
+        'created_at': folder.created_at.isoformat() if folder.created_at else None,
+    }
@@ -0,0 +1,62 @@
+"""
+Модуль ingest.py - потоковый прием загружаемых файлов.
+
+По умолчанию Werkzeug разбирает multipart-тело во временный файл
+(SpooledTemporaryFile в системном /tmp), после чего его приходится
+читать и копировать в хранилище еще раз. StreamingRequest подменяет
+приемник частей-файлов на BlobWriter хранилища: тело запроса разбирается
+по мере чтения из сокета, каждый байт пишется на диск один раз - сразу
+во временный каталог хранилища, а SHA-256 и размер считаются в том же
+проходе. После разбора файл переносится на место блоба через rename.
+
+Начало каждого файла проверяется валидаторами app.sniffing до записи на
+диск: если содержимое не соответствует типу, разбор прерывается
+исключением UploadRejected (415).
+"""
+
+from functools import partial
+
+from flask import Request, current_app
+
+from app.sniffing import inspect_upload
+from app.storage import BlobWriter
+
+
+class StreamingRequest(Request):
+    """Запрос, части-файлы которого пишутся прямо в хранилище блобов"""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        store = current_app.extensions.get('blob_store')
+        if store is None:
+            return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length
+            )
+        writer = store.open_writer(partial(inspect_upload, filename or ''))
+        self.__dict__.setdefault('_blob_writers', []).append(writer)
+        return writer
+
+    def close(self) -> None:
+        """Удаляет временные файлы частей, которые обработчик не сохранил"""
+        super().close()
+        for writer in self.__dict__.pop('_blob_writers', ()):
+            writer.discard()
+
+
+def uploaded_blob(file) -> BlobWriter:
+    """
+    Данные загруженного файла (FileStorage) в виде BlobWriter.
+
+    Если запрос разобран не StreamingRequest (например, в тестовом
+    окружении с другим классом запроса), поток копируется в хранилище.
+    MIME-тип содержимого - в атрибуте mime_type.
+
+    Raises:
+        UploadRejected: содержимое не соответствует типу файла
+    """
+    if isinstance(file.stream, BlobWriter):
+        file.stream.close()
+        return file.stream
+    return current_app.extensions['blob_store'].write_stream(
+        file.stream, partial(inspect_upload, file.filename)
+    )
@@ -0,0 +1,441 @@
+"""
+Модуль metrics.py - метрики производительности в формате Prometheus.
+
+Собирается:
+- время обработки запросов по маршрутам (гистограмма, до начала ответа)
+  и число ответов по кодам
+- байты, принятые и отданные приложением при загрузке и скачивании
+- число и время SQL-запросов на HTTP-запрос (события движков SQLAlchemy);
+  запросы, выполнившие больше METRICS_QUERY_WARNING SQL-запросов,
+  пишутся в лог вместе с самым частым из них - типичный признак N+1
+- длительность фоновых задач Celery
+
+Метрики хранятся в памяти процесса. У gunicorn и Celery процессов
+несколько, поэтому при заданном METRICS_DIR каждый процесс раз в
+METRICS_FLUSH_INTERVAL секунд (и после каждой задачи) записывает туда
+снимок своих значений, а /metrics складывает снимки всех процессов.
+Снимок назван по pid и времени запуска процесса, так что процесс с
+повторно выданным pid не затирает чужой снимок. Живой процесс
+обновляет снимок и без запросов, а снимки, не обновлявшиеся
+STALE_FLUSH_INTERVALS интервалов (процесс завершился), удаляются при
+сборе - счетчики завершенных процессов выбывают из суммы, и Prometheus
+видит это как сброс счетчика.
+
+/metrics отдается по заголовку Authorization: Bearer <METRICS_TOKEN>,
+без токена - только администраторам.
+"""
+
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter as StatementCounter
+from pathlib import Path
+
+from flask import Blueprint, Response, abort, current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+
+from app.database import BufferFlusher
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# Снимок процесса, не обновлявшийся столько интервалов записи, считается
+# оставшимся от завершенного процесса
+STALE_FLUSH_INTERVALS = 3
+
+# Маршруты, для которых считаются принятые и отданные байты
+UPLOAD_ENDPOINTS = {'main.upload_file', 'api.upload_chunk', 'api_v1.upload_chunk'}
+DOWNLOAD_ENDPOINTS = {
+    'main.download_file', 'main.shared_download', 'main.download_folder',
+    'api.bulk_download', 'api.api_download_folder',
+    'api_v1.bulk_download', 'api_v1.api_download_folder',
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    """Монотонно растущий счетчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def empty(self) -> float:
+        return 0.0
+
+    def update(self, value: float, amount: float) -> float:
+        return value + amount
+
+    def merge(self, first: float, second: float) -> float:
+        return first + second
+
+    def render(self, labels: tuple, value: float) -> list:
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}']
+
+
+class Histogram:
+    """
+    Гистограмма с метками.
+
+    Значение серии - список [количество по корзинам..., сумма, количество];
+    корзины хранятся без накопления и суммируются при выводе.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def empty(self) -> list:
+        return [0] * (len(self.buckets) + 2)
+
+    def update(self, value: list, amount: float) -> list:
+        for index, bound in enumerate(self.buckets):
+            if amount <= bound:
+                value[index] += 1
+                break
+        value[-2] += amount
+        value[-1] += 1
+        return value
+
+    def merge(self, first: list, second: list) -> list:
+        return [a + b for a, b in zip(first, second)]
+
+    def render(self, labels: tuple, value: list) -> list:
+        lines = []
+        cumulative = 0
+        names = self.labelnames + ('le',)
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            bucket = _format_labels(names, labels + (bound,))
+            lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+        lines.append(f'{self.name}_bucket{_format_labels(names, labels + ("+Inf",))} {value[-1]}')
+        base = _format_labels(self.labelnames, labels)
+        lines.append(f'{self.name}_sum{base} {_format_value(value[-2])}')
+        lines.append(f'{self.name}_count{base} {value[-1]}')
+        return lines
+
+
+class Registry:
+    """Метрики процесса и их снимки для объединения между процессами"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._process = None
+        self._directory = None
+        # Периодическая запись снимка, пока процесс жив
+        self.flusher = BufferFlusher(self._flush_now, 'metrics-flush')
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        self._values[metric.name] = {}
+        return metric
+
+    def record(self, metric, amount: float, *labels) -> None:
+        with self._lock:
+            series = self._values[metric.name]
+            value = series.get(labels)
+            if value is None:
+                value = metric.empty()
+            series[labels] = metric.update(value, amount)
+
+    def snapshot(self) -> dict:
+        """Значения в виде, пригодном для JSON: {метрика: [[метки, значение], ...]}"""
+        with self._lock:
+            return {
+                name: [[list(labels), list(value) if isinstance(value, list) else value]
+                       for labels, value in series.items()]
+                for name, series in self._values.items()
+            }
+
+    def snapshot_name(self) -> str:
+        """Имя файла снимка текущего процесса: <pid>-<время запуска, мс>.json"""
+        pid = os.getpid()
+        if self._process is None or self._process[0] != pid:
+            # После fork значение наследуется - pid сменился, процесс новый
+            self._process = (pid, time.time_ns() // 1_000_000)
+        return f'{self._process[0]}-{self._process[1]}.json'
+
+    def keep_fresh(self, app, directory, interval: float) -> None:
+        """Запускает периодическую запись снимка в directory в текущем процессе"""
+        if not directory:
+            return
+        self._directory = directory
+        self.flusher.start(app, interval)
+
+    def _flush_now(self) -> None:
+        self.flush(self._directory)
+
+    def flush(self, directory, interval: float = 0) -> None:
+        """Записывает снимок процесса в directory, если с прошлой записи прошло interval секунд"""
+        if not directory or time.monotonic() - self._flushed_at < interval:
+            return
+        self._flushed_at = time.monotonic()
+        path = Path(directory)
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path, prefix='.snapshot-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self.snapshot(), fh)
+            os.replace(tmp_path, path / self.snapshot_name())
+        except OSError as e:
+            logger.error(f"Metrics flush error: {str(e)}")
+
+    def collect(self, directory=None, max_age: float = None) -> dict:
+        """
+        Значения текущего процесса, сложенные со снимками остальных процессов.
+
+        Снимки (и брошенные временные файлы) старше max_age секунд удаляются.
+        """
+        snapshots = [self.snapshot()]
+        if directory and Path(directory).is_dir():
+            own = self.snapshot_name()
+            now = time.time()
+            for path in Path(directory).iterdir():
+                snapshot = path.suffix == '.json'
+                if path.name == own or not (snapshot or path.name.startswith('.snapshot-')):
+                    continue
+                try:
+                    if max_age is not None and now - path.stat().st_mtime > max_age:
+                        path.unlink()
+                        continue
+                    if snapshot:
+                        snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+
+        merged = {}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in series:
+                    labels = tuple(labels)
+                    target[labels] = metric.merge(target[labels], value) \
+                        if labels in target else value
+        return merged
+
+    def render(self, directory=None, max_age: float = None) -> str:
+        """Текстовый формат Prometheus 0.0.4"""
+        merged = self.collect(directory, max_age)
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, value in sorted(merged.get(name, {}).items()):
+                lines.extend(metric.render(labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'filescloud_http_request_duration_seconds',
+    'Время обработки запроса до начала ответа',
+    ('endpoint', 'method')
+))
+requests_total = registry.register(Counter(
+    'filescloud_http_requests_total',
+    'Количество запросов',
+    ('endpoint', 'method', 'status')
+))
+received_bytes = registry.register(Counter(
+    'filescloud_http_received_bytes_total',
+    'Байты тела запросов загрузки',
+    ('endpoint',)
+))
+sent_bytes = registry.register(Counter(
+    'filescloud_http_sent_bytes_total',
+    'Байты ответов скачивания, отданные приложением',
+    ('endpoint',)
+))
+request_queries = registry.register(Histogram(
+    'filescloud_db_queries_per_request',
+    'Количество SQL-запросов на один HTTP-запрос',
+    ('endpoint',),
+    buckets=QUERY_COUNT_BUCKETS
+))
+query_seconds = registry.register(Counter(
+    'filescloud_db_query_seconds_total',
+    'Суммарное время SQL-запросов',
+    ('endpoint',)
+))
+task_duration = registry.register(Histogram(
+    'filescloud_task_duration_seconds',
+    'Длительность фоновых задач Celery',
+    ('task', 'state'),
+    buckets=TASK_BUCKETS
+))
+
+
+class RequestStats:
+    """Счетчики текущего HTTP-запроса"""
+
+    __slots__ = ('started', 'queries', 'query_time', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = StatementCounter()
+
+
+def _endpoint() -> str:
+    return request.endpoint or 'unmatched'
+
+
+def _counting_body(iterable, endpoint: str):
+    """Тело потокового ответа, считающее отданные байты"""
+    sent = 0
+    try:
+        for chunk in iterable:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.record(sent_bytes, sent, endpoint)
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.get('request_stats')
+    if stats is None:
+        return response
+    endpoint = _endpoint()
+    registry.record(request_duration, time.perf_counter() - stats.started, endpoint, request.method)
+    registry.record(requests_total, 1, endpoint, request.method, str(response.status_code))
+
+    if endpoint in UPLOAD_ENDPOINTS and request.content_length:
+        registry.record(received_bytes, request.content_length, endpoint)
+    if endpoint in DOWNLOAD_ENDPOINTS and request.method != 'HEAD':
+        if response.content_length is not None:
+            # Файл отдается оберткой с sendfile - тело не оборачиваем
+            registry.record(sent_bytes, response.content_length, endpoint)
+        elif response.is_streamed:
+            response.response = _counting_body(response.response, endpoint)
+    return response
+
+
+def _teardown_request(error=None):
+    # После отправки потокового ответа: учитываются и запросы из генератора тела
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return
+    config = current_app.config
+    endpoint = _endpoint()
+    registry.record(request_queries, stats.queries, endpoint)
+    if stats.query_time:
+        registry.record(query_seconds, stats.query_time, endpoint)
+
+    threshold = config['METRICS_QUERY_WARNING']
+    if threshold and stats.queries > threshold:
+        statement, repeats = stats.statements.most_common(1)[0]
+        logger.warning(
+            f"{stats.queries} SQL queries ({stats.query_time * 1000:.1f} ms) "
+            f"in {request.method} {request.path} [{endpoint}]; "
+            f"most frequent ({repeats}x): {' '.join(statement.split())[:300]}"
+        )
+    registry.flush(config['METRICS_DIR'], config['METRICS_FLUSH_INTERVAL'])
+    registry.keep_fresh(current_app._get_current_object(), config['METRICS_DIR'],
+                        config['METRICS_FLUSH_INTERVAL'])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_stats' in g:
+        conn.info['metrics_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started', None)
+    if started is None or not has_request_context():
+        return
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+        stats.statements[statement] += 1
+
+
+def init_metrics(app, db) -> None:
+    """Подключает сбор метрик к приложению; вызывается после db.init_app"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    # Первым среди before_request, чтобы в задержку вошли проверка CSRF и т.п.
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.register_blueprint(metrics_bp)
+
+
+def observe_task(name: str, state: str, seconds: float, directory=None, app=None) -> None:
+    """
+    Учитывает выполнение фоновой задачи и сразу записывает снимок процесса.
+
+    С приложением app снимок и дальше обновляется раз в
+    METRICS_FLUSH_INTERVAL, пока воркер ждет следующих задач.
+    """
+    registry.record(task_duration, seconds, name, state or 'UNKNOWN')
+    registry.flush(directory)
+    if app is not None:
+        registry.keep_fresh(app, directory, app.config['METRICS_FLUSH_INTERVAL'])
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Метрики всех процессов в текстовом формате Prometheus"""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            abort(401)
+    elif not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    config = current_app.config
+    return Response(
+        registry.render(config['METRICS_DIR'],
+                        config['METRICS_FLUSH_INTERVAL'] * STALE_FLUSH_INTERVALS),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -4,10 +4,14 @@
 Содержит модели:
 - User: Модель пользователя системы
 - File: Модель для хранения файловых метаданных
-- ShareLink: Модель для управления общим доступом к файлам
+- Folder: Модель папки (иерархия через материализованный путь)
+- ShareLink: Модель для управления общим доступом к файлам и папкам
+- Blob: Модель содержимого файлов в контентно-адресуемом хранилище
+- UploadSession, UploadChunk: Модели возобновляемой загрузки по частям
 """
 
 from datetime import datetime
+from flask import current_app
 from flask_login import UserMixin
 from app import db
 
@@ -22,6 +26,12 @@ class User(UserMixin, db.Model):
         created_at (datetime): Дата и время регистрации пользователя
         last_login (datetime): Дата и время последнего входа
         is_active (bool): Флаг активности аккаунта (по умолчанию True)
+        bytes_used (int): Занятое место в байтах, включая корзину
+        file_count (int): Количество файлов вне корзины
+        trash_bytes (int): Объем файлов в корзине
+        trash_count (int): Количество файлов в корзине
+        quota_bytes (int): Персональная квота (NULL - квота по умолчанию)
+        change_version (int): Номер изменения файлов, папок и ссылок пользователя
         files (relationship): Связь один-ко-многим с моделью File
     """
     __tablename__ = 'users'
@@ -36,7 +46,7 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(
         db.String(256), 
         nullable=False,
-        doc="Хеш пароля пользователя (PBKDF2:sha256)")
+        doc="Хеш пароля пользователя (scrypt, pbkdf2 или argon2id - см. PASSWORD_HASH_METHOD)")
     created_at = db.Column(
         db.DateTime, 
         default=datetime.utcnow,
@@ -48,6 +58,39 @@ class User(UserMixin, db.Model):
         db.Boolean, 
         default=True,
         doc="Флаг активности аккаунта (True/False)")
+    bytes_used = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Занятое место в байтах, включая корзину")
+    file_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Количество файлов вне корзины")
+    trash_bytes = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Объем файлов в корзине")
+    trash_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Количество файлов в корзине")
+    quota_bytes = db.Column(
+        db.BigInteger,
+        doc="Персональная квота в байтах (NULL - DEFAULT_QUOTA_BYTES)")
+    change_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Растет при каждом изменении файлов, папок и общих ссылок (ETag списков API)")
     
     # Связи
     files = db.relationship(
@@ -61,6 +104,11 @@ class User(UserMixin, db.Model):
         """Строковое представление объекта пользователя"""
         return f'<User {self.username}>'
 
+    @property
+    def is_admin(self) -> bool:
+        """Пользователь указан в ADMIN_USERNAMES"""
+        return self.username in current_app.config['ADMIN_USERNAMES']
+
 
 class File(db.Model):
     """
@@ -69,14 +117,26 @@ class File(db.Model):
     Атрибуты:
         id (int): Уникальный идентификатор файла (первичный ключ)
         filename (str): Оригинальное имя файла (макс. 256 символов)
-        storage_path (str): Путь к файлу в файловой системе (макс. 512 символов)
+        storage_path (str): Ключ данных в бэкенде хранения (макс. 512 символов)
+        content_hash (str): SHA-256 содержимого, ключ блоба в хранилище
         size (int): Размер файла в байтах
+        stored_size (int): Размер данных на диске (после сжатия)
+        codec (str): Кодек сжатия на диске ('zstd', 'gzip') или None
+        mime_type (str): MIME-тип, определенный по содержимому при загрузке
         user_id (int): Ссылка на владельца файла (внешний ключ)
+        folder_id (int): Папка файла (NULL - корень)
         uploaded_at (datetime): Дата и время загрузки
         is_deleted (bool): Флаг мягкого удаления
         deleted_at (datetime): Дата и время удаления
     """
     __tablename__ = 'files'
+    __table_args__ = (
+        # Составные индексы под keyset-пагинацию списка файлов и корзины
+        db.Index('ix_files_listing', 'user_id', 'is_deleted', 'uploaded_at', 'id'),
+        db.Index('ix_files_trash', 'user_id', 'is_deleted', 'deleted_at', 'id'),
+        # Список одной папки
+        db.Index('ix_files_folder', 'user_id', 'folder_id', 'is_deleted', 'uploaded_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, doc="Уникальный идентификатор файла")
     filename = db.Column(
@@ -86,21 +146,40 @@ class File(db.Model):
     storage_path = db.Column(
         db.String(512), 
         nullable=False, 
-        unique=True,
-        doc="Физический путь к файлу")
+        index=True,
+        doc="Ключ данных в бэкенде хранения (общий для файлов с одинаковым содержимым)")
+    content_hash = db.Column(
+        db.String(64),
+        db.ForeignKey('blobs.hash'),
+        index=True,
+        doc="SHA-256 содержимого (NULL для файлов до переноса в хранилище блобов)")
     size = db.Column(
         db.BigInteger, 
         nullable=False,
         doc="Размер файла в байтах")
+    stored_size = db.Column(
+        db.BigInteger,
+        doc="Размер данных на диске (NULL - совпадает с size)")
+    codec = db.Column(
+        db.String(8),
+        doc="Кодек сжатия блоба на диске (NULL - без сжатия)")
+    mime_type = db.Column(
+        db.String(255),
+        doc="MIME-тип по сигнатуре содержимого (NULL - файл загружен до проверки типов)")
     user_id = db.Column(
         db.Integer, 
         db.ForeignKey('users.id', ondelete='CASCADE'), 
         nullable=False, 
         index=True,
         doc="Внешний ключ к таблице пользователей")
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey('folders.id', ondelete='CASCADE'),
+        doc="Папка файла (NULL - корень)")
     uploaded_at = db.Column(
         db.DateTime, 
         default=datetime.utcnow,
+        index=True,
         doc="Дата и время загрузки файла")
     is_deleted = db.Column(
         db.Boolean, 
@@ -116,14 +195,108 @@ class File(db.Model):
         return f'<File {self.filename}>'
 
 
+class Folder(db.Model):
+    """
+    Модель папки.
+
+    Иерархия хранится материализованным путем из идентификаторов
+    (/1/5/9/ - папка 9 внутри 5 внутри 1), поэтому поддерево выбирается
+    одним диапазонным условием по индексу, предки известны без рекурсии,
+    а переименование не затрагивает потомков. Агрегаты file_count и
+    total_size относятся ко всему поддереву и, как bytes_used
+    пользователя, включают файлы в корзине.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор папки (первичный ключ)
+        user_id (int): Ссылка на владельца (внешний ключ)
+        parent_id (int): Родительская папка (NULL - корень)
+        name (str): Имя папки (макс. 256 символов)
+        path (str): Материализованный путь из id, включая собственный
+        depth (int): Глубина вложенности (1 - папка в корне)
+        file_count (int): Количество файлов в поддереве
+        total_size (int): Объем файлов в поддереве в байтах
+        created_at (datetime): Дата и время создания
+        is_deleted (bool): Флаг мягкого удаления
+        deleted_at (datetime): Дата и время удаления
+    """
+    __tablename__ = 'folders'
+    __table_args__ = (
+        db.Index('ix_folders_children', 'user_id', 'parent_id', 'is_deleted', 'name'),
+        db.Index('ix_folders_path', 'user_id', 'path'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, doc="Уникальный идентификатор папки")
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        doc="Внешний ключ к таблице пользователей")
+    parent_id = db.Column(
+        db.Integer,
+        db.ForeignKey('folders.id', ondelete='CASCADE'),
+        doc="Родительская папка (NULL - корень)")
+    name = db.Column(
+        db.String(256),
+        nullable=False,
+        doc="Имя папки")
+    # Побайтовое сравнение: поддерево выбирается диапазоном path, а в
+    # локалях PostgreSQL знак / при сортировке игнорируется
+    path = db.Column(
+        db.String(512).with_variant(db.String(512, collation='C'), 'postgresql'),
+        nullable=False,
+        doc="Материализованный путь из идентификаторов (/1/5/9/)")
+    depth = db.Column(
+        db.Integer,
+        nullable=False,
+        doc="Глубина вложенности")
+    file_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Количество файлов в поддереве, включая корзину")
+    total_size = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+        server_default='0',
+        doc="Объем файлов в поддереве, включая корзину")
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+        doc="Дата и время создания папки")
+    is_deleted = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+        doc="Флаг мягкого удаления папки")
+    deleted_at = db.Column(
+        db.DateTime,
+        doc="Дата и время удаления (общая для всего удаленного поддерева)")
+
+    def __repr__(self) -> str:
+        """Строковое представление объекта папки"""
+        return f'<Folder {self.path} {self.name}>'
+
+    @property
+    def ancestor_ids(self) -> list:
+        """Идентификаторы предков от корня, без самой папки"""
+        return [int(part) for part in self.path.strip('/').split('/')[:-1]]
+
+
 class ShareLink(db.Model):
     """
-    Модель для управления общим доступом к файлам.
+    Модель для управления общим доступом к файлам и папкам.
+
+    Ссылка ведет либо на файл (file_id), либо на папку (folder_id) -
+    папка скачивается ZIP-архивом.
 
     Атрибуты:
         id (int): Уникальный идентификатор ссылки (первичный ключ)
         token (str): Уникальный токен доступа (32 символа)
         file_id (int): Ссылка на файл (внешний ключ)
+        folder_id (int): Ссылка на папку (внешний ключ)
         created_at (datetime): Дата и время создания ссылки
         expiration (datetime): Дата и время истечения срока действия
         password (str): Пароль для доступа (макс. 128 символов)
@@ -142,8 +315,14 @@ class ShareLink(db.Model):
     file_id = db.Column(
         db.Integer, 
         db.ForeignKey('files.id', ondelete='CASCADE'), 
-        nullable=False,
+        nullable=True,
         doc="Внешний ключ к таблице файлов")
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey('folders.id', ondelete='CASCADE'),
+        nullable=True,
+        index=True,
+        doc="Внешний ключ к таблице папок")
     created_at = db.Column(
         db.DateTime, 
         default=datetime.utcnow,
@@ -165,6 +344,8 @@ class ShareLink(db.Model):
 
     def __repr__(self) -> str:
         """Строковое представление объекта ссылки"""
+        if self.folder_id is not None:
+            return f'<ShareLink for folder {self.folder_id}>'
         return f'<ShareLink for file {self.file_id}>'
 
     def is_valid(self) -> bool:
@@ -173,4 +354,134 @@ class ShareLink(db.Model):
             return False
         if self.download_limit and self.download_count >= self.download_limit:
             return False
-        return True
\ No newline at end of file
+        return True
+
+
+class Blob(db.Model):
+    """
+    Модель содержимого файла в контентно-адресуемом хранилище.
+
+    Атрибуты:
+        hash (str): SHA-256 содержимого в hex (первичный ключ)
+        size (int): Размер содержимого в байтах
+        ref_count (int): Количество записей File, ссылающихся на блоб
+        created_at (datetime): Дата и время первой загрузки содержимого
+    """
+    __tablename__ = 'blobs'
+
+    hash = db.Column(db.String(64), primary_key=True, doc="SHA-256 содержимого")
+    size = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc="Размер содержимого в байтах")
+    ref_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        doc="Счетчик ссылок из таблицы файлов")
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+        doc="Дата и время первой загрузки содержимого")
+
+    def __repr__(self) -> str:
+        """Строковое представление объекта блоба"""
+        return f'<Blob {self.hash[:12]} refs={self.ref_count}>'
+
+
+class UploadSession(db.Model):
+    """
+    Модель сессии возобновляемой загрузки по частям.
+
+    Атрибуты:
+        id (str): Идентификатор сессии (32 hex-символа, первичный ключ)
+        user_id (int): Ссылка на владельца загрузки (внешний ключ)
+        folder_id (int): Папка, в которую попадет файл (NULL - корень)
+        filename (str): Оригинальное имя загружаемого файла
+        total_size (int): Итоговый размер файла в байтах
+        created_at (datetime): Дата и время начала загрузки
+        expires_at (datetime): Срок, после которого незавершенная загрузка удаляется
+        chunks (relationship): Связь один-ко-многим с моделью UploadChunk
+    """
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True, doc="Идентификатор сессии загрузки")
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+        doc="Внешний ключ к таблице пользователей")
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey('folders.id', ondelete='SET NULL'),
+        doc="Папка, в которую попадет файл (NULL - корень)")
+    filename = db.Column(
+        db.String(256),
+        nullable=False,
+        doc="Оригинальное имя файла")
+    total_size = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc="Итоговый размер файла в байтах")
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+        doc="Дата и время начала загрузки")
+    expires_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        index=True,
+        doc="Срок действия незавершенной загрузки")
+
+    chunks = db.relationship(
+        'UploadChunk',
+        backref='session',
+        lazy='dynamic',
+        passive_deletes=True,
+        doc="Принятые части файла")
+
+    def __repr__(self) -> str:
+        """Строковое представление объекта сессии загрузки"""
+        return f'<UploadSession {self.id} {self.filename}>'
+
+
+class UploadChunk(db.Model):
+    """
+    Модель принятой части файла.
+
+    Части только добавляются, поэтому параллельные PUT-запросы одной
+    сессии не конфликтуют между собой при записи в базу.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор части (первичный ключ)
+        session_id (str): Ссылка на сессию загрузки (внешний ключ)
+        offset (int): Смещение части в итоговом файле
+        length (int): Длина части в байтах
+        checksum (str): SHA-256 содержимого части
+    """
+    __tablename__ = 'upload_chunks'
+
+    id = db.Column(db.Integer, primary_key=True, doc="Уникальный идентификатор части")
+    session_id = db.Column(
+        db.String(32),
+        db.ForeignKey('upload_sessions.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+        doc="Внешний ключ к таблице сессий загрузки")
+    offset = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc="Смещение части в файле")
+    length = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc="Длина части в байтах")
+    checksum = db.Column(
+        db.String(64),
+        nullable=False,
+        doc="SHA-256 содержимого части")
+
+    def __repr__(self) -> str:
+        """Строковое представление объекта части"""
+        return f'<UploadChunk {self.session_id} @{self.offset}+{self.length}>'
@@ -0,0 +1,168 @@
+"""
+Модуль pagination.py - постраничный вывод по ключу (keyset pagination).
+
+Вместо OFFSET страница задается курсором - значениями сортировки последней
+(или первой) записи предыдущей страницы. Запрос вида
+WHERE (uploaded_at, id) < (:ts, :id) ORDER BY uploaded_at DESC, id DESC
+читает по составному индексу ровно per_page + 1 строк, независимо от того,
+насколько далеко пользователь пролистал список.
+
+Колонка сортировки может быть NULL (файлы без даты удаления или
+загрузки). Такие строки стоят там, где их ставит сама база (SQLite и
+MySQL - в конце порядка DESC, PostgreSQL - в начале), чтобы ORDER BY
+по-прежнему читался по индексу, а курсор хранит NULL явно и условие
+перехода к соседней странице строится с учетом этого места.
+
+Общее количество записей считается отдельно и кэшируется на короткое
+время, чтобы COUNT(*) не выполнялся при каждом переходе по страницам.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, tuple_
+
+from app import db
+from app.cache import TTLCache
+
+# user_id -> {ключ списка: количество}
+count_cache = TTLCache(maxsize=4096, ttl=60)
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Кодирует позицию в списке в непрозрачную строку для URL"""
+    raw = json.dumps([sort_value.isoformat() if sort_value else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """
+    Декодирует курсор из URL.
+
+    Returns:
+        tuple: (datetime или None, id) или None для пустого/поврежденного курсора
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _nulls_high() -> bool:
+    """NULL больше любого значения: первым в порядке DESC (PostgreSQL, Oracle)"""
+    return db.engine.dialect.name in ('postgresql', 'oracle')
+
+
+def _beyond(sort_column, id_column, position, newer: bool):
+    """
+    Условие на строки после позиции курсора в порядке (sort DESC, id DESC):
+    более старые, а при newer=True - более новые.
+    """
+    sort_value, row_id = position
+    nulls_high = _nulls_high()
+    if sort_value is None:
+        clause = and_(sort_column.is_(None), id_column > row_id if newer else id_column < row_id)
+        if newer != nulls_high:
+            # Все строки с датой лежат по эту сторону от строк с NULL
+            clause = or_(sort_column.is_not(None), clause)
+        return clause
+
+    key = tuple_(sort_column, id_column)
+    clause = key > tuple_(*position) if newer else key < tuple_(*position)
+    if newer == nulls_high:
+        # Сравнение кортежа с NULL дает NULL, а не истину
+        clause = or_(clause, sort_column.is_(None))
+    return clause
+
+
+class KeysetPage:
+    """
+    Страница результатов keyset-пагинации.
+
+    Атрибуты:
+        items (list): Записи текущей страницы
+        next_cursor (str): Курсор следующей (более старой) страницы
+        prev_cursor (str): Курсор предыдущей (более новой) страницы
+        total (int): Общее количество записей, если оно запрашивалось
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, sort_column, id_column, per_page: int,
+                    after=None, before=None) -> KeysetPage:
+    """
+    Выбирает страницу записей в порядке (sort_column DESC, id_column DESC).
+
+    Args:
+        query: Запрос с уже наложенными фильтрами
+        sort_column: Колонка сортировки (например, File.uploaded_at)
+        id_column: Первичный ключ для однозначного порядка
+        per_page (int): Размер страницы
+        after (tuple): Позиция, после которой начинается страница
+        before (tuple): Позиция, перед которой заканчивается страница
+
+    Returns:
+        KeysetPage: Страница с курсорами соседних страниц
+    """
+    if before:
+        rows = query.filter(_beyond(sort_column, id_column, before, newer=True)).order_by(
+            sort_column.asc(), id_column.asc()
+        ).limit(per_page + 1).all()
+        has_more_newer = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_older, has_newer = True, has_more_newer
+    else:
+        if after:
+            query = query.filter(_beyond(sort_column, id_column, after, newer=False))
+        rows = query.order_by(
+            sort_column.desc(), id_column.desc()
+        ).limit(per_page + 1).all()
+        has_older = len(rows) > per_page
+        rows = rows[:per_page]
+        has_newer = after is not None
+
+    def position(item):
+        return getattr(item, sort_column.key), getattr(item, id_column.key)
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(*position(rows[-1])) if rows and has_older else None,
+        prev_cursor=encode_cursor(*position(rows[0])) if rows and has_newer else None
+    )
+
+
+def cached_count(user_id: int, name, query) -> int:
+    """Количество записей в списке пользователя с кэшированием на 60 секунд"""
+    counts = count_cache.get(user_id)
+    if counts is None:
+        counts = {}
+        count_cache.set(user_id, counts)
+    if name not in counts:
+        counts[name] = query.order_by(None).count()
+    return counts[name]
+
+
+def invalidate_counts(user_id: int) -> None:
+    """Сбрасывает кэш количеств после изменения файлов пользователя"""
+    count_cache.delete(user_id)
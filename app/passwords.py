@@ -0,0 +1,144 @@
+"""
+Модуль passwords.py - хеширование паролей вне потока запроса.
+
+Хеширование пароля намеренно дорогое, поэтому выполняется в отдельном
+пуле из PASSWORD_HASH_WORKERS процессов: волна входов загружает не
+больше этого числа ядер, а воркеры, отдающие файлы, продолжают работать.
+Очередь к пулу ограничена PASSWORD_HASH_QUEUE задачами; когда она полна,
+запрос сразу получает HashingBusy вместо ожидания. PASSWORD_HASH_WORKERS=0
+хеширует прямо в потоке запроса.
+
+Алгоритм задается PASSWORD_HASH_METHOD в формате Werkzeug:
+- scrypt:N:r:p (по умолчанию scrypt:32768:8:1)
+- pbkdf2:sha256:итерации
+- argon2id:time_cost:memory_cost_KiB:parallelism - требует пакета argon2-cffi
+
+Хеш, записанный другим алгоритмом или с другой стоимостью, проверяется
+как раньше и после успешного входа прозрачно пересчитывается.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    from argon2 import PasswordHasher, Type
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    PasswordHasher = None
+
+
+class HashingBusy(RuntimeError):
+    """Очередь пула хеширования заполнена"""
+
+
+def _argon2_hasher(method: str = 'argon2id:3:65536:1'):
+    if PasswordHasher is None:
+        raise RuntimeError('Для хешей argon2id нужен пакет argon2-cffi')
+    _, time_cost, memory_cost, parallelism = method.split(':')
+    return PasswordHasher(
+        time_cost=int(time_cost), memory_cost=int(memory_cost),
+        parallelism=int(parallelism), type=Type.ID
+    )
+
+
+def compute_hash(password: str, method: str) -> str:
+    """Хеш пароля заданным методом (выполняется в процессе пула)"""
+    if method.startswith('argon2id:'):
+        return _argon2_hasher(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+
+def check_hash(stored: str, password: str) -> bool:
+    """Проверка пароля по хешу любого поддерживаемого формата"""
+    if stored.startswith('$argon2'):
+        hasher = _argon2_hasher()
+        try:
+            return hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(stored, password)
+
+
+def needs_rehash(stored: str, method: str) -> bool:
+    """Записан ли хеш не тем алгоритмом или не с той стоимостью"""
+    if method.startswith('argon2id:'):
+        return not stored.startswith('$argon2id$') or \
+            _argon2_hasher(method).check_needs_rehash(stored)
+    return stored.split('$', 1)[0] != method
+
+
+class HashPool:
+    """
+    Пул процессов для хеширования, общий для потоков процесса.
+
+    Создается при первом использовании и заново после fork (gunicorn
+    запускает воркеры от уже импортированного приложения). Процессы
+    пула запускаются через spawn, чтобы не наследовать блокировки
+    потоков родителя.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure(self, workers: int, queue: int):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._slots = threading.BoundedSemaphore(workers + queue)
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def run(self, func, *args):
+        config = current_app.config
+        workers = config['PASSWORD_HASH_WORKERS']
+        if not workers:
+            return func(*args)
+
+        executor, slots = self._ensure(workers, config['PASSWORD_HASH_QUEUE'])
+        if not slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+        except BrokenProcessPool:
+            # Процесс пула погиб (OOM и т.п.) - следующий вызов создаст пул заново
+            self.shutdown()
+            raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hash_pool = HashPool()
+
+
+def hash_password(password: str) -> str:
+    """Хеш нового пароля по PASSWORD_HASH_METHOD"""
+    return hash_pool.run(compute_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(stored: str, password: str) -> bool:
+    return hash_pool.run(check_hash, stored, password)
+
+
+def password_needs_rehash(stored: str) -> bool:
+    return needs_rehash(stored, current_app.config['PASSWORD_HASH_METHOD'])
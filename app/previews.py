@@ -0,0 +1,333 @@
+"""
+Модуль previews.py - миниатюры изображений и превью первой страницы PDF.
+
+Превью строятся фоновой задачей Celery сразу после загрузки, а если
+задача не успела (или Celery не настроен) - по первому запросу.
+Готовые картинки лежат в кэше на диске UPLOAD_FOLDER/previews, ключом
+служит хеш содержимого и размер, поэтому одинаковые файлы разных
+пользователей делят одно превью, а ответ можно кэшировать в браузере
+надолго. Общий объем кэша ограничен PREVIEW_CACHE_MAX_BYTES: при
+превышении удаляются давно не запрашивавшиеся превью (LRU по mtime).
+
+Рендеринг опционален: изображения требуют Pillow, PDF - PyMuPDF.
+Без этих пакетов превью соответствующего типа просто недоступны.
+"""
+
+import io
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.cache import TTLCache
+from app.models import File
+from app.storage import blob_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: остаются только блокировки внутри процесса
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+previews_cli = AppGroup('previews', help='Обслуживание кэша превью.')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+PDF_EXTENSIONS = {'pdf'}
+IMAGE_MIME_TYPES = {'image/png', 'image/jpeg', 'image/gif'}
+PREVIEW_SUFFIX = '.jpg'
+JPEG_QUALITY = 85
+
+# Количество блокировок рендеринга; превью с одним ключом всегда
+# попадает под одну и ту же блокировку
+LOCK_STRIPES = 64
+
+# (ключ, размер) -> True для превью, которые не удалось построить;
+# не даем битому файлу рендериться заново на каждый запрос
+_failures = TTLCache(maxsize=4096, ttl=600)
+
+
+def preview_kind(filename: str, mime_type: str = None):
+    """
+    Тип превью по MIME-типу содержимого, а для файлов без него - по расширению.
+
+    Returns:
+        str: 'image', 'pdf' или None, если превью для файла не строится
+    """
+    if mime_type is not None:
+        is_image = mime_type in IMAGE_MIME_TYPES
+        is_pdf = mime_type == 'application/pdf'
+    else:
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        is_image = extension in IMAGE_EXTENSIONS
+        is_pdf = extension in PDF_EXTENSIONS
+    if is_image and Image is not None:
+        return 'image'
+    if is_pdf and fitz is not None:
+        return 'pdf'
+    return None
+
+
+def render_image(source, size: int) -> bytes:
+    """Миниатюра изображения, вписанная в квадрат size x size"""
+    with Image.open(source) as img:
+        # Для JPEG уменьшение выполняется еще при декодировании
+        img.draft('RGB', (size, size))
+        img.thumbnail((size, size))
+        if 'A' in img.getbands() or img.mode == 'P':
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, 'white')
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        return buffer.getvalue()
+
+
+def render_pdf(source, size: int) -> bytes:
+    """Первая страница PDF, вписанная в квадрат size x size"""
+    with fitz.open(source) as document:
+        page = document.load_page(0)
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes('jpeg')
+
+
+RENDERERS = {
+    'image': render_image,
+    'pdf': render_pdf,
+}
+
+
+class PreviewCache:
+    """
+    Кэш превью на диске с вытеснением по общему объему.
+
+    Файлы: root/<ключ[:2]>/<ключ>-<размер>.jpg. Время последнего
+    обращения хранится в mtime файла (обновляется при каждом попадании),
+    по нему выбираются кандидаты на вытеснение.
+    """
+
+    def __init__(self, root, max_bytes: int):
+        self.root = Path(root)
+        self.lock_dir = self.root / 'locks'
+        self.max_bytes = max_bytes
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._guard = threading.Lock()
+        self._total = None  # Оценка объема кэша, уточняется при вытеснении
+
+    def path_for(self, key: str, size: int) -> Path:
+        return self.root / key[:2] / f'{key}-{size}{PREVIEW_SUFFIX}'
+
+    def get(self, key: str, size: int):
+        """Путь к готовому превью или None; отмечает обращение для LRU"""
+        path = self.path_for(key, size)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_render(self, key: str, size: int, render):
+        """
+        Возвращает превью из кэша, при промахе строит его вызовом render(size).
+
+        Параллельные запросы одного превью (в том числе из разных
+        процессов) ждут друг друга, и рендеринг выполняется один раз.
+
+        Returns:
+            Path: путь к превью или None, если render вернул None
+        """
+        path = self.get(key, size)
+        if path is not None:
+            return path
+
+        with self._render_lock(f'{key}-{size}'):
+            path = self.get(key, size)
+            if path is not None:
+                return path
+            data = render(size)
+            if data is None:
+                return None
+            path = self.path_for(key, size)
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+        self._account(len(data), path)
+        return path
+
+    @contextmanager
+    def _render_lock(self, name: str):
+        stripe = zlib.crc32(name.encode()) % LOCK_STRIPES
+        with self._locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_dir / f'{stripe:02d}.lock', 'a') as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _account(self, added: int, path: Path) -> None:
+        with self._guard:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += added
+            over = self._total > self.max_bytes
+        if over:
+            self.evict(keep=path)
+
+    def _entries(self):
+        """Все превью кэша: (mtime, размер, путь)"""
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.path == str(self.lock_dir):
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(PREVIEW_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def evict(self, target: int = None, keep: Path = None) -> tuple:
+        """
+        Удаляет давно не запрашивавшиеся превью, пока объем кэша больше target.
+
+        По умолчанию кэш сокращается до 90% от max_bytes, чтобы вытеснение
+        не запускалось после каждого нового превью. Превью keep (только что
+        построенное для текущего запроса) не удаляется.
+
+        Returns:
+            tuple: (удалено файлов, освобождено байт)
+        """
+        if target is None:
+            target = self.max_bytes * 9 // 10
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = freed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if keep is not None and path == str(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        with self._guard:
+            self._total = total
+        return removed, freed
+
+
+def preview_cache() -> PreviewCache:
+    """Кэш превью текущего приложения"""
+    return current_app.extensions['preview_cache']
+
+
+def preview_size(requested: int) -> int:
+    """Приводит запрошенный размер к ближайшему большему из THUMBNAIL_SIZES"""
+    sizes = sorted(current_app.config['THUMBNAIL_SIZES'])
+    for size in sizes:
+        if requested <= size:
+            return size
+    return sizes[-1]
+
+
+def get_preview(file: File, size: int):
+    """
+    Превью файла заданного размера (из кэша или построенное сейчас).
+
+    Returns:
+        Path: путь к JPEG или None, если превью для файла недоступно
+    """
+    kind = preview_kind(file.filename, file.mime_type)
+    if kind is None:
+        return None
+    key = file.content_hash or f'file{file.id}'
+    size = preview_size(size)
+    if _failures.get((key, size)):
+        return None
+
+    def render(size):
+        try:
+            with blob_store().plain_copy(file) as source:
+                return RENDERERS[kind](source, size)
+        except Exception as e:
+            logger.warning(f"Preview render error for file {file.id} ({size}px): {str(e)}")
+            _failures.set((key, size), True)
+            return None
+
+    return preview_cache().get_or_render(key, size, render)
+
+
+def generate_previews(file: File) -> int:
+    """
+    Строит превью всех размеров THUMBNAIL_SIZES.
+
+    Returns:
+        int: Количество доступных превью
+    """
+    return sum(
+        get_preview(file, size) is not None
+        for size in current_app.config['THUMBNAIL_SIZES']
+    )
+
+
+def schedule_previews(file: File) -> None:
+    """
+    Ставит построение превью нового файла в очередь Celery.
+
+    Без брокера (CELERY_BROKER_URL) ничего не делает: превью будут
+    построены при первом запросе.
+    """
+    if not current_app.config['CELERY_BROKER_URL']:
+        return
+    if preview_kind(file.filename, file.mime_type) is None:
+        return
+    try:
+        from app.tasks import render_previews
+        render_previews.delay(file.id)
+    except Exception as e:
+        logger.warning(f"Could not schedule previews for file {file.id}: {str(e)}")
+
+
+@previews_cli.command('prune')
+@click.option('--max-bytes', type=int, default=None,
+              help='Целевой объем кэша (по умолчанию 90% от PREVIEW_CACHE_MAX_BYTES).')
+def prune_command(max_bytes):
+    """Удаляет давно не запрашивавшиеся превью сверх лимита кэша."""
+    removed, freed = preview_cache().evict(max_bytes)
+    click.echo(f"Удалено превью: {removed} ({freed} байт)")
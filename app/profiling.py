@@ -0,0 +1,454 @@
+"""
+Модуль profiling.py - профилирование запросов и фоновых задач по требованию.
+
+Профилируется запрос:
+- с заголовком PROFILING_HEADER (значение - режим: sampling или
+  cprofile) от администратора или с Authorization: Bearer <PROFILING_TOKEN>
+- случайный, с вероятностью PROFILING_SAMPLE_RATE
+Задачи Celery выбираются с вероятностью PROFILING_TASK_SAMPLE_RATE.
+
+Режимы:
+- sampling - фоновый поток раз в PROFILING_INTERVAL секунд снимает стек
+  профилируемого потока (sys._current_frames); накладные расходы не
+  зависят от числа вызовов, стеки сохраняются в свернутом формате
+  (collapsed stacks) для flamegraph.pl и speedscope
+- cprofile - детерминированный cProfile: точные числа вызовов, но
+  заметное замедление и без стеков, только время по функциям. В процессе
+  одновременно работает только один такой профиль (с Python 3.12 cProfile
+  занимает общий для процесса sys.monitoring), параллельные запросы
+  профилируются в режиме sampling
+
+Профили хранятся кольцевым буфером из PROFILING_BUFFER последних записей:
+в памяти процесса или, при заданном PROFILING_DIR, файлами в общем
+каталоге, куда пишут все процессы gunicorn и Celery. Профили задач
+сохраняются только в PROFILING_DIR - память воркера Celery веб-процессу
+недоступна. /admin/profiles отдает список профилей и горячие точки по
+маршрутам и задачам, сложенные по всему буферу.
+
+При PROFILING_ENABLED = False (по умолчанию) обработчики не
+подключаются и запросы не проходят через модуль вовсе.
+"""
+
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+profiling_bp = Blueprint('profiling', __name__, url_prefix='/admin/profiles')
+
+MODES = ('sampling', 'cprofile')
+# Глубже стек обрезается со стороны корня
+MAX_STACK_DEPTH = 128
+HOT_SPOTS_LIMIT = 20
+PROFILE_ID = re.compile(r'[0-9a-f]{16}')
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+
+
+def _frame_label(filename: str, line: int, name: str) -> str:
+    if filename.startswith(PROJECT_ROOT):
+        filename = filename[len(PROJECT_ROOT):]
+    else:
+        # Библиотеки: путь от site-packages или имя модуля стандартной библиотеки
+        filename = filename.rsplit('site-packages' + os.sep, 1)[-1]
+        if filename.startswith(os.sep):
+            filename = os.path.basename(filename)
+    return f'{name} ({filename}:{line})'
+
+
+def _collapse(frame) -> str:
+    """Стек кадра в свернутом виде: корень;...;лист"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        labels.append(_frame_label(code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class Sampler:
+    """
+    Фоновый поток, снимающий стеки профилируемых потоков.
+
+    Поток запускается с первым профилем и завершается, когда профилируемых
+    потоков не осталось, так что без профилирования он не работает.
+    """
+
+    def __init__(self):
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.interval = 0.005
+
+    def start(self, thread_id: int, interval: float) -> Counter:
+        stacks = Counter()
+        with self._lock:
+            self._targets[thread_id] = stacks
+            self.interval = interval
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+        return stacks
+
+    def stop(self, thread_id: int) -> None:
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, stacks in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+                interval = self.interval
+            del frames
+            time.sleep(interval)
+
+
+sampler = Sampler()
+# Занят, пока в процессе работает профиль cprofile
+_cprofile_lock = threading.Lock()
+
+
+class Profile:
+    """
+    Профиль одного запроса или задачи.
+
+    Атрибуты:
+        id (str): Идентификатор профиля (отдается в заголовке X-Profile-Id)
+        mode (str): sampling или cprofile (sampling, если cprofile в процессе занят)
+        interval (float): Период снятия стеков в режиме sampling, сек
+    """
+
+    def __init__(self, mode: str, interval: float):
+        self.id = os.urandom(8).hex()
+        self.mode = mode
+        self.interval = interval
+        self.started_at = datetime.utcnow()
+        self._thread_id = threading.get_ident()
+        self._stacks = None
+        self._profiler = None
+        self._started = time.perf_counter()
+
+    def start(self) -> None:
+        if self.mode == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profiler = profiler
+            except ValueError as e:
+                # Профилировщик процесса занят другим инструментом (отладчик, coverage)
+                _cprofile_lock.release()
+                logger.info(f"cProfile unavailable: {str(e)}")
+        if self._profiler is None:
+            # Второй cProfile в процессе с Python 3.12 не включится
+            # (ValueError), а до 3.12 отключил бы первый
+            self.mode = 'sampling'
+            self._stacks = sampler.start(self._thread_id, self.interval)
+        self._started = time.perf_counter()
+
+    def finish(self, kind: str, name: str, detail: str) -> dict:
+        """Останавливает профилирование и возвращает запись для буфера"""
+        duration = time.perf_counter() - self._started
+        if self._profiler is not None:
+            try:
+                self._profiler.disable()
+            finally:
+                _cprofile_lock.release()
+            stacks, functions = {}, self._cprofile_functions()
+        else:
+            sampler.stop(self._thread_id)
+            stacks = dict(self._stacks)
+            functions = _sampled_functions(stacks, self.interval)
+        return {
+            'id': self.id,
+            'kind': kind,
+            'name': name,
+            'detail': detail,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(timespec='milliseconds'),
+            'duration': round(duration, 6),
+            'interval': self.interval if self.mode == 'sampling' else None,
+            'samples': sum(stacks.values()),
+            'stacks': stacks,
+            'functions': functions,
+        }
+
+    def _cprofile_functions(self) -> dict:
+        functions = {}
+        for (filename, line, name), (_, calls, self_time, total, _) in \
+                pstats.Stats(self._profiler).stats.items():
+            functions[_frame_label(filename, line, name)] = [self_time, total, calls]
+        return functions
+
+
+def _sampled_functions(stacks: dict, interval: float) -> dict:
+    """Собственное и полное время функций по стекам: [self, total, None]"""
+    functions = {}
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        seconds = count * interval
+        for label in set(frames):
+            functions.setdefault(label, [0.0, 0.0, None])[1] += seconds
+        functions[frames[-1]][0] += seconds
+    return functions
+
+
+class ProfileStore:
+    """Кольцевой буфер последних профилей: в памяти или файлами в общем каталоге"""
+
+    def __init__(self, size: int, directory=None):
+        self.size = size
+        self.directory = Path(directory) if directory else None
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, record: dict) -> None:
+        if self.directory is None:
+            with self._lock:
+                self._records.append(record)
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.profile-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(record, fh)
+            os.replace(tmp_path, self.directory / f'{time.time_ns()}-{record["id"]}.json')
+            for path in self._paths()[self.size:]:
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Profile save error: {str(e)}")
+
+    def _paths(self) -> list:
+        # Имя начинается со времени записи: новые - первыми
+        return sorted(self.directory.glob('*.json'), reverse=True)
+
+    def records(self) -> list:
+        """Профили от новых к старым"""
+        if self.directory is None:
+            with self._lock:
+                return list(reversed(self._records))
+        records = []
+        for path in self._paths()[:self.size]:
+            try:
+                records.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def get(self, profile_id: str):
+        if self.directory is None:
+            with self._lock:
+                return next((r for r in self._records if r['id'] == profile_id), None)
+        for path in self.directory.glob(f'*-{profile_id}.json'):
+            try:
+                return json.loads(path.read_text())
+            except (OSError, ValueError):
+                return None
+        return None
+
+
+def hot_spots(records: list, limit: int = HOT_SPOTS_LIMIT) -> dict:
+    """
+    Горячие точки по маршрутам и задачам, сложенные по профилям.
+
+    Returns:
+        dict: {имя: {'profiles', 'seconds', 'functions': [...]}}, функции
+        отсортированы по собственному времени
+    """
+    groups = {}
+    for record in records:
+        group = groups.setdefault(record['name'], {'profiles': 0, 'seconds': 0.0, 'functions': {}})
+        group['profiles'] += 1
+        group['seconds'] += record['duration']
+        for label, (self_time, total, calls) in record['functions'].items():
+            totals = group['functions'].setdefault(label, [0.0, 0.0, None])
+            totals[0] += self_time
+            totals[1] += total
+            if calls is not None:
+                totals[2] = (totals[2] or 0) + calls
+
+    result = {}
+    for name, group in groups.items():
+        top = sorted(group['functions'].items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        result[name] = {
+            'profiles': group['profiles'],
+            'seconds': round(group['seconds'], 6),
+            'functions': [
+                {'function': label, 'self_seconds': round(self_time, 6),
+                 'total_seconds': round(total, 6), 'calls': calls}
+                for label, (self_time, total, calls) in top
+            ],
+        }
+    return result
+
+
+def folded(records: list) -> str:
+    """Свернутые стеки профилей одним текстом (строка: стек число_выборок)"""
+    stacks = Counter()
+    for record in records:
+        stacks.update(record['stacks'])
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def _sampled(rate: float) -> bool:
+    return bool(rate) and random.random() < rate
+
+
+def _token_matches(token) -> bool:
+    supplied = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
+
+
+def _requested_mode(config):
+    """Режим из заголовка, если запрос вправе его задать"""
+    mode = request.headers.get(config['PROFILING_HEADER'], '').strip().lower()
+    if not mode:
+        return None
+    if mode not in MODES:
+        mode = config['PROFILING_MODE']
+    if _token_matches(config['PROFILING_TOKEN']):
+        return mode
+    if current_user.is_authenticated and current_user.is_admin:
+        return mode
+    return None
+
+
+def _start_request():
+    config = current_app.config
+    mode = _requested_mode(config)
+    if mode is None:
+        if not _sampled(config['PROFILING_SAMPLE_RATE']):
+            return
+        mode = config['PROFILING_MODE']
+    profile = Profile(mode, config['PROFILING_INTERVAL'])
+    profile.start()
+    g.profile = profile
+
+
+def _finish_request(response):
+    profile = g.get('profile')
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+
+def _teardown_request(error=None):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    record = profile.finish('request', request.endpoint or 'unmatched', f'{request.method} {request.path}')
+    current_app.extensions['profiles'].add(record)
+
+
+def init_profiling(app) -> None:
+    """Подключает профилирование к приложению, если оно включено"""
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.extensions['profiles'] = ProfileStore(app.config['PROFILING_BUFFER'], app.config['PROFILING_DIR'])
+    # Первым среди before_request: в профиль попадают все обработчики запроса
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(profiling_bp)
+
+
+# task_id -> профиль выполняемой задачи
+_task_profiles = {}
+
+
+def start_task_profile(task_id: str, config) -> None:
+    """Начинает профиль задачи Celery, если она попала в выборку (config - класс Config)"""
+    if not config.PROFILING_ENABLED or not config.PROFILING_DIR:
+        return
+    if not _sampled(config.PROFILING_TASK_SAMPLE_RATE):
+        return
+    profile = Profile(config.PROFILING_MODE, config.PROFILING_INTERVAL)
+    profile.start()
+    _task_profiles[task_id] = profile
+
+
+def finish_task_profile(task_id: str, name: str, state, config) -> None:
+    """Сохраняет профиль задачи в PROFILING_DIR"""
+    profile = _task_profiles.pop(task_id, None)
+    if profile is None:
+        return
+    record = profile.finish('task', name, f'{task_id} {state or "UNKNOWN"}')
+    ProfileStore(config.PROFILING_BUFFER, config.PROFILING_DIR).add(record)
+
+
+@profiling_bp.before_request
+def _authorize():
+    if _token_matches(current_app.config['PROFILING_TOKEN']):
+        return None
+    if not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    return None
+
+
+def _store() -> ProfileStore:
+    return current_app.extensions['profiles']
+
+
+def _selected(records: list) -> list:
+    name = request.args.get('name')
+    return [r for r in records if r['name'] == name] if name else records
+
+
+@profiling_bp.route('')
+def list_profiles():
+    """Последние профили и горячие точки по маршрутам; ?name= - одна группа"""
+    records = _selected(_store().records())
+    return jsonify({
+        'profiles': [
+            {key: record[key] for key in
+             ('id', 'kind', 'name', 'detail', 'mode', 'started_at', 'duration', 'samples')}
+            for record in records
+        ],
+        'hot_spots': hot_spots(records, request.args.get('limit', HOT_SPOTS_LIMIT, type=int)),
+    })
+
+
+@profiling_bp.route('/folded')
+def folded_profiles():
+    """Свернутые стеки всех профилей буфера (или группы ?name=) для flame graph"""
+    return Response(folded(_selected(_store().records())), content_type='text/plain; charset=utf-8')
+
+
+@profiling_bp.route('/<profile_id>')
+def get_profile(profile_id):
+    """Профиль целиком в JSON"""
+    record = _store().get(profile_id) if PROFILE_ID.fullmatch(profile_id) else None
+    if record is None:
+        abort(404)
+    return jsonify(record)
+
+
+@profiling_bp.route('/<profile_id>.folded')
+def get_profile_folded(profile_id):
+    """Свернутые стеки одного профиля"""
+    record = _store().get(profile_id) if PROFILE_ID.fullmatch(profile_id) else None
+    if record is None:
+        abort(404)
+    return Response(folded([record]), content_type='text/plain; charset=utf-8')
@@ -0,0 +1,193 @@
+"""
+Модуль quota.py - учет занятого места и квоты пользователей.
+
+Счетчики хранятся прямо в таблице users и меняются атомарными
+UPDATE users SET col = col + :delta в той же транзакции, что и сама
+операция с файлом, поэтому для показа занятого места и статистики не
+нужен SUM(files.size) по всем строкам.
+
+Счетчики входят в кэшированный снимок пользователя сессии (users.py),
+поэтому каждое их изменение сбрасывает этот снимок.
+
+Семантика счетчиков:
+- bytes_used: все байты пользователя, включая корзину (учитываются в квоте)
+- file_count: файлы вне корзины
+- trash_bytes, trash_count: файлы в корзине
+Каждое изменение счетчиков увеличивает и версию изменений пользователя
+(change_version, см. users.touch_user).
+"""
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, func, select, update
+
+from app import db
+from app.models import User, File
+from app.users import invalidate_user
+
+quota_cli = AppGroup('quota', help='Учет занятого места пользователей.')
+
+
+def quota_limit(user: User):
+    """Квота пользователя в байтах (None - без ограничений)"""
+    if user.quota_bytes is not None:
+        return user.quota_bytes
+    return current_app.config['DEFAULT_QUOTA_BYTES']
+
+
+def has_room_for(user: User, size: int) -> bool:
+    """
+    Быстрая проверка до приема данных по уже загруженному объекту пользователя.
+
+    Окончательную проверку выполняет reserve_space атомарно в базе.
+    """
+    limit = quota_limit(user)
+    return limit is None or user.bytes_used + size <= limit
+
+
+def reserve_space(user_id: int, size: int) -> bool:
+    """
+    Учитывает новый файл, если он помещается в квоту.
+
+    Условие проверяется в самом UPDATE, поэтому параллельные загрузки
+    не могут вместе превысить квоту.
+
+    Returns:
+        bool: False, если квота будет превышена (счетчики не изменены)
+    """
+    default = current_app.config['DEFAULT_QUOTA_BYTES']
+    stmt = update(User).where(User.id == user_id).values(
+        bytes_used=User.bytes_used + size,
+        file_count=User.file_count + 1,
+        change_version=User.change_version + 1
+    )
+    if default is None:
+        stmt = stmt.where(
+            (User.quota_bytes.is_(None)) | (User.bytes_used + size <= User.quota_bytes)
+        )
+    else:
+        stmt = stmt.where(
+            User.bytes_used + size <= func.coalesce(User.quota_bytes, default)
+        )
+    reserved = bool(db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount)
+    if reserved:
+        invalidate_user(user_id)
+    return reserved
+
+
+def adjust_usage(user_id: int, bytes_used: int = 0, file_count: int = 0,
+                 trash_bytes: int = 0, trash_count: int = 0) -> None:
+    """Атомарно изменяет счетчики пользователя на заданные величины"""
+    db.session.execute(
+        update(User).where(User.id == user_id).values(
+            bytes_used=User.bytes_used + bytes_used,
+            file_count=User.file_count + file_count,
+            trash_bytes=User.trash_bytes + trash_bytes,
+            trash_count=User.trash_count + trash_count,
+            change_version=User.change_version + 1
+        ).execution_options(synchronize_session=False)
+    )
+    invalidate_user(user_id)
+
+
+def adjust_usage_many(deltas: dict) -> None:
+    """
+    Пакетный вариант adjust_usage: один executemany на набор пользователей.
+
+    Args:
+        deltas (dict): user_id -> dict с изменениями bytes_used, file_count,
+                       trash_bytes, trash_count (отсутствующие ключи - 0)
+    """
+    if not deltas:
+        return
+    users = User.__table__
+    db.session.execute(
+        update(users).where(users.c.id == bindparam('uid')).values(
+            bytes_used=users.c.bytes_used + bindparam('d_bytes_used'),
+            file_count=users.c.file_count + bindparam('d_file_count'),
+            trash_bytes=users.c.trash_bytes + bindparam('d_trash_bytes'),
+            trash_count=users.c.trash_count + bindparam('d_trash_count'),
+            change_version=users.c.change_version + 1
+        ),
+        [{
+            'uid': user_id,
+            'd_bytes_used': delta.get('bytes_used', 0),
+            'd_file_count': delta.get('file_count', 0),
+            'd_trash_bytes': delta.get('trash_bytes', 0),
+            'd_trash_count': delta.get('trash_count', 0),
+        } for user_id, delta in deltas.items()]
+    )
+    invalidate_user(*deltas)
+
+
+def move_to_trash(file: File) -> None:
+    adjust_usage(file.user_id, file_count=-1, trash_bytes=file.size, trash_count=1)
+
+
+def restore_from_trash(file: File) -> None:
+    adjust_usage(file.user_id, file_count=1, trash_bytes=-file.size, trash_count=-1)
+
+
+def release_space(file: File) -> None:
+    """Учитывает окончательное удаление файла из корзины"""
+    adjust_usage(file.user_id, bytes_used=-file.size, trash_bytes=-file.size, trash_count=-1)
+
+
+def reconcile_usage(batch_size: int = 1000) -> int:
+    """
+    Пересчитывает счетчики всех пользователей по таблице files.
+
+    Пользователи обрабатываются окнами по первичному ключу: один
+    агрегирующий запрос по files и один пакетный UPDATE на окно.
+
+    Returns:
+        int: Количество обработанных пользователей
+    """
+    last_id = 0
+    processed = 0
+    while True:
+        user_ids = db.session.scalars(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).all()
+        if not user_ids:
+            break
+
+        totals = {
+            row.user_id: row for row in db.session.execute(
+                select(
+                    File.user_id,
+                    func.coalesce(func.sum(File.size), 0).label('bytes_used'),
+                    func.sum(case((File.is_deleted == False, 1), else_=0)).label('file_count'),
+                    func.sum(case((File.is_deleted == True, File.size), else_=0)).label('trash_bytes'),
+                    func.sum(case((File.is_deleted == True, 1), else_=0)).label('trash_count'),
+                ).where(File.user_id.in_(user_ids)).group_by(File.user_id)
+            )
+        }
+
+        params = []
+        for user_id in user_ids:
+            row = totals.get(user_id)
+            params.append({
+                'id': user_id,
+                'bytes_used': row.bytes_used if row else 0,
+                'file_count': row.file_count if row else 0,
+                'trash_bytes': row.trash_bytes if row else 0,
+                'trash_count': row.trash_count if row else 0,
+            })
+        db.session.execute(update(User), params)
+        invalidate_user(*user_ids)
+        db.session.commit()
+
+        last_id = user_ids[-1]
+        processed += len(user_ids)
+    return processed
+
+
+@quota_cli.command('reconcile')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Количество пользователей в одной транзакции.')
+def reconcile_command(batch_size):
+    """Пересчитывает счетчики занятого места по таблице файлов."""
+    processed = reconcile_usage(batch_size)
+    click.echo(f"Счетчики пересчитаны для {processed} пользователей")
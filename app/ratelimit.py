@@ -0,0 +1,75 @@
+"""
+Модуль ratelimit.py - ограничение частоты попыток входа.
+
+Каждому IP-адресу и каждому имени пользователя соответствует ведро
+токенов: ведро вмещает burst токенов и пополняется со скоростью rate
+токенов в секунду, попытка входа расходует один токен. Подбор паролей
+с одного адреса или к одной учетной записи упирается в rate, а
+обычный пользователь, ошибившийся паролем пару раз, ограничения не
+замечает.
+
+Состояние хранится в памяти процесса (TTLCache): ведро, которое успело
+наполниться, просто забывается. При нескольких воркерах лимит
+действует в каждом из них отдельно.
+
+Адрес клиента - request.remote_addr. За обратным прокси это адрес самого
+прокси, поэтому нужно задать PROXY_FIX_X_FOR (число доверенных прокси),
+иначе все клиенты делят одно ведро.
+"""
+
+import math
+import threading
+import time
+
+from flask import current_app, request
+
+from app.cache import TTLCache
+
+
+class TokenBucketLimiter:
+    """Набор ведер токенов по ключам"""
+
+    def __init__(self, maxsize: int = 100000):
+        self._buckets = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate: float, burst: int) -> float:
+        """
+        Расходует токен из ведра key.
+
+        Returns:
+            float: 0, если попытка разрешена, иначе через сколько секунд
+                   появится следующий токен
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets.set(key, (tokens, now), ttl=burst / rate)
+                return (1 - tokens) / rate
+            self._buckets.set(key, (tokens - 1, now), ttl=burst / rate)
+            return 0.0
+
+
+login_limiter = TokenBucketLimiter()
+
+
+def login_retry_after(username: str = None) -> int:
+    """
+    Проверяет лимиты попыток для адреса клиента и, если задано, имени.
+
+    Returns:
+        int: 0, если попытку можно выполнить, иначе значение Retry-After в секундах
+    """
+    config = current_app.config
+    if not config['LOGIN_RATE_LIMIT']:
+        return 0
+    wait = login_limiter.take(
+        ('ip', request.remote_addr), config['LOGIN_IP_RATE'], config['LOGIN_IP_BURST']
+    )
+    if username and not wait:
+        wait = login_limiter.take(
+            ('user', username.lower()), config['LOGIN_USER_RATE'], config['LOGIN_USER_BURST']
+        )
+    return math.ceil(wait)
@@ -14,67 +14,145 @@
 
 from flask import (
     Blueprint, render_template, redirect, url_for,
-    request, flash, send_from_directory, current_app, abort
+    request, flash, send_from_directory, send_file, current_app, abort, make_response
 )
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import hmac
 import logging
 from datetime import datetime, timedelta
 from urllib.parse import quote
+from sqlalchemy import func
 
 from app import db
 from app.forms import RegistrationForm, LoginForm, ShareSettingsForm
-from app.models import User, File, ShareLink
+from app.models import User, File, Folder, ShareLink
+from app.storage import blob_store, add_ref, release_file
+from app.database import read_only
+from app.downloads import is_download_start, send_stored_file
+from app.archives import send_folder_archive
+from app.ingest import uploaded_blob
+from app.sniffing import UploadRejected
+from app.previews import get_preview, schedule_previews
+from app.sharing import resolve_share, count_download, invalidate_shares, delete_file_shares
+from app.search import filter_query
+from app.users import record_login, touch_user
+from app.passwords import HashingBusy, hash_password, verify_password, password_needs_rehash
+from app.ratelimit import login_retry_after
+from app.folders import (
+    FolderError,
+    get_folder,
+    list_children,
+    breadcrumbs,
+    create_folder,
+    rename_folder,
+    trash_folder,
+    restore_folder,
+    adjust_folder_totals,
+    adjust_folder_totals_many,
+    detach_from_trashed_folders,
+    trash_roots_clause,
+    visible_in_trash_clause
+)
+from app.trash import purge_folder
+from app.quota import (
+    has_room_for,
+    reserve_space,
+    move_to_trash,
+    restore_from_trash,
+    release_space
+)
+from app.pagination import keyset_paginate, decode_cursor, cached_count, invalidate_counts
 from app.utils import (
     allowed_file,
     generate_secure_filename,
     validate_file_ownership,
-    handle_database_error
+    handle_database_error,
+    admin_required
 )
 
 main = Blueprint('main', __name__)
 logger = logging.getLogger(__name__)
 
+# Запас на заголовки и границы multipart при предварительной проверке квоты
+MULTIPART_OVERHEAD = 16 * 1024
+
 @main.route('/')
 @login_required
+@read_only
 def index():
     """Главная страница с файлами пользователя"""
     try:
-        page = request.args.get('page', 1, type=int)
         search_query = request.args.get('q', '').strip()
         per_page = current_app.config['ITEMS_PER_PAGE']
+        folder_id = request.args.get('folder', type=int)
+        folder = get_folder(current_user.id, folder_id)
+        if folder_id is not None and folder is None:
+            abort(404)
 
         query = File.query.filter(
             File.user_id == current_user.id,
             File.is_deleted == False
         )
 
+        # Поиск идет по всем папкам, без него - список одной папки
         if search_query:
-            search = f"%{search_query}%"
-            query = query.filter(File.filename.ilike(search))
-
-        files = query.order_by(File.uploaded_at.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+            query = filter_query(query, current_user.id, search_query)
+            folders = []
+        else:
+            query = query.filter(File.folder_id == folder_id)
+            folders = list_children(current_user.id, folder_id)
+
+        files = keyset_paginate(
+            query, File.uploaded_at, File.id, per_page,
+            after=decode_cursor(request.args.get('after')),
+            before=decode_cursor(request.args.get('before'))
         )
+        if current_app.config['LISTING_SHOW_TOTAL']:
+            files.total = cached_count(
+                current_user.id, ('files', folder_id, search_query), query
+            )
 
-        return render_template('main/index.html', files=files)
+        return render_template(
+            'main/index.html',
+            files=files,
+            folder=folder,
+            folders=folders,
+            breadcrumbs=breadcrumbs(folder)
+        )
 
     except Exception as e:
         return handle_database_error(e)
 
+def check_upload_quota():
+    """
+    Проверка размера и квоты загрузки до чтения тела запроса.
+
+    Подключается первым обработчиком before_request приложения (см.
+    init_web): проверка CSRF читает request.form, а разбор формы уже
+    записывает файл на диск, поэтому в самом обработчике проверять поздно.
+    Служебные части multipart учитываются с запасом MULTIPART_OVERHEAD.
+    """
+    if request.endpoint != 'main.upload_file' or request.method != 'POST':
+        return None
+    content_length = request.content_length or 0
+    if content_length > current_app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+    if current_user.is_authenticated and \
+            not has_room_for(current_user, content_length - MULTIPART_OVERHEAD):
+        flash('Недостаточно места: превышена квота', 'danger')
+        return redirect(url_for('main.index'))
+    return None
+
 @main.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
     """Обработка загрузки файлов"""
     try:
-        if request.content_length > current_app.config['MAX_CONTENT_LENGTH']:
-            abort(413)
-
+        # Размер и квота по Content-Length проверены в check_upload_quota
+        # до чтения тела; точная проверка - после записи файла
         if 'file' not in request.files:
             flash('Файл не выбран', 'danger')
             return redirect(url_for('main.index'))
@@ -84,49 +162,96 @@ def upload_file():
             flash('Недопустимый файл', 'danger')
             return redirect(url_for('main.index'))
 
+        folder_id = request.form.get('folder_id', type=int)
+        folder = get_folder(current_user.id, folder_id)
+        if folder_id is not None and folder is None:
+            flash('Папка не найдена', 'danger')
+            return redirect(url_for('main.index'))
+
         filename = generate_secure_filename(file.filename)
-        user_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], str(current_user.id))
-        os.makedirs(user_dir, exist_ok=True)
-        file_path = os.path.join(user_dir, filename)
+        store = blob_store()
+        writer = uploaded_blob(file)
+        blob = store.commit(writer)
 
-        file.save(file_path)
+        if not reserve_space(current_user.id, writer.size):
+            db.session.rollback()
+            store.unlink([writer.digest])
+            flash('Недостаточно места: превышена квота', 'danger')
+            return redirect(url_for('main.index'))
+
+        add_ref(writer.digest, writer.size)
+        adjust_folder_totals(folder, 1, writer.size)
         new_file = File(
             filename=filename,
-            storage_path=file_path,
-            size=os.path.getsize(file_path),
-            user_id=current_user.id
+            storage_path=blob.key,
+            content_hash=writer.digest,
+            size=writer.size,
+            stored_size=blob.stored_size,
+            codec=blob.codec,
+            mime_type=writer.mime_type,
+            user_id=current_user.id,
+            folder_id=folder_id
         )
 
         db.session.add(new_file)
         db.session.commit()
+        invalidate_counts(current_user.id)
+        schedule_previews(new_file)
         flash('Файл успешно загружен', 'success')
         logger.info(f"User {current_user.id} uploaded {filename}")
 
     except RequestEntityTooLarge:
         abort(413)
+    except UploadRejected:
+        raise
     except Exception as e:
         db.session.rollback()
         logger.error(f"Upload error: {str(e)}", exc_info=True)
         flash('Ошибка при загрузке файла', 'danger')
 
-    return redirect(url_for('main.index'))
+    return redirect(url_for('main.index', folder=request.form.get('folder_id', type=int)))
 
 @main.route('/download/<filename>')
 @login_required
 def download_file(filename):
     """Скачивание файла"""
+    file = File.query.filter_by(
+        user_id=current_user.id,
+        filename=filename,
+        is_deleted=False
+    ).first_or_404()
     try:
-        user_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], str(current_user.id))
-        return send_from_directory(
-            user_dir,
-            filename,
-            as_attachment=True,
-            download_name=secure_filename(filename)
-        )
+        return send_stored_file(file, secure_filename(filename))
     except FileNotFoundError:
         logger.warning(f"File not found: {filename}")
         abort(404)
 
+@main.route('/files/<int:file_id>/thumbnail')
+@login_required
+def file_thumbnail(file_id):
+    """
+    Превью файла. Параметр size приводится к одному из THUMBNAIL_SIZES.
+
+    Содержимое файла не меняется, поэтому превью кэшируется браузером
+    на PREVIEW_MAX_AGE без повторных проверок.
+    """
+    file = validate_file_ownership(file_id)
+    path = get_preview(file, request.args.get('size', 256, type=int))
+    if path is None:
+        abort(404)
+
+    response = send_file(
+        path,
+        mimetype='image/jpeg',
+        etag=path.stem,
+        last_modified=file.uploaded_at,
+        max_age=current_app.config['PREVIEW_MAX_AGE']
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 @main.route('/delete/<int:file_id>', methods=['POST'])
 @login_required
 def delete_file(file_id):
@@ -140,9 +265,12 @@ def delete_file(file_id):
 
         file.is_deleted = True
         file.deleted_at = datetime.utcnow()
+        move_to_trash(file)
         db.session.commit()
+        invalidate_counts(current_user.id)
         flash('Файл перемещен в корзину', 'success')
         logger.info(f"User {current_user.id} deleted {file.filename}")
+        return redirect(url_for('main.index', folder=file.folder_id))
 
     except Exception as e:
         db.session.rollback()
@@ -162,9 +290,13 @@ def restore_file(file_id):
             is_deleted=True
         ).first_or_404()
 
+        # Файл из удаленной папки восстанавливается в корень
+        detach_from_trashed_folders([File.id == file.id])
         file.is_deleted = False
         file.deleted_at = None
+        restore_from_trash(file)
         db.session.commit()
+        invalidate_counts(current_user.id)
         flash('Файл успешно восстановлен', 'success')
         logger.info(f"User {current_user.id} restored {file.filename}")
 
@@ -186,9 +318,14 @@ def purge_file(file_id):
             is_deleted=True
         ).first_or_404()
 
-        os.remove(file.storage_path)
+        orphans = release_file(file)
+        release_space(file)
+        adjust_folder_totals_many({file.folder_id: (-1, -file.size)})
+        delete_file_shares([file.id])
         db.session.delete(file)
         db.session.commit()
+        invalidate_counts(current_user.id)
+        blob_store().unlink(orphans)
         flash('Файл удален навсегда', 'success')
         logger.info(f"User {current_user.id} purged {file.filename}")
 
@@ -201,19 +338,141 @@ def purge_file(file_id):
 
 @main.route('/trash')
 @login_required
+@read_only
 def trash():
     """Страница корзины"""
     try:
-        files = File.query.filter_by(
-            user_id=current_user.id,
-            is_deleted=True
-        ).order_by(File.deleted_at.desc()).all()
+        # Содержимое удаленных папок показывается самими папками
+        query = File.query.filter(
+            File.user_id == current_user.id,
+            File.is_deleted == True,
+            visible_in_trash_clause()
+        )
+        folders = Folder.query.filter(
+            Folder.user_id == current_user.id,
+            Folder.is_deleted == True,
+            trash_roots_clause()
+        ).order_by(Folder.deleted_at.desc()).all()
+        files = keyset_paginate(
+            query, File.deleted_at, File.id,
+            current_app.config['ITEMS_PER_PAGE'],
+            after=decode_cursor(request.args.get('after')),
+            before=decode_cursor(request.args.get('before'))
+        )
+        if current_app.config['LISTING_SHOW_TOTAL']:
+            files.total = cached_count(current_user.id, 'trash', query)
 
-        return render_template('main/trash.html', files=files)
+        return render_template('main/trash.html', files=files, folders=folders)
 
     except Exception as e:
         return handle_database_error(e)
 
+@main.route('/folders', methods=['POST'])
+@login_required
+def new_folder():
+    """Создание папки"""
+    parent_id = request.form.get('parent_id', type=int)
+    try:
+        parent = get_folder(current_user.id, parent_id)
+        if parent_id is not None and parent is None:
+            abort(404)
+        create_folder(current_user.id, request.form.get('name', ''), parent)
+        db.session.commit()
+        flash('Папка создана', 'success')
+    except FolderError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder create error: {str(e)}", exc_info=True)
+        flash('Ошибка при создании папки', 'danger')
+
+    return redirect(url_for('main.index', folder=parent_id))
+
+@main.route('/folders/<int:folder_id>/rename', methods=['POST'])
+@login_required
+def rename_folder_view(folder_id):
+    """Переименование папки"""
+    folder = get_folder(current_user.id, folder_id) or abort(404)
+    parent_id = folder.parent_id
+    try:
+        rename_folder(folder, request.form.get('name', ''))
+        db.session.commit()
+        flash('Папка переименована', 'success')
+    except FolderError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder rename error: {str(e)}", exc_info=True)
+        flash('Ошибка при переименовании папки', 'danger')
+
+    return redirect(url_for('main.index', folder=parent_id))
+
+@main.route('/folders/<int:folder_id>/download')
+@login_required
+def download_folder(folder_id):
+    """Скачивание папки ZIP-архивом"""
+    folder = get_folder(current_user.id, folder_id) or abort(404)
+    return send_folder_archive(folder)
+
+@main.route('/folders/<int:folder_id>/delete', methods=['POST'])
+@login_required
+def delete_folder(folder_id):
+    """Перемещение папки со всем содержимым в корзину"""
+    folder = get_folder(current_user.id, folder_id) or abort(404)
+    parent_id = folder.parent_id
+    try:
+        count = trash_folder(folder)
+        db.session.commit()
+        invalidate_counts(current_user.id)
+        flash('Папка перемещена в корзину', 'success')
+        logger.info(f"User {current_user.id} deleted folder {folder_id} ({count} files)")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder delete error: {str(e)}", exc_info=True)
+        flash('Ошибка при удалении папки', 'danger')
+
+    return redirect(url_for('main.index', folder=parent_id))
+
+@main.route('/folders/<int:folder_id>/restore', methods=['POST'])
+@login_required
+def restore_folder_view(folder_id):
+    """Восстановление папки из корзины"""
+    folder = get_folder(current_user.id, folder_id, is_deleted=True) or abort(404)
+    try:
+        count = restore_folder(folder)
+        db.session.commit()
+        invalidate_counts(current_user.id)
+        flash('Папка успешно восстановлена', 'success')
+        logger.info(f"User {current_user.id} restored folder {folder_id} ({count} files)")
+    except FolderError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder restore error: {str(e)}", exc_info=True)
+        flash('Ошибка при восстановлении папки', 'danger')
+
+    return redirect(url_for('main.trash'))
+
+@main.route('/folders/<int:folder_id>/purge', methods=['POST'])
+@login_required
+def purge_folder_view(folder_id):
+    """Полное удаление папки из корзины"""
+    folder = get_folder(current_user.id, folder_id, is_deleted=True) or abort(404)
+    try:
+        files, _ = purge_folder(folder)
+        flash('Папка удалена навсегда', 'success')
+        logger.info(f"User {current_user.id} purged folder {folder_id} ({files} files)")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Folder purge error: {str(e)}", exc_info=True)
+        flash('Ошибка при удалении папки', 'danger')
+    invalidate_counts(current_user.id)
+
+    return redirect(url_for('main.trash'))
+
 @main.route('/share/<int:file_id>', methods=['GET', 'POST'])
 @login_required
 def share_file(file_id):
@@ -225,6 +484,7 @@ def share_file(file_id):
         if form.validate_on_submit():
             # Создание или обновление ссылки
             share_link = ShareLink.query.filter_by(file_id=file.id).first()
+            old_token = share_link.token if share_link else None
 
             if not share_link:
                 share_link = ShareLink(file_id=file.id)
@@ -236,8 +496,11 @@ def share_file(file_id):
             share_link.password = form.password.data
             share_link.download_limit = form.download_limit.data
             share_link.token = os.urandom(16).hex()
+            touch_user(current_user.id)
 
             db.session.commit()
+            if old_token:
+                invalidate_shares([old_token])
             flash('Настройки доступа обновлены', 'success')
             return redirect(url_for('main.share_file', file_id=file.id))
 
@@ -262,41 +525,95 @@ def share_file(file_id):
 @main.route('/shared/<token>', methods=['GET', 'POST'])
 def shared_download(token):
     """Скачивание по общей ссылке"""
-    try:
-        share_link = ShareLink.query.filter_by(token=token).first_or_404()
-        file = File.query.get_or_404(share_link.file_id)
-
-        # Проверка срока действия
-        if share_link.expiration and share_link.expiration < datetime.utcnow():
-            flash('Срок действия ссылки истек', 'danger')
-            abort(410)
-
-        # Проверка пароля
-        if share_link.password:
-            if request.method == 'POST':
-                if request.form.get('password') != share_link.password:
-                    flash('Неверный пароль', 'danger')
-            else:
-                return render_template('shared_password.html')
+    shared = resolve_share(token)
+    if shared is None:
+        abort(404)
 
-        # Проверка лимита скачиваний
-        if share_link.download_limit and share_link.download_count >= share_link.download_limit:
+    # Проверка срока действия
+    if shared.expiration and shared.expiration < datetime.utcnow():
+        flash('Срок действия ссылки истек', 'danger')
+        abort(410)
+
+    # Проверка пароля
+    if shared.password:
+        if request.method != 'POST':
+            return render_template('main/shared_password.html')
+        if not hmac.compare_digest(request.form.get('password', ''), shared.password):
+            flash('Неверный пароль', 'danger')
+            return render_template('main/shared_password.html'), 403
+
+    folder = None
+    if shared.folder_id is not None:
+        folder = Folder.query.filter_by(id=shared.folder_id, is_deleted=False).first_or_404()
+
+    if folder is not None:
+        response = send_folder_archive(folder)
+    else:
+        response = send_stored_file(shared, quote(shared.filename))
+
+    # Учет скачивания с проверкой лимита: HEAD, 304 и докачка не засчитываются
+    if is_download_start(response, shared.size or 0):
+        try:
+            counted = count_download(shared)
+        except Exception as e:
+            response.close()
+            db.session.rollback()
+            logger.error(f"Shared download error: {str(e)}", exc_info=True)
+            abort(500)
+        if not counted:
+            response.close()
             flash('Лимит скачиваний исчерпан', 'danger')
             abort(410)
+    return response
 
-        share_link.download_count += 1
-        db.session.commit()
+@main.route('/admin')
+@admin_required
+def admin_dashboard():
+    """
+    Панель управления администратора.
+
+    Суммарные объемы берутся из счетчиков в таблице users, а не из
+    агрегатов по всей таблице files.
+    """
+    try:
+        now = datetime.utcnow()
+        totals = db.session.query(
+            func.count(User.id),
+            func.coalesce(func.sum(User.file_count), 0),
+            func.coalesce(func.sum(User.bytes_used), 0)
+        ).one()
+
+        users_stats = {
+            'total': totals[0],
+            'last_week': User.query.filter(
+                User.created_at >= now - timedelta(days=7)
+            ).count()
+        }
+        files_stats = {
+            'total': totals[1],
+            'total_size': totals[2],
+            'last_24h': File.query.filter(
+                File.uploaded_at >= now - timedelta(days=1)
+            ).count()
+        }
 
-        return send_from_directory(
-            os.path.dirname(file.storage_path),
-            os.path.basename(file.storage_path),
-            as_attachment=True,
-            download_name=quote(file.filename)
+        return render_template(
+            'admin/dashboard.html',
+            users_stats=users_stats,
+            files_stats=files_stats,
+            recent_files=File.query.order_by(File.uploaded_at.desc()).limit(10).all(),
+            recent_users=User.query.order_by(User.created_at.desc()).limit(10).all()
         )
 
     except Exception as e:
-        logger.error(f"Shared download error: {str(e)}", exc_info=True)
-        abort(404)
+        return handle_database_error(e)
+
+def too_many_attempts(template: str, form, retry_after: int):
+    """Ответ 429 на форму входа или регистрации при превышении лимита"""
+    flash('Слишком много попыток. Повторите через несколько секунд', 'danger')
+    response = make_response(render_template(template, form=form), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 @main.route('/register', methods=['GET', 'POST'])
 def register() -> str:
@@ -313,6 +630,9 @@ def register() -> str:
     form = RegistrationForm()
     
     if form.validate_on_submit():
+        retry_after = login_retry_after()
+        if retry_after:
+            return too_many_attempts('auth/register.html', form, retry_after)
         try:
             # Проверка уникальности имени пользователя
             existing_user = User.query.filter_by(
@@ -324,10 +644,7 @@ def register() -> str:
                 return redirect(url_for('main.register'))
 
             # Создание нового пользователя
-            hashed_password = generate_password_hash(
-                form.password.data,
-                method='pbkdf2:sha256'
-            )
+            hashed_password = hash_password(form.password.data)
             
             user = User(
                 username=form.username.data,
@@ -339,6 +656,9 @@ def register() -> str:
             flash('Аккаунт успешно создан! Можете войти', 'success')
             return redirect(url_for('main.login'))
 
+        except HashingBusy:
+            db.session.rollback()
+            return too_many_attempts('auth/register.html', form, 1)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Registration error: {str(e)}", exc_info=True)
@@ -364,21 +684,30 @@ def login() -> str:
     form = LoginForm()
     
     if form.validate_on_submit():
+        retry_after = login_retry_after(form.username.data)
+        if retry_after:
+            return too_many_attempts('auth/login.html', form, retry_after)
         try:
             user = User.query.filter_by(
                 username=form.username.data
             ).first()
             
-            if user and check_password_hash(user.password_hash, form.password.data):
-                # Обновление времени последнего входа
+            if user and verify_password(user.password_hash, form.password.data):
+                # Хеш старого алгоритма или стоимости пересчитывается, пока известен пароль
+                if password_needs_rehash(user.password_hash):
+                    user.password_hash = hash_password(form.password.data)
+                    db.session.commit()
                 login_user(user)
-                user.last_login = datetime.utcnow()
-                db.session.commit()
+                # Время входа записывается пакетно, без коммита на каждый вход
+                record_login(user.id)
                 flash('Вы успешно вошли в систему', 'success')
                 return redirect(url_for('main.index'))
             
             flash('Неверные учетные данные', 'danger')
 
+        except HashingBusy:
+            db.session.rollback()
+            return too_many_attempts('auth/login.html', form, 1)
         except Exception as e:
             logger.error(f"Login error: {str(e)}", exc_info=True)
             flash('Ошибка при входе в систему', 'danger')
@@ -444,6 +773,19 @@ def file_too_large(error) -> tuple:
     """
     return render_template('errors/413.html'), 413
 
+
+@main.errorhandler(UploadRejected)
+def upload_rejected(error):
+    """
+    Обрабатывает отклоненную загрузку: содержимое не соответствует типу.
+
+    Тело запроса может быть разобрано еще до обработчика (проверка
+    CSRF читает форму), поэтому ошибка обрабатывается здесь, а не в upload_file.
+    """
+    logger.warning(f"Upload rejected: {error.description}")
+    flash(error.description, 'danger')
+    return redirect(url_for('main.index'))
+
 @main.route('/favicon.ico')
 def favicon():
     return send_from_directory(
@@ -0,0 +1,181 @@
+"""
+Модуль search.py - полнотекстовый поиск по именам файлов.
+
+Вместо File.filename.ilike('%q%'), который всегда читает все строки
+пользователя, используется индекс:
+- SQLite: виртуальная таблица FTS5 files_fts (без хранения содержимого),
+  которую поддерживают в актуальном состоянии триггеры на таблице files.
+  Владелец индексируется токеном u<user_id>, поэтому отбор по
+  пользователю тоже выполняется внутри индекса.
+- PostgreSQL: GIN-индекс по tsvector от имени файла для поиска по словам
+  и префиксам и trigram-индекс (pg_trgm) для ранжирования по сходству.
+
+Если индекс не создан (база собрана через db.create_all, другая СУБД),
+поиск откатывается на ILIKE.
+"""
+
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, literal_column, text
+
+from app import db
+from app.models import File
+
+search_cli = AppGroup('search', help='Обслуживание поискового индекса.')
+
+# Части имени файла: буквы и цифры, разделители (_ . - пробел) отбрасываются
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TOKENS = 8
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+        filename, owner, content='', prefix='2 3',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, filename, owner)
+        VALUES (new.id, new.filename, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename, owner)
+        VALUES ('delete', old.id, old.filename, 'u' || old.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF filename, user_id ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename, owner)
+        VALUES ('delete', old.id, old.filename, 'u' || old.user_id);
+        INSERT INTO files_fts(rowid, filename, owner)
+        VALUES (new.id, new.filename, 'u' || new.user_id);
+    END""",
+]
+
+# Выражение должно совпадать с индексом ix_files_filename_tsv из миграции
+PG_TSVECTOR = "to_tsvector('simple', regexp_replace(files.filename, '[_.\\-]+', ' ', 'g'))"
+
+# engine.url -> 'sqlite' | 'postgresql' | None
+_backends = {}
+
+
+def tokenize(query: str) -> list:
+    """Разбивает поисковую строку на слова"""
+    return TOKEN_RE.findall(query.lower())[:MAX_TOKENS]
+
+
+def search_backend():
+    """Определяет доступный поисковый индекс для текущей базы"""
+    engine = db.engine
+    key = str(engine.url)
+    if key not in _backends:
+        backend = None
+        if engine.dialect.name == 'sqlite':
+            exists = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+            )).first()
+            backend = 'sqlite' if exists else None
+        elif engine.dialect.name == 'postgresql':
+            backend = 'postgresql'
+        _backends[key] = backend
+    return _backends[key]
+
+
+def _fts5_match(user_id: int, tokens: list) -> str:
+    # Каждое слово - префиксный запрос; кавычки экранируются удвоением
+    terms = ' AND '.join('"{}"*'.format(t.replace('"', '""')) for t in tokens)
+    return f'owner:u{user_id} AND filename:({terms})'
+
+
+def _pg_tsquery(tokens: list) -> str:
+    return ' & '.join(f'{t}:*' for t in tokens)
+
+
+def match_clause(user_id: int, search_query: str):
+    """
+    Условие WHERE для файлов пользователя, имя которых подходит под поиск.
+
+    Годится и для SELECT, и для пакетных UPDATE/DELETE по таблице files.
+    """
+    tokens = tokenize(search_query)
+    if not tokens:
+        return File.filename.ilike(f"%{search_query}%")
+
+    backend = search_backend()
+    if backend == 'sqlite':
+        matches = text(
+            "SELECT rowid FROM files_fts WHERE files_fts MATCH :match"
+        ).bindparams(match=_fts5_match(user_id, tokens))
+        return File.id.in_(matches.columns(literal_column('rowid')))
+    if backend == 'postgresql':
+        return text(
+            f"{PG_TSVECTOR} @@ to_tsquery('simple', :tsquery)"
+        ).bindparams(tsquery=_pg_tsquery(tokens))
+    return File.filename.ilike(f"%{search_query}%")
+
+
+def filter_query(query, user_id: int, search_query: str):
+    """
+    Ограничивает запрос к File файлами, имя которых подходит под поиск.
+
+    Порядок сортировки не меняется, поэтому фильтр совместим
+    с keyset-пагинацией списка файлов.
+    """
+    return query.filter(match_clause(user_id, search_query))
+
+
+def ranked_search(user_id: int, search_query: str, limit: int = 10) -> list:
+    """
+    Файлы пользователя, подходящие под поиск, в порядке релевантности.
+
+    Returns:
+        list: Не более limit объектов File (без удаленных в корзину)
+    """
+    tokens = tokenize(search_query)
+    if not tokens:
+        return []
+
+    base = File.query.filter(File.user_id == user_id, File.is_deleted == False)
+    backend = search_backend()
+
+    if backend == 'sqlite':
+        ranked = db.session.execute(text(
+            "SELECT rowid FROM files_fts WHERE files_fts MATCH :match "
+            "ORDER BY bm25(files_fts) LIMIT :limit"
+        ), {'match': _fts5_match(user_id, tokens), 'limit': limit * 2}).scalars().all()
+        files = {f.id: f for f in base.filter(File.id.in_(ranked))}
+        return [files[i] for i in ranked if i in files][:limit]
+
+    if backend == 'postgresql':
+        return base.filter(text(
+            f"{PG_TSVECTOR} @@ to_tsquery('simple', :tsquery)"
+        ).bindparams(tsquery=_pg_tsquery(tokens))).order_by(
+            func.similarity(File.filename, search_query).desc(),
+            File.uploaded_at.desc()
+        ).limit(limit).all()
+
+    return base.filter(
+        File.filename.ilike(f"%{search_query}%")
+    ).order_by(File.uploaded_at.desc()).limit(limit).all()
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Создает (при необходимости) и заново заполняет поисковый индекс."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO files_fts(files_fts) VALUES ('delete-all')"))
+        db.session.execute(text(
+            "INSERT INTO files_fts(rowid, filename, owner) "
+            "SELECT id, filename, 'u' || user_id FROM files"
+        ))
+    elif dialect == 'postgresql':
+        db.session.execute(text("REINDEX INDEX ix_files_filename_tsv"))
+        db.session.execute(text("REINDEX INDEX ix_files_filename_trgm"))
+    else:
+        click.echo(f"Поисковый индекс для {dialect} не поддерживается, используется ILIKE")
+        return
+
+    db.session.commit()
+    _backends.clear()
+    count = File.query.count()
+    click.echo(f"Индекс перестроен: {count} файлов")
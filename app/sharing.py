@@ -0,0 +1,249 @@
+"""
+Модуль sharing.py - разрешение общих ссылок и учет скачиваний.
+
+Популярная ссылка может получать сотни запросов в секунду, поэтому:
+- метаданные ссылки и файла кэшируются и на промахе читаются одним
+  запросом с JOIN: в памяти процесса на SHARE_CACHE_LOCAL_TTL секунд и,
+  если задан CACHE_REDIS_URL, в общем кэше процессов на SHARE_CACHE_TTL
+  секунд; изменение или удаление ссылки сбрасывает общий кэш сразу, а
+  другие процессы видят старые настройки не дольше SHARE_CACHE_LOCAL_TTL
+- при заданном лимите скачивание засчитывается атомарным условным
+  UPDATE, так что параллельные запросы не превышают лимит
+- без лимита счетчики копятся в памяти и записываются в базу одним
+  пакетным UPDATE фоновым потоком раз в SHARE_COUNT_FLUSH_INTERVAL секунд
+  и при завершении процесса; при аварийной остановке теряется не больше
+  одного интервала
+"""
+
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, select, update
+
+from app import db
+from app.cache import TTLCache
+from app.database import BufferFlusher
+from app.models import File, ShareLink
+
+logger = logging.getLogger(__name__)
+
+# Передний кэш процесса: token -> снимок SharedFile ({} для несуществующего токена)
+share_cache = TTLCache(maxsize=10000, ttl=2)
+
+
+class SharedFile:
+    """
+    Снимок общей ссылки и файла, достаточный для отдачи без ORM-объектов.
+
+    Совместим с send_stored_file по атрибутам файла. У ссылки на папку
+    атрибуты файла равны None.
+
+    Атрибуты:
+        link_id (int): Идентификатор ссылки
+        file_id (int): Идентификатор файла
+        folder_id (int): Идентификатор папки
+        filename (str): Имя файла
+        storage_path (str): Ключ данных в хранилище
+        content_hash (str): SHA-256 содержимого
+        size (int): Размер файла
+        codec (str): Кодек сжатия блоба на диске
+        mime_type (str): MIME-тип содержимого
+        uploaded_at (datetime): Дата загрузки
+        expiration (datetime): Срок действия ссылки
+        password (str): Пароль ссылки
+        download_limit (int): Лимит скачиваний (0 - без ограничений)
+    """
+
+    __slots__ = ('link_id', 'file_id', 'folder_id', 'filename', 'storage_path', 'content_hash',
+                 'size', 'codec', 'mime_type', 'uploaded_at', 'expiration', 'password',
+                 'download_limit')
+
+    # Колонки с датой и временем хранятся в кэше строками ISO 8601
+    DATETIME_FIELDS = ('uploaded_at', 'expiration')
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values[name])
+
+    def snapshot(self) -> dict:
+        """Значения, пригодные для JSON (общий кэш процессов)"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        for name in self.DATETIME_FIELDS:
+            if values[name] is not None:
+                values[name] = values[name].isoformat()
+        return values
+
+    @classmethod
+    def from_snapshot(cls, values: dict):
+        values = dict(values)
+        for name in cls.DATETIME_FIELDS:
+            if values[name] is not None:
+                values[name] = datetime.fromisoformat(values[name])
+        return cls(**values)
+
+
+def _caches() -> tuple:
+    shared = current_app.extensions['shared_cache']
+    if isinstance(shared, TTLCache):
+        # Без Redis общего кэша нет: только короткий кэш процесса
+        return (share_cache,)
+    return (share_cache, shared)
+
+
+def resolve_share(token: str):
+    """
+    Находит ссылку и файл по токену, используя кэш.
+
+    Для ссылки на папку кэшируется только сама ссылка: состояние папки
+    проверяется при каждом скачивании.
+
+    Returns:
+        SharedFile: данные ссылки или None, если токен не найден
+    """
+    key = f'share:{token}'
+    caches = _caches()
+    for index, cache in enumerate(caches):
+        values = cache.get(key)
+        if values is not None:
+            for front in caches[:index]:
+                front.set(key, values, current_app.config['SHARE_CACHE_LOCAL_TTL'])
+            return SharedFile.from_snapshot(values) if values else None
+
+    row = db.session.execute(
+        select(
+            ShareLink.id.label('link_id'),
+            ShareLink.expiration,
+            ShareLink.password,
+            ShareLink.download_limit,
+            ShareLink.folder_id,
+            File.id.label('file_id'),
+            File.filename,
+            File.storage_path,
+            File.content_hash,
+            File.size,
+            File.codec,
+            File.mime_type,
+            File.uploaded_at,
+        ).outerjoin(File, File.id == ShareLink.file_id).where(ShareLink.token == token)
+    ).first()
+    shared = SharedFile(**row._mapping) if row else None
+    values = shared.snapshot() if shared else {}
+    for cache in caches:
+        cache.set(key, values, current_app.config['SHARE_CACHE_LOCAL_TTL']
+                  if cache is share_cache else current_app.config['SHARE_CACHE_TTL'])
+    return shared
+
+
+def invalidate_shares(tokens) -> None:
+    """Удаляет ссылки из кэша после изменения или удаления"""
+    caches = _caches()
+    for token in tokens:
+        for cache in caches:
+            cache.delete(f'share:{token}')
+
+
+def delete_file_shares(file_ids) -> None:
+    """Удаляет ссылки на файлы (без коммита) и сбрасывает их кэш"""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    tokens = db.session.scalars(
+        select(ShareLink.token).where(ShareLink.file_id.in_(file_ids))
+    ).all()
+    if tokens:
+        db.session.execute(
+            delete(ShareLink).where(ShareLink.file_id.in_(file_ids))
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_shares(tokens)
+
+
+def delete_folder_shares(folder_ids) -> None:
+    """Удаляет ссылки на папки (без коммита) и сбрасывает их кэш"""
+    folder_ids = list(folder_ids)
+    if not folder_ids:
+        return
+    tokens = db.session.scalars(
+        select(ShareLink.token).where(ShareLink.folder_id.in_(folder_ids))
+    ).all()
+    if tokens:
+        db.session.execute(
+            delete(ShareLink).where(ShareLink.folder_id.in_(folder_ids))
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_shares(tokens)
+
+
+class DownloadCounter:
+    """
+    Буфер счетчиков скачиваний для ссылок без лимита.
+
+    В базу буфер пишет фоновый поток (BufferFlusher), запущенный первым
+    скачиванием в процессе.
+    """
+
+    def __init__(self):
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self.flusher = BufferFlusher(self.flush, 'download-counter')
+
+    def add(self, link_id: int, interval: float) -> None:
+        """Засчитывает скачивание; буфер пишется в базу раз в interval секунд"""
+        with self._lock:
+            self._pending[link_id] += 1
+        self.flusher.start(current_app._get_current_object(), interval)
+
+    def flush(self) -> None:
+        """Записывает накопленные счетчики (нужен контекст приложения)"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        self._write(pending)
+
+    def _write(self, pending: Counter) -> None:
+        if not pending:
+            return
+        links = ShareLink.__table__
+        try:
+            db.session.execute(
+                update(links).where(links.c.id == bindparam('link_id')).values(
+                    download_count=links.c.download_count + bindparam('downloads')
+                ),
+                [{'link_id': link_id, 'downloads': count} for link_id, count in pending.items()]
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Download counter flush error: {str(e)}")
+            with self._lock:
+                self._pending.update(pending)
+
+
+download_counter = DownloadCounter()
+
+
+def count_download(shared: SharedFile) -> bool:
+    """
+    Засчитывает скачивание по ссылке.
+
+    Returns:
+        bool: False, если лимит скачиваний уже исчерпан
+    """
+    if not shared.download_limit:
+        download_counter.add(
+            shared.link_id, current_app.config['SHARE_COUNT_FLUSH_INTERVAL']
+        )
+        return True
+
+    counted = db.session.execute(
+        update(ShareLink).where(
+            ShareLink.id == shared.link_id,
+            ShareLink.download_count < ShareLink.download_limit
+        ).values(
+            download_count=ShareLink.download_count + 1
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return bool(counted)
@@ -0,0 +1,129 @@
+"""
+Модуль sniffing.py - определение типа содержимого загружаемых файлов.
+
+Расширение имени ничего не говорит о содержимом, поэтому тип файла
+определяется по сигнатуре (magic bytes) в первых SNIFF_SIZE байтах.
+Проверка встроена в прием загрузки: BlobWriter держит начало файла в
+памяти, пока его не проверят валидаторы, так что файл с чужим
+содержимым отклоняется до того, как на диск записан хотя бы байт, а
+остальная часть тела запроса не читается.
+
+Валидаторы - функции validator(filename, sample, mime_type) -> str,
+которые возвращают (возможно, уточненный) MIME-тип или бросают
+UploadRejected. Встроенный match_extension сверяет содержимое с
+расширением; дополнительные подключаются через register_validator.
+Итоговый тип сохраняется в File.mime_type и используется при отдаче.
+"""
+
+import mimetypes
+
+from werkzeug.exceptions import UnsupportedMediaType
+
+# Объем начала файла, по которому определяется тип
+SNIFF_SIZE = 8 * 1024
+# Сигнатура PDF может начинаться не с первого байта (RFC 8118)
+PDF_HEADER_WINDOW = 1024
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'PK\x03\x04', 'application/zip'),
+)
+# Маркеры частей OOXML в именах первых записей zip-архива
+OOXML_MARKERS = ((b'word/', DOCX), (b'xl/', XLSX))
+TEXT_BOMS = (b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')
+
+# Допустимые типы содержимого для расширений; расширения из
+# ALLOWED_EXTENSIONS, которых здесь нет, по содержимому не проверяются
+EXTENSION_TYPES = {
+    'png': {'image/png'},
+    'jpg': {'image/jpeg'},
+    'jpeg': {'image/jpeg'},
+    'gif': {'image/gif'},
+    'pdf': {'application/pdf'},
+    'txt': {'text/plain'},
+    # Если маркер части не попал в начало архива, виден только zip
+    'docx': {DOCX, 'application/zip'},
+    'xlsx': {XLSX, 'application/zip'},
+}
+
+
+class UploadRejected(UnsupportedMediaType):
+    """Содержимое загружаемого файла не прошло проверку"""
+
+    description = 'Содержимое файла не соответствует его типу'
+
+
+def sniff_mime(sample: bytes):
+    """
+    Тип содержимого по началу файла.
+
+    Returns:
+        str: MIME-тип или None, если тип не распознан
+    """
+    for signature, mime_type in SIGNATURES:
+        if sample.startswith(signature):
+            if mime_type == 'application/zip':
+                for marker, ooxml_type in OOXML_MARKERS:
+                    if marker in sample:
+                        return ooxml_type
+            return mime_type
+    if b'%PDF-' in sample[:PDF_HEADER_WINDOW]:
+        return 'application/pdf'
+    # Текст: нет нулевых байтов (UTF-16 узнается по BOM)
+    if sample.startswith(TEXT_BOMS) or b'\x00' not in sample:
+        return 'text/plain'
+    return None
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def match_extension(filename: str, sample: bytes, mime_type):
+    """Отклоняет файл, содержимое которого не соответствует расширению"""
+    allowed = EXTENSION_TYPES.get(_extension(filename))
+    if allowed is None or not sample:
+        # Расширение без проверки или пустой файл - тип определится по имени
+        return None
+    if mime_type not in allowed:
+        raise UploadRejected()
+    if mime_type == 'application/zip':
+        return next(iter(allowed - {'application/zip'}))
+    return mime_type
+
+
+validators = [match_extension]
+
+
+def register_validator(validator):
+    """Добавляет проверку загрузок (можно использовать как декоратор)"""
+    validators.append(validator)
+    return validator
+
+
+def inspect_upload(filename: str, sample: bytes) -> str:
+    """
+    Проверяет начало загружаемого файла всеми валидаторами.
+
+    Returns:
+        str: MIME-тип содержимого
+
+    Raises:
+        UploadRejected: содержимое не прошло проверку
+    """
+    mime_type = sniff_mime(sample)
+    for validator in validators:
+        mime_type = validator(filename, sample, mime_type)
+    return mime_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def read_head(path) -> bytes:
+    """Первые SNIFF_SIZE байт файла на диске"""
+    with open(path, 'rb') as fh:
+        return fh.read(SNIFF_SIZE)
@@ -34,7 +34,92 @@ function initUploadModal() {
         const submitBtn = form.querySelector('button[type="submit"]');
         submitBtn.disabled = true;
         submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm"></span> Загрузка...';
+
+        // Большие файлы загружаем по частям через /api/uploads
+        const file = fileInput.files[0];
+        if (file && file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            e.preventDefault();
+            const csrfToken = form.querySelector('input[name="csrf_token"]').value;
+            const folderId = form.querySelector('input[name="folder_id"]')?.value;
+            uploadChunked(file, csrfToken, folderId ? Number(folderId) : null)
+                .then(() => window.location.reload())
+                .catch(error => {
+                    console.error('Ошибка загрузки:', error);
+                    alert('Ошибка при загрузке файла');
+                    submitBtn.disabled = false;
+                    submitBtn.textContent = 'Загрузить';
+                });
+        }
+    });
+}
+
+// Возобновляемая загрузка по частям
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const CHUNKED_UPLOAD_PARALLEL = 3;
+
+async function sha256Hex(blob) {
+    if (!window.crypto?.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadChunked(file, csrfToken, folderId = null) {
+    const headers = {'X-CSRFToken': csrfToken};
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+    // Продолжаем прерванную загрузку того же файла, если она еще жива
+    let upload = null;
+    let ranges = [];
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        const response = await fetch(`/api/uploads/${savedId}`);
+        if (response.ok) {
+            upload = await response.json();
+            ranges = upload.ranges;
+        }
+    }
+    if (!upload) {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: {...headers, 'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size, folder_id: folderId})
+        });
+        if (!response.ok) throw new Error((await response.json()).error);
+        upload = await response.json();
+        localStorage.setItem(resumeKey, upload.id);
+    }
+
+    const chunkSize = upload.chunk_size || 8 * 1024 * 1024;
+    const isReceived = (start, end) => ranges.some(([s, e]) => s <= start && end <= e);
+    const pending = [];
+    for (let offset = 0; offset < file.size; offset += chunkSize) {
+        const end = Math.min(offset + chunkSize, file.size);
+        if (!isReceived(offset, end)) pending.push([offset, end]);
+    }
+
+    const worker = async () => {
+        while (pending.length) {
+            const [start, end] = pending.shift();
+            const chunk = file.slice(start, end);
+            const checksum = await sha256Hex(chunk);
+            const response = await fetch(`/api/uploads/${upload.id}?offset=${start}`, {
+                method: 'PUT',
+                headers: checksum ? {...headers, 'X-Chunk-SHA256': checksum} : headers,
+                body: chunk
+            });
+            if (!response.ok) throw new Error((await response.json()).error);
+        }
+    };
+    await Promise.all(Array.from({length: CHUNKED_UPLOAD_PARALLEL}, worker));
+
+    const response = await fetch(`/api/uploads/${upload.id}/complete`, {
+        method: 'POST',
+        headers: {...headers, 'Content-Type': 'application/json'},
+        body: '{}'
     });
+    if (!response.ok) throw new Error((await response.json()).error);
+    localStorage.removeItem(resumeKey);
+    return response.json();
 }
 
 // Переключение темы
@@ -80,11 +165,13 @@ function initDragAndDrop() {
     });
 }
 
-// Динамическое обновление файлового списка
-async function refreshFileList() {
+// Динамическое обновление файлового списка. Ответ кэшируется браузером
+// и сверяется по ETag: без изменений сервер отвечает 304 без тела
+async function refreshFileList(folderId = null) {
     try {
-        const response = await fetch('/api/files');
-        const files = await response.json();
+        const params = folderId ? `?folder_id=${folderId}` : '';
+        const response = await fetch(`/api/v1/files${params}`);
+        const {files} = await response.json();
         renderFileList(files);
     } catch (error) {
         console.error('Ошибка обновления списка:', error);
@@ -0,0 +1,660 @@
+"""
+Модуль storage.py - контентно-адресуемое хранилище файлов (blob store).
+
+Каждый загружаемый файл хешируется (SHA-256) прямо во время записи на диск
+и хранится ровно один раз под ключом своего хеша: blobs/ab/cd/<sha256>.
+Где физически лежат данные, решает бэкенд хранения (app.backends).
+Таблица blobs ведет счетчик ссылок, поэтому повторная загрузка того же
+содержимого сводится к вставке метаданных, а данные удаляются, только
+когда на них больше не ссылается ни одна запись File.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок staging-файлов
+    fcntl = None
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.backends import LocalBackend
+from app.codecs import SAMPLE_SIZE, SUFFIXES, get_codec, is_compressible, storage_codec
+from app.models import Blob, File
+from app.sniffing import SNIFF_SIZE
+
+storage_cli = AppGroup('storage', help='Обслуживание хранилища файлов.')
+logger = logging.getLogger(__name__)
+
+
+def _lock_file(fh, exclusive: bool) -> None:
+    """Блокировка flock открытого файла; снимается при его закрытии"""
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+class BlobWriter:
+    """
+    Файлоподобный приемник загрузки.
+
+    Пишет данные во временный файл и одновременно считает SHA-256 и размер,
+    так что после записи повторно читать файл не нужно. Если задан кодек,
+    по первым SAMPLE_SIZE байтам решается, сжимать ли файл, и дальше
+    данные сжимаются в том же проходе.
+
+    Если задана функция inspect, первые SNIFF_SIZE байт копятся в памяти
+    и передаются ей до записи на диск; она возвращает MIME-тип
+    (mime_type) или бросает исключение, прерывающее прием файла.
+    """
+
+    def __init__(self, tmp_dir, codec=None, level: int = 3, inspect=None):
+        fd, self.tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix='upload-')
+        self._fh = os.fdopen(fd, 'wb')
+        self._hash = hashlib.sha256()
+        self._codec = codec
+        self._level = level
+        self._compressor = None
+        # Начало файла копится, пока не решено, сжимать ли его
+        self._sample = bytearray() if codec else None
+        self._inspect = inspect
+        self._head = bytearray() if inspect else None
+        self.mime_type = None
+        self.codec = None
+        self.size = 0
+        self.stored_size = 0
+
+    def write(self, data) -> int:
+        if self._head is None:
+            self._accept(data)
+        else:
+            self._head += data
+            if len(self._head) >= SNIFF_SIZE:
+                self._inspect_head()
+        return len(data)
+
+    def _inspect_head(self) -> None:
+        head, self._head = bytes(self._head), None
+        self.mime_type = self._inspect(head)
+        self._accept(head)
+
+    def _accept(self, data) -> None:
+        self._hash.update(data)
+        self.size += len(data)
+        if self._sample is None:
+            self._store(data)
+        else:
+            self._sample += data
+            if len(self._sample) >= SAMPLE_SIZE:
+                self._choose_codec()
+
+    def _choose_codec(self) -> None:
+        sample, self._sample = bytes(self._sample), None
+        if is_compressible(sample, self.size):
+            self.codec = self._codec.name
+            self._compressor = self._codec.compressor(self._level)
+        self._store(sample)
+
+    def _store(self, data) -> None:
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._emit(data)
+
+    def _emit(self, data) -> None:
+        if data:
+            self._fh.write(data)
+            self.stored_size += len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """
+        Вызывается парсером multipart по окончании части файла.
+
+        Читать приемник не нужно, поэтому поддерживается только
+        перемотка в начало, которая лишь сбрасывает буфер на диск.
+        """
+        if offset or whence:
+            raise OSError('BlobWriter поддерживает только seek(0)')
+        if not self._fh.closed:
+            self._fh.flush()
+        return 0
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        if self._head is not None:
+            self._inspect_head()
+        if self._sample is not None:
+            self._choose_codec()
+        if self._compressor is not None:
+            self._emit(self._compressor.flush())
+        self._fh.close()
+
+    def discard(self) -> None:
+        """Закрывает и удаляет временный файл (если он еще не перенесен в хранилище)"""
+        # Непроверенное начало файла уже не нужно
+        self._head = None
+        self.close()
+        if self.tmp_path is None:
+            return
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+        self.tmp_path = None
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class StoredBlob:
+    """
+    Блоб, помещенный в хранилище.
+
+    Атрибуты:
+        digest (str): SHA-256 исходного содержимого
+        size (int): Исходный размер в байтах
+        key (str): Ключ блоба в бэкенде хранения
+        codec (str): Кодек сжатия на диске или None
+        stored_size (int): Размер в хранилище
+    """
+
+    def __init__(self, digest, size, key, codec=None, stored_size=None):
+        self.digest = digest
+        self.size = size
+        self.key = key
+        self.codec = codec
+        self.stored_size = size if stored_size is None else stored_size
+
+
+class BlobStore:
+    """
+    Хранилище блобов поверх бэкенда хранения (app.backends).
+
+    Загрузки пишутся во временные файлы в локальном корне и передаются
+    бэкенду готовыми: для локального диска это атомарный rename без
+    копирования, для S3 - загрузка (multipart для больших файлов).
+    Сжатые блобы хранятся под ключом с суффиксом кодека (<sha256>.zst, .gz).
+    """
+
+    def __init__(self, root, backend=None, chunk_size=1024 * 1024, codec=None, level: int = 3):
+        self.root = Path(root)
+        self.tmp_dir = self.root / 'tmp'
+        self.backend = backend or LocalBackend(self.root)
+        # Файлы старого формата (<user_id>/<имя>) всегда лежат на локальном диске
+        self.legacy = LocalBackend(self.root)
+        self.chunk_size = chunk_size
+        self.codec = storage_codec(codec)
+        self.level = level
+        # Фоновое удаление для запросов, которые не должны его ждать
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='blob-unlink')
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key_for(digest: str, codec: str = None) -> str:
+        """Ключ блоба с двумя уровнями каталогов по префиксу хеша"""
+        return f'blobs/{digest[:2]}/{digest[2:4]}/{digest}{SUFFIXES[codec]}'
+
+    def locate(self, digest: str):
+        """
+        Ищет блоб в хранилище в любом из вариантов хранения.
+
+        Returns:
+            tuple: (ключ, кодек) или None, если блоба нет
+        """
+        for codec in SUFFIXES:
+            key = self.key_for(digest, codec)
+            if self.backend.exists(key):
+                return key, codec
+        return None
+
+    def legacy_path(self, key: str) -> Path:
+        """Путь к файлу старого формата (uploads/<user_id>/...) на локальном диске"""
+        return self.legacy.local_path(key)
+
+    def staging_path(self, key: str) -> Path:
+        """Путь к файлу незавершенной загрузки по частям"""
+        return self.tmp_dir / f'chunked-{key}'
+
+    def completing_path(self, key: str) -> Path:
+        """Путь staging-файла, забранного у загрузки на время ее завершения"""
+        return self.tmp_dir / f'completing-{key}'
+
+    @contextmanager
+    def open_staging(self, key: str):
+        """
+        Открывает staging-файл для записи части.
+
+        Запись идет под разделяемой блокировкой, которую freeze_staging
+        дожидается. Файл, забранный на завершение между открытием и
+        блокировкой, не записывается: после блокировки путь staging
+        должен указывать на тот же файл.
+
+        Raises:
+            FileNotFoundError: загрузки нет или она уже завершается
+        """
+        path = self.staging_path(key)
+        with open(path, 'r+b') as fh:
+            _lock_file(fh, exclusive=False)
+            opened, current = os.fstat(fh.fileno()), os.stat(path)
+            if (opened.st_dev, opened.st_ino) != (current.st_dev, current.st_ino):
+                raise FileNotFoundError(path)
+            yield fh
+
+    def freeze_staging(self, key: str) -> Path:
+        """
+        Забирает staging-файл у загрузки перед завершением.
+
+        Файл переименовывается, так что новые части его уже не откроют, и
+        затем дожидается записи частей, начатых раньше. После этого
+        содержимое не меняется, пока файл хешируется и передается
+        хранилищу (на локальном диске - жесткой ссылкой на тот же inode).
+
+        Returns:
+            Path: Новый путь файла (completing_path)
+
+        Raises:
+            FileNotFoundError: файла нет - загрузка уже завершается или завершена
+        """
+        frozen = self.completing_path(key)
+        os.replace(self.staging_path(key), frozen)
+        with open(frozen, 'rb') as fh:
+            _lock_file(fh, exclusive=True)
+        return frozen
+
+    def thaw_staging(self, key: str) -> None:
+        """Возвращает staging-файл загрузке после неудачного завершения"""
+        os.replace(self.completing_path(key), self.staging_path(key))
+
+    def discard_staging(self, key: str) -> None:
+        """Удаляет staging-файл загрузки, в том числе забранный на завершение"""
+        for path in (self.staging_path(key), self.completing_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def open_writer(self, inspect=None) -> BlobWriter:
+        return BlobWriter(self.tmp_dir, self.codec, self.level, inspect)
+
+    def backend_for(self, file):
+        """Бэкенд с данными файла: файлы старого формата лежат на локальном диске"""
+        return self.backend if file.content_hash else self.legacy
+
+    def open_plain(self, file):
+        """Открывает данные файла на чтение исходного (распакованного) содержимого"""
+        codec = get_codec(file.codec)
+        fh = self.backend_for(file).open(file.storage_path)
+        return codec.open(fh) if codec else fh
+
+    @contextmanager
+    def plain_copy(self, file):
+        """
+        Путь к локальному файлу с исходным содержимым файла.
+
+        Для несжатых данных на локальном диске - сам блоб, в остальных
+        случаях - временная копия, которая удаляется по выходу из блока.
+        """
+        if file.codec is None:
+            path = self.backend_for(file).local_path(file.storage_path)
+            if path is not None:
+                yield path
+                return
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix='plain-')
+        try:
+            with os.fdopen(fd, 'wb') as out, self.open_plain(file) as source:
+                shutil.copyfileobj(source, out, self.chunk_size)
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    def write_stream(self, stream, inspect=None) -> BlobWriter:
+        """Копирует поток во временный файл, вычисляя хеш на лету"""
+        writer = self.open_writer(inspect)
+        try:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.close()
+        except Exception:
+            writer.discard()
+            raise
+        return writer
+
+    def _compressible(self, source) -> bool:
+        with open(source, 'rb') as fh:
+            sample = fh.read(SAMPLE_SIZE)
+        return is_compressible(sample, os.path.getsize(source))
+
+    def adopt(self, source, move=False) -> StoredBlob:
+        """
+        Помещает в хранилище уже существующий на диске файл.
+
+        Файл читается только для хеширования и передается бэкенду как
+        есть: на локальном диске это жесткая ссылка (или перенос при
+        move=True), так что данные не копируются. Без move исходный путь
+        остается валидным, пока вызывающий код не удалит его сам. Если
+        включено сжатие и файл сжимаем, он переписывается в хранилище сжатым.
+        """
+        if self.codec is not None and self._compressible(source):
+            with open(source, 'rb') as fh:
+                blob = self.commit(self.write_stream(fh))
+            if move:
+                os.remove(source)
+            return blob
+
+        digest = hashlib.sha256()
+        size = 0
+        with open(source, 'rb') as fh:
+            while True:
+                chunk = fh.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+        digest = digest.hexdigest()
+
+        found = self.locate(digest)
+        if found:
+            if move:
+                os.remove(source)
+            key, codec = found
+            return StoredBlob(digest, size, key, codec, self.backend.stat(key).size)
+
+        key = self.key_for(digest)
+        self.backend.put_file(key, source, move=move)
+        return StoredBlob(digest, size, key)
+
+    def commit(self, writer: BlobWriter) -> StoredBlob:
+        """
+        Передает записанный файл бэкенду под его постоянным ключом.
+
+        Если блоб с таким хешем уже есть в хранилище (в любом варианте
+        хранения), временная копия просто удаляется - содержимое идентично.
+        """
+        writer.close()
+        found = self.locate(writer.digest)
+        if found:
+            writer.discard()
+            key, codec = found
+            return StoredBlob(writer.digest, writer.size, key, codec, self.backend.stat(key).size)
+
+        key = self.key_for(writer.digest, writer.codec)
+        try:
+            self.backend.put_file(key, writer.tmp_path, move=True)
+        except Exception:
+            writer.discard()
+            raise
+        writer.tmp_path = None
+        return StoredBlob(writer.digest, writer.size, key, writer.codec, writer.stored_size)
+
+    def unlink(self, digests, workers: int = 1) -> None:
+        """
+        Удаляет из хранилища блобы, на которые больше нет ссылок.
+
+        Вызывается после коммита. Хеши, для которых строка в blobs успела
+        появиться снова (параллельная загрузка того же содержимого),
+        пропускаются.
+        """
+        digests = set(digests)
+        if not digests:
+            return
+        self.remove(self._dead_keys(digests), workers)
+
+    def unlink_later(self, digests, legacy_keys=()) -> None:
+        """
+        Как unlink, но удаление выполняется в фоновом потоке.
+
+        Какие блобы действительно осиротели, проверяется сразу (в текущем
+        контексте приложения), а в фон уходит только работа с хранилищем.
+        Дополнительно можно передать ключи файлов старого формата.
+        """
+        keys = self._dead_keys(set(digests))
+        if keys:
+            self._background.submit(self.remove, keys)
+        if legacy_keys:
+            self._background.submit(self.remove_legacy, list(legacy_keys))
+
+    def _dead_keys(self, digests: set) -> list:
+        if not digests:
+            return []
+        alive = set(db.session.scalars(
+            select(Blob.hash).where(Blob.hash.in_(digests))
+        ))
+        return [
+            self.key_for(digest, codec)
+            for digest in digests - alive
+            for codec in SUFFIXES
+        ]
+
+    def remove(self, keys, workers: int = 1) -> int:
+        """
+        Удаляет объекты по ключам (см. бэкенд: отсутствующие не считаются ошибкой).
+
+        Returns:
+            int: Количество реально удаленных объектов
+        """
+        return self.backend.delete(keys, workers)
+
+    def remove_legacy(self, keys, workers: int = 1) -> int:
+        """Удаляет файлы старого формата с локального диска"""
+        return self.legacy.delete(keys, workers)
+
+
+def blob_store() -> BlobStore:
+    """Хранилище блобов текущего приложения"""
+    return current_app.extensions['blob_store']
+
+
+def add_ref(digest: str, size: int, count: int = 1) -> None:
+    """Увеличивает счетчик ссылок блоба, создавая строку при необходимости"""
+    stmt = update(Blob).where(Blob.hash == digest).values(
+        ref_count=Blob.ref_count + count
+    )
+    if db.session.execute(stmt).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(hash=digest, size=size, ref_count=count))
+    except IntegrityError:
+        # Строку успела вставить параллельная загрузка
+        db.session.execute(stmt)
+
+
+def release(digest: str, count: int = 1) -> bool:
+    """
+    Уменьшает счетчик ссылок блоба.
+
+    Returns:
+        bool: True, если ссылок не осталось и блоб нужно удалить с диска
+              (после коммита, через BlobStore.unlink)
+    """
+    db.session.execute(
+        update(Blob).where(Blob.hash == digest).values(
+            ref_count=Blob.ref_count - count
+        )
+    )
+    removed = db.session.execute(
+        delete(Blob).where(Blob.hash == digest, Blob.ref_count <= 0)
+    ).rowcount
+    return bool(removed)
+
+
+def release_many(counts: dict) -> list:
+    """
+    Пакетный вариант release для набора хешей.
+
+    Args:
+        counts (dict): хеш -> на сколько уменьшить счетчик ссылок
+
+    Returns:
+        list: Хеши блобов без ссылок, которые нужно удалить с диска после коммита
+    """
+    if not counts:
+        return []
+    blobs = Blob.__table__
+    db.session.execute(
+        update(blobs).where(blobs.c.hash == bindparam('digest')).values(
+            ref_count=blobs.c.ref_count - bindparam('count')
+        ),
+        [{'digest': digest, 'count': count} for digest, count in counts.items()]
+    )
+    orphans = db.session.scalars(
+        select(Blob.hash).where(Blob.hash.in_(counts), Blob.ref_count <= 0)
+    ).all()
+    if orphans:
+        db.session.execute(delete(Blob).where(Blob.hash.in_(orphans), Blob.ref_count <= 0))
+    return orphans
+
+
+def release_file(file: File) -> list:
+    """
+    Освобождает данные файла перед удалением записи.
+
+    Для файлов в хранилище блобов возвращает список хешей на удаление
+    после коммита; файлы старого формата (без content_hash) удаляются сразу.
+    """
+    if file.content_hash:
+        return [file.content_hash] if release(file.content_hash) else []
+    blob_store().remove_legacy([file.storage_path])
+    return []
+
+
+def migrate_legacy(batch_size: int = 500, start_after: int = 0, grace: float = 120,
+                   pause: float = 0, progress=None) -> dict:
+    """
+    Переносит файлы старого формата в хранилище блобов.
+
+    Старые файлы лежат плоско в uploads/<user_id>/, и у активных
+    пользователей там сотни тысяч записей в одном каталоге; в хранилище
+    блобов они раскладываются по подкаталогам blobs/ab/cd/ по префиксу хеша.
+
+    Перенос выполняется без остановки сервиса:
+    - каждая пачка коммитится отдельно, а запись File переключается на
+      блоб условным UPDATE - только если файл за это время не удалили и
+      не перенесли параллельно
+    - старый файл удаляется не сразу после коммита, а через grace секунд,
+      чтобы начатые скачивания и закэшированные общие ссылки
+      (SHARE_CACHE_TTL) успели перейти на новый ключ
+    - прерванный запуск продолжается с start_after или просто запускается
+      заново: перенесенные строки повторно не выбираются
+
+    Args:
+        pause (float): Пауза между пачками, сек - ограничивает нагрузку на диск
+        progress (callable): Вызывается со статистикой после каждой пачки
+
+    Returns:
+        dict: Метрики: перенесено, не найдено, пропущено, ошибок, последний id
+    """
+    store = blob_store()
+    stats = {'moved': 0, 'missing': 0, 'skipped': 0, 'errors': 0, 'last_id': start_after}
+    # (время удаления, ключи старых файлов) в порядке коммита пачек
+    pending = deque()
+
+    def remove_due(force: bool = False) -> None:
+        while pending and (force or pending[0][0] <= time.monotonic()):
+            due, keys = pending.popleft()
+            time.sleep(max(due - time.monotonic(), 0))
+            store.remove_legacy(keys)
+
+    last_id = start_after
+    while True:
+        rows = db.session.execute(
+            select(File.id, File.storage_path)
+            .where(File.content_hash.is_(None), File.id > last_id)
+            .order_by(File.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        adopted = []
+        moved = []
+        skipped = missing = 0
+        try:
+            for row in rows:
+                path = store.legacy_path(row.storage_path)
+                if not path.exists():
+                    missing += 1
+                    continue
+                blob = store.adopt(path)
+                adopted.append(blob.digest)
+                switched = db.session.execute(
+                    update(File).where(
+                        File.id == row.id,
+                        File.content_hash.is_(None),
+                        File.storage_path == row.storage_path
+                    ).values(
+                        content_hash=blob.digest,
+                        storage_path=blob.key,
+                        codec=blob.codec,
+                        stored_size=blob.stored_size
+                    ).execution_options(synchronize_session=False)
+                ).rowcount
+                if switched:
+                    add_ref(blob.digest, blob.size)
+                    moved.append(row.storage_path)
+                else:
+                    skipped += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            stats['errors'] += 1
+            logger.error(f"Legacy migration error in batch up to id={last_id}: {str(e)}")
+            moved = []
+        # Блобы, которые не стали нужны ни одной записи, удаляются
+        store.unlink(adopted)
+
+        stats['moved'] += len(moved)
+        stats['missing'] += missing
+        stats['skipped'] += skipped
+        stats['last_id'] = last_id
+        if moved:
+            pending.append((time.monotonic() + grace, moved))
+        remove_due()
+        if progress:
+            progress(stats)
+        if pause:
+            time.sleep(pause)
+
+    remove_due(force=True)
+    return stats
+
+
+@storage_cli.command('dedup')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Количество файлов в одной транзакции.')
+@click.option('--start-after', default=0, help='Продолжить с id больше указанного.')
+@click.option('--grace', default=120.0, show_default=True,
+              help='Через сколько секунд после переноса удалять старый файл.')
+@click.option('--pause', default=0.0, show_default=True,
+              help='Пауза между пачками, сек.')
+def dedup_command(batch_size, start_after, grace, pause):
+    """Переносит старые файлы из uploads/<user_id>/ в хранилище блобов."""
+    def progress(stats):
+        click.echo(
+            f"Обработано до id={stats['last_id']}: перенесено {stats['moved']}, "
+            f"не найдено {stats['missing']}"
+        )
+
+    stats = migrate_legacy(batch_size, start_after, grace, pause, progress)
+    click.echo(
+        f"Готово: перенесено {stats['moved']}, не найдено на диске {stats['missing']}, "
+        f"пропущено {stats['skipped']}, ошибок {stats['errors']}, последний id: {stats['last_id']}"
+    )
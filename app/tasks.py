@@ -1,25 +1,105 @@
 # app/tasks.py
+import threading
+import time
+from datetime import datetime
 from celery import Celery
-from app import create_app
-from app.models import File
+from celery.signals import task_prerun, task_postrun
+from app import create_app, db
+from app.metrics import observe_task
+from app.models import File, UploadSession, UploadChunk
+from app.previews import generate_previews, preview_cache
+from app.profiling import finish_task_profile, start_task_profile
+from app.storage import blob_store
+from app.quota import reconcile_usage
+from app.trash import cleanup_expired
+from config import Config
+
+celery = Celery(__name__, broker=Config.CELERY_BROKER_URL)
+
+# task_id -> время начала выполнения
+_task_started = {}
+# Приложение процесса воркера, см. get_app
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """
+    Приложение для задач процесса воркера: создается при первой задаче
+    (после fork в prefork-пуле) и затем переиспользуется - пересоздание на
+    каждую задачу заново строило бы движки БД, хранилища и кэши.
+    """
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app(lightweight=True)
+    return _app
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    start_task_profile(task_id, Config)
+
+
+@task_postrun.connect
+def _record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    """Длительность задачи в метрики, профиль задачи в PROFILING_DIR"""
+    started = _task_started.pop(task_id, None)
+    if started is not None and Config.METRICS_ENABLED:
+        observe_task(task.name, state, time.perf_counter() - started, Config.METRICS_DIR, get_app())
+    finish_task_profile(task_id, task.name, state, Config)
+
+
+@celery.task
+def cleanup_trash(days=30, batch_size=1000, workers=8, start_after=0):
+    """Удаляет просроченные файлы из корзины пачками, возвращает метрики"""
+    app = get_app()
+    with app.app_context():
+        return cleanup_expired(days, batch_size, workers, start_after)
+
+
+@celery.task
+def reconcile_storage_usage():
+    """Пересчитывает счетчики занятого места, исправляя накопившийся дрейф"""
+    app = get_app()
+    with app.app_context():
+        reconcile_usage()
 
-celery = Celery(__name__)
 
 @celery.task
-def cleanup_trash(days=30):
-    app = create_app()
+def cleanup_uploads():
+    """Удаляет просроченные незавершенные загрузки по частям"""
+    app = get_app()
     with app.app_context():
-        old_files = File.query.filter(
-            File.is_deleted == True,
-            File.uploaded_at < datetime.utcnow() - timedelta(days=days)
+        store = blob_store()
+        expired = UploadSession.query.filter(
+            UploadSession.expires_at < datetime.utcnow()
         ).all()
-        
-        for file in old_files:
-            try:
-                os.remove(file.storage_path)
-                db.session.delete(file)
-            except Exception as e:
-                db.session.rollback()
-                current_app.logger.error(f"Cleanup error: {str(e)}")
-        
-        db.session.commit()
\ No newline at end of file
+
+        for upload in expired:
+            UploadChunk.query.filter_by(session_id=upload.id).delete(synchronize_session=False)
+            db.session.delete(upload)
+        db.session.commit()
+
+        for upload in expired:
+            store.discard_staging(upload.id)
+
+
+@celery.task
+def render_previews(file_id):
+    """Строит превью нового файла всех размеров"""
+    app = get_app()
+    with app.app_context():
+        file = db.session.get(File, file_id)
+        if file is None:
+            return 0
+        return generate_previews(file)
+
+
+@celery.task
+def prune_previews():
+    """Сокращает кэш превью до лимита"""
+    app = get_app()
+    with app.app_context():
+        return preview_cache().evict()
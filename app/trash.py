@@ -0,0 +1,244 @@
+"""
+Модуль trash.py - окончательное удаление файлов из корзины.
+
+Удаление выполняется пачками и на уровне множеств: один DELETE ... WHERE
+id IN (...) на пачку, пакетное уменьшение счетчиков ссылок блобов и
+счетчиков пользователей и агрегатов папок. Файлы с диска удаляются
+только после коммита пачки, параллельно в пуле потоков.
+"""
+
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, select
+
+from app import db
+from app.folders import (
+    adjust_folder_totals_many, delete_empty_trashed_folders, subtree_clause, subtree_ids
+)
+from app.models import File, Folder
+from app.quota import adjust_usage_many
+from app.sharing import delete_file_shares
+from app.storage import blob_store, release_many
+
+trash_cli = AppGroup('trash', help='Обслуживание корзины.')
+
+# Колонки, которых достаточно для удаления файла без загрузки ORM-объектов
+PURGE_COLUMNS = (File.id, File.user_id, File.folder_id, File.size, File.content_hash,
+                 File.storage_path)
+# Размер пачки при окончательном удалении: строки и IN (...) не растут с корзиной
+BULK_PURGE_BATCH = 500
+
+
+class PurgeBatch:
+    """
+    Результат удаления пачки файлов из базы.
+
+    Атрибуты:
+        rows (list): Реально удаленные строки
+        orphans (list): Хеши блобов, оставшихся без ссылок
+        legacy_keys (list): Ключи файлов старого формата (вне хранилища блобов)
+    """
+
+    def __init__(self, rows, orphans, legacy_keys):
+        self.rows = rows
+        self.orphans = orphans
+        self.legacy_keys = legacy_keys
+
+    @property
+    def bytes(self) -> int:
+        return sum(row.size for row in self.rows)
+
+
+def purge_rows(rows, *criteria) -> PurgeBatch:
+    """
+    Удаляет из базы файлы корзины одной пачкой (без коммита).
+
+    Args:
+        rows: Строки с колонками PURGE_COLUMNS
+        *criteria: Дополнительные условия DELETE (например, срок удаления);
+                   строки, которые им уже не соответствуют (файл успели
+                   восстановить), пропускаются
+
+    Returns:
+        PurgeBatch: Что нужно удалить из хранилища после коммита
+    """
+    rows = list(rows)
+    ids = [row.id for row in rows]
+    if not ids:
+        return PurgeBatch([], [], [])
+
+    deleted = db.session.execute(
+        delete(File).where(File.id.in_(ids), File.is_deleted == True, *criteria)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if deleted != len(ids):
+        survivors = set(db.session.scalars(select(File.id).where(File.id.in_(ids))))
+        rows = [row for row in rows if row.id not in survivors]
+        ids = [row.id for row in rows]
+
+    delete_file_shares(ids)
+
+    orphans = release_many(Counter(row.content_hash for row in rows if row.content_hash))
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        deltas[row.user_id]['bytes_used'] -= row.size
+        deltas[row.user_id]['trash_bytes'] -= row.size
+        deltas[row.user_id]['trash_count'] -= 1
+    adjust_usage_many(deltas)
+
+    folder_deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        if row.folder_id is not None:
+            folder_deltas[row.folder_id][0] -= 1
+            folder_deltas[row.folder_id][1] -= row.size
+    adjust_folder_totals_many(folder_deltas)
+
+    return PurgeBatch(
+        rows,
+        orphans,
+        [row.storage_path for row in rows if not row.content_hash]
+    )
+
+
+def purge_folder(folder: Folder) -> tuple:
+    """
+    Окончательно удаляет папку из корзины со всем поддеревом.
+
+    Файлы поддерева выбираются окнами по первичному ключу по
+    BULK_PURGE_BATCH, как в cleanup_expired; каждая пачка коммитится
+    отдельно, данные из хранилища удаляются после ее коммита в фоновом
+    потоке. Сами папки удаляются последней транзакцией, поэтому при
+    ошибке папка остается в корзине и повторный запрос доудалит остальное.
+
+    Returns:
+        tuple: (количество удаленных файлов, байт)
+    """
+    files = purged_bytes = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(*PURGE_COLUMNS)
+            .where(File.user_id == folder.user_id,
+                   File.folder_id.in_(subtree_ids(folder)),
+                   File.id > last_id)
+            .order_by(File.id)
+            .limit(BULK_PURGE_BATCH)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        batch = purge_rows(rows, File.user_id == folder.user_id)
+        db.session.commit()
+
+        remove_purged(batch, background=True)
+        files += len(batch.rows)
+        purged_bytes += batch.bytes
+
+    # Поддерево удаляется явно: SQLite без PRAGMA foreign_keys не каскадирует
+    delete_empty_trashed_folders(
+        Folder.user_id == folder.user_id, subtree_clause(folder.path)
+    )
+    db.session.commit()
+    return files, purged_bytes
+
+
+def remove_purged(batch: PurgeBatch, workers: int = 1, background: bool = False) -> None:
+    """
+    Удаляет из хранилища данные пачки; вызывается после коммита.
+
+    При background=True удаление выполняется в фоновом потоке хранилища,
+    чтобы HTTP-запрос не ждал работы с хранилищем.
+    """
+    store = blob_store()
+    if background:
+        store.unlink_later(batch.orphans, batch.legacy_keys)
+        return
+    store.unlink(batch.orphans, workers)
+    store.remove_legacy(batch.legacy_keys, workers)
+
+
+def cleanup_expired(days: int = 30, batch_size: int = 1000, workers: int = 8,
+                    start_after: int = 0) -> dict:
+    """
+    Удаляет файлы, пролежавшие в корзине дольше days дней.
+
+    Строки выбираются окнами по первичному ключу, каждая пачка
+    коммитится отдельно, поэтому ошибка затрагивает только свою пачку,
+    а прерванный запуск можно продолжить с start_after (или просто
+    запустить заново - уже удаленные строки повторно не выбираются).
+
+    Returns:
+        dict: Метрики: количество файлов, байт, пачек, ошибок, скорость
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    expired = (File.is_deleted == True, File.deleted_at < cutoff)
+    started = time.perf_counter()
+    stats = {'files': 0, 'folders': 0, 'bytes': 0, 'batches': 0, 'errors': 0,
+             'last_id': start_after}
+
+    last_id = start_after
+    while True:
+        rows = db.session.execute(
+            select(*PURGE_COLUMNS)
+            .where(*expired, File.id > last_id)
+            .order_by(File.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        try:
+            batch = purge_rows(rows, File.deleted_at < cutoff)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            stats['errors'] += 1
+            current_app.logger.error(f"Cleanup batch error (ids up to {last_id}): {str(e)}")
+            continue
+
+        remove_purged(batch, workers)
+        stats['files'] += len(batch.rows)
+        stats['bytes'] += batch.bytes
+        stats['batches'] += 1
+        stats['last_id'] = last_id
+        current_app.logger.info(
+            f"Cleanup batch {stats['batches']}: {len(batch.rows)} files, last id {last_id}"
+        )
+
+    # Папки корзины удаляются, когда в их поддереве не осталось файлов
+    try:
+        stats['folders'] = delete_empty_trashed_folders(Folder.deleted_at < cutoff)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        stats['errors'] += 1
+        current_app.logger.error(f"Cleanup folders error: {str(e)}")
+
+    elapsed = time.perf_counter() - started
+    stats['elapsed_s'] = round(elapsed, 3)
+    stats['files_per_s'] = round(stats['files'] / elapsed, 1) if elapsed else 0.0
+    stats['mb_per_s'] = round(stats['bytes'] / elapsed / 1024 / 1024, 2) if elapsed else 0.0
+    current_app.logger.info(f"Cleanup finished: {stats}")
+    return stats
+
+
+@trash_cli.command('cleanup')
+@click.option('--days', default=30, show_default=True, help='Срок хранения в корзине.')
+@click.option('--batch-size', default=1000, show_default=True, help='Файлов в одной транзакции.')
+@click.option('--workers', default=8, show_default=True, help='Потоков для удаления с диска.')
+@click.option('--start-after', default=0, help='Продолжить с id больше указанного.')
+def cleanup_command(days, batch_size, workers, start_after):
+    """Удаляет файлы, пролежавшие в корзине дольше срока хранения."""
+    stats = cleanup_expired(days, batch_size, workers, start_after)
+    click.echo(
+        f"Удалено файлов: {stats['files']} ({stats['bytes']} байт), папок: {stats['folders']} "
+        f"за {stats['elapsed_s']} с, "
+        f"{stats['files_per_s']} файлов/с, ошибок: {stats['errors']}, последний id: {stats['last_id']}"
+    )
@@ -0,0 +1,221 @@
+"""
+Модуль users.py - загрузка пользователя сессии и учет входов.
+
+Flask-Login загружает пользователя на каждый авторизованный запрос.
+Вместо запроса к базе берется снимок строки users из кэша:
+- общий кэш процессов (Redis по CACHE_REDIS_URL) на USER_CACHE_TTL секунд,
+  перед ним внутрипроцессный на USER_CACHE_LOCAL_TTL секунд
+- без Redis - только внутрипроцессный кэш на USER_CACHE_TTL секунд
+
+Снимок сбрасывается при изменении пользователя (счетчики занятого места
+меняются через quota.py) сразу и еще раз после коммита транзакции, чтобы
+параллельный запрос не закэшировал старые значения. Хеш пароля в кэш не
+попадает.
+
+Версия изменений users.change_version растет в той же транзакции, что и
+любое изменение файлов, папок или общих ссылок пользователя; по ней
+строятся ETag списков JSON API.
+
+Время последнего входа копится в памяти и записывается пакетным UPDATE
+фоновым потоком раз в LAST_LOGIN_FLUSH_INTERVAL секунд и при завершении
+процесса, как счетчики скачиваний общих ссылок; при аварийной остановке
+теряется не больше одного интервала.
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import DateTime, bindparam, event, select, update
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db
+from app.cache import TTLCache
+from app.database import BufferFlusher, RoutingSession
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+# Передний кэш перед Redis: снимает сетевой запрос с повторных обращений
+local_user_cache = TTLCache(maxsize=10000, ttl=2)
+
+# Колонки снимка; password_hash нужен только при входе и читается из базы
+CACHED_COLUMNS = [
+    column for column in User.__table__.columns if column.name != 'password_hash'
+]
+
+
+def _caches() -> tuple:
+    shared = current_app.extensions['shared_cache']
+    if isinstance(shared, TTLCache):
+        return (shared,)
+    return (local_user_cache, shared)
+
+
+def _cache_key(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def _snapshot(row) -> dict:
+    values = {}
+    for column in CACHED_COLUMNS:
+        value = row[column.name]
+        if isinstance(column.type, DateTime) and value is not None:
+            value = value.isoformat()
+        values[column.name] = value
+    return values
+
+
+def _from_snapshot(values: dict) -> User:
+    """Отсоединенный от сессии User, как будто только что прочитанный из базы"""
+    kwargs = {}
+    for column in CACHED_COLUMNS:
+        value = values[column.name]
+        if isinstance(column.type, DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+        kwargs[column.name] = value
+    user = User(**kwargs)
+    make_transient_to_detached(user)
+    return user
+
+
+def load_cached_user(user_id: int):
+    """
+    Пользователь по id для Flask-Login.
+
+    Returns:
+        User: отсоединенный объект (связи не загружаются) или None
+    """
+    key = _cache_key(user_id)
+    caches = _caches()
+    ttl = current_app.config['USER_CACHE_TTL']
+
+    for index, cache in enumerate(caches):
+        values = cache.get(key)
+        if values is not None:
+            for front in caches[:index]:
+                front.set(key, values, current_app.config['USER_CACHE_LOCAL_TTL'])
+            return _from_snapshot(values)
+
+    row = db.session.execute(
+        select(*CACHED_COLUMNS).where(User.id == user_id)
+    ).mappings().first()
+    if row is None:
+        return None
+    values = _snapshot(row)
+    for cache in caches:
+        cache.set(key, values, current_app.config['USER_CACHE_LOCAL_TTL']
+                  if cache is local_user_cache else ttl)
+    return _from_snapshot(values)
+
+
+def invalidate_user(*user_ids) -> None:
+    """
+    Сбрасывает снимки пользователей: сейчас и после коммита текущей транзакции.
+    """
+    _drop(user_ids)
+    db.session.info.setdefault('stale_users', set()).update(user_ids)
+
+
+def _drop(user_ids) -> None:
+    caches = _caches()
+    for user_id in user_ids:
+        for cache in caches:
+            cache.delete(_cache_key(user_id))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _drop_after_commit(session):
+    stale = session.info.pop('stale_users', None)
+    if stale:
+        _drop(stale)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('stale_users', None)
+
+
+def touch_user(*user_ids) -> None:
+    """
+    Увеличивает версию изменений пользователей (без коммита).
+
+    Нужна операциям, которые меняют файлы, папки или ссылки, не трогая
+    счетчики занятого места: изменения счетчиков (quota.py) увеличивают
+    версию сами.
+    """
+    if not user_ids:
+        return
+    db.session.execute(
+        update(User).where(User.id.in_(user_ids)).values(
+            change_version=User.change_version + 1
+        ).execution_options(synchronize_session=False)
+    )
+    invalidate_user(*user_ids)
+
+
+def change_version(user_id: int) -> int:
+    """
+    Текущая версия изменений пользователя.
+
+    Читается из базы, а не из снимка сессии: в другом процессе снимок
+    может отставать на USER_CACHE_TTL, а устаревшая версия подтвердила бы
+    клиенту (304) уже изменившийся список.
+    """
+    return db.session.scalar(select(User.change_version).where(User.id == user_id)) or 0
+
+
+class LastLoginBuffer:
+    """
+    Буфер времени последнего входа пользователей.
+
+    В базу буфер пишет фоновый поток (BufferFlusher), запущенный первым
+    входом в процессе.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.flusher = BufferFlusher(self.flush, 'last-login')
+
+    def add(self, user_id: int, when: datetime, interval: float) -> None:
+        """Запоминает вход; буфер пишется в базу раз в interval секунд"""
+        with self._lock:
+            self._pending[user_id] = when
+        self.flusher.start(current_app._get_current_object(), interval)
+
+    def flush(self) -> None:
+        """Записывает накопленное время входа (нужен контекст приложения)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        self._write(pending)
+
+    def _write(self, pending: dict) -> None:
+        if not pending:
+            return
+        users = User.__table__
+        try:
+            db.session.execute(
+                update(users).where(users.c.id == bindparam('uid')).values(
+                    last_login=bindparam('logged_in_at')
+                ),
+                [{'uid': user_id, 'logged_in_at': when} for user_id, when in pending.items()]
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Last login flush error: {str(e)}")
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+
+
+last_login_buffer = LastLoginBuffer()
+
+
+def record_login(user_id: int) -> None:
+    """Отмечает успешный вход без отдельной записи в базу на каждый вход"""
+    last_login_buffer.add(
+        user_id, datetime.utcnow(), current_app.config['LAST_LOGIN_FLUSH_INTERVAL']
+    )
@@ -1,9 +1,12 @@
 import os
 import uuid
-from flask import current_app
+from functools import wraps
+from flask import current_app, abort, flash, redirect, url_for
+from flask_login import current_user
 from werkzeug.utils import secure_filename
 
 from app import db  # Добавить в начало файла
+from app.models import File
 
 def allowed_file(filename):
     allowed_extensions = current_app.config['ALLOWED_EXTENSIONS']
@@ -24,3 +27,14 @@ def handle_database_error(error):
     db.session.rollback()
     flash('A database error occurred', 'danger')
     return redirect(url_for('main.index'))
+
+def admin_required(view):
+    """Доступ только для пользователей из ADMIN_USERNAMES"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if not current_user.is_admin:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
@@ -0,0 +1,184 @@
+"""
+Бенчмарк конкурентной нагрузки на SQLite: загрузка, список файлов и
+скачивание по общей ссылке из нескольких потоков одновременно.
+
+Сравниваются режимы:
+- rollback: журнал отката и synchronous=FULL, busy_timeout 5 с -
+  то, что SQLite и pysqlite делают по умолчанию
+- wal: настройки из config.py (WAL, synchronous=NORMAL, mmap)
+
+Кроме задержек операций считается суммарное время выполнения SQL
+(в основном это ожидание блокировки записи) и число ошибок.
+Каждый режим запускается в отдельном процессе.
+
+Запуск:
+    python -m benchmarks.bench_concurrency --threads 8 --seconds 20
+"""
+
+import argparse
+import io
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.common import make_app, random_text
+
+MODES = {
+    'rollback': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_BUSY_TIMEOUT': 5,
+        'SQLITE_MMAP_SIZE': 0,
+    },
+    'wal': {},
+}
+PASSWORD = 'benchmark-password'
+# Доли операций в смеси
+OPERATIONS = (('upload', 0.3), ('list', 0.4), ('shared', 0.3))
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 2)
+
+
+def login(app, username: str):
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': PASSWORD, 'confirm': PASSWORD})
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    return client
+
+
+def run_mode(mode: str, threads: int, seconds: float) -> dict:
+    """Нагрузка в текущем процессе"""
+    app, workdir = make_app(**MODES[mode])
+
+    from sqlalchemy import event
+    from app import db
+
+    sql_time = [0.0]
+    sql_lock = threading.Lock()
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['started'].pop()
+        with sql_lock:
+            sql_time[0] += elapsed
+
+    # Общая ссылка с лимитом: каждое скачивание - атомарный UPDATE
+    owner = login(app, 'owner')
+    owner.post('/upload', data={'file': (io.BytesIO(random_text(64 * 1024)), 'shared.txt')},
+               content_type='multipart/form-data')
+    with app.app_context():
+        from app.models import File
+        file_id = File.query.one().id
+    token = owner.post('/api/files/bulk/share', json={
+        'ids': [file_id], 'download_limit': 10 ** 9
+    }).get_json()['links'][0]['token']
+
+    clients = [login(app, f'user{i}') for i in range(threads)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    names, weights = zip(*OPERATIONS)
+
+    def worker(index: int):
+        client = clients[index]
+        anonymous = app.test_client()
+        rng = random.Random(index)
+        counter = 0
+        while time.perf_counter() < deadline:
+            operation = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                if operation == 'upload':
+                    counter += 1
+                    response = client.post('/upload', data={
+                        'file': (io.BytesIO(random_text(rng.randint(4, 64) * 1024)),
+                                 f'f{index}-{counter}.txt')
+                    }, content_type='multipart/form-data')
+                    ok = response.status_code == 302
+                elif operation == 'list':
+                    ok = client.get('/').status_code == 200
+                else:
+                    response = anonymous.get(f'/shared/{token}')
+                    ok = response.status_code == 200
+                    response.close()
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with results_lock:
+                latencies[operation].append(elapsed)
+                if not ok:
+                    errors[operation] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    # Неудачная загрузка отвечает тем же редиректом, поэтому сверяем с базой
+    with app.app_context():
+        from app.models import File
+        stored = File.query.count() - 1
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'mode': mode,
+        'threads': threads,
+        'seconds': seconds,
+        'sql_time_s': round(sql_time[0], 3),
+        'uploads_stored': stored,
+        'operations': {},
+    }
+    for operation, samples in latencies.items():
+        samples.sort()
+        report['operations'][operation] = {
+            'count': len(samples),
+            'per_s': round(len(samples) / seconds, 1),
+            'median_ms': round(statistics.median(samples), 2),
+            'p95_ms': percentile(samples, 0.95),
+            'p99_ms': percentile(samples, 0.99),
+            'errors': errors[operation],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--mode', choices=list(MODES),
+                        help='Запустить один режим в текущем процессе')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.threads, args.seconds)))
+        return
+
+    report = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_concurrency', '--threads', str(args.threads),
+             '--seconds', str(args.seconds), '--mode', mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
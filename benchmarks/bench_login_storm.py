@@ -0,0 +1,170 @@
+"""
+Бенчмарк волны входов: задержка скачиваний, пока злоумышленник
+перебирает пароли с нескольких адресов.
+
+Приложение обслуживается ограниченным числом "воркеров" (семафор на
+WSGI-вызов, как у gunicorn с синхронными воркерами): запрос, пришедший
+при занятых воркерах, ждет в очереди.
+
+Сравниваются режимы:
+- inline: хеширование в потоке запроса без ограничения попыток -
+  поведение до появления app/passwords.py и app/ratelimit.py
+- pool: настройки из config.py (пул процессов хеширования с
+  ограниченной очередью, ведра токенов по адресу и имени)
+
+Для каждого режима сначала измеряются скачивания без нагрузки, затем
+во время волны входов. Каждый режим запускается в отдельном процессе.
+
+Запуск:
+    python -m benchmarks.bench_login_storm --workers 4 --attackers 16 --seconds 10
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+from benchmarks.common import make_app
+
+MODES = {
+    'inline': {'PASSWORD_HASH_WORKERS': 0, 'LOGIN_RATE_LIMIT': False},
+    'pool': {'LOGIN_RATE_LIMIT': True},
+}
+PASSWORD = 'benchmark-password'
+# Адреса, с которых идет перебор
+ATTACK_ADDRESSES = [f'203.0.113.{i}' for i in range(1, 5)]
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 2)
+
+
+class WorkerSlots:
+    """WSGI-обертка, пропускающая не больше workers запросов одновременно"""
+
+    def __init__(self, wsgi_app, workers: int):
+        self.wsgi_app = wsgi_app
+        self.slots = threading.Semaphore(workers)
+
+    def __call__(self, environ, start_response):
+        with self.slots:
+            # Тело читается внутри слота: синхронный воркер занят до конца ответа
+            response = self.wsgi_app(environ, start_response)
+            try:
+                body = b''.join(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        return [body]
+
+
+def latency_stats(samples: list, seconds: float) -> dict:
+    samples.sort()
+    return {
+        'count': len(samples),
+        'per_s': round(len(samples) / seconds, 1),
+        'median_ms': round(statistics.median(samples), 2),
+        'p95_ms': percentile(samples, 0.95),
+        'p99_ms': percentile(samples, 0.99),
+    }
+
+
+def run_mode(mode: str, workers: int, attackers: int, seconds: float) -> dict:
+    """Нагрузка в текущем процессе"""
+    app, workdir = make_app(**MODES[mode])
+    app.wsgi_app = WorkerSlots(app.wsgi_app, workers)
+
+    owner = app.test_client()
+    owner.post('/register', data={'username': 'owner', 'password': PASSWORD, 'confirm': PASSWORD})
+    owner.post('/login', data={'username': 'owner', 'password': PASSWORD})
+    owner.post('/upload', data={'file': (io.BytesIO(b'%PDF-1.7\n' + os.urandom(256 * 1024)), 'report.pdf')},
+               content_type='multipart/form-data')
+    with app.app_context():
+        from app.models import File
+        filename = File.query.one().filename
+
+    def downloads(duration: float) -> list:
+        samples = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = owner.get(f'/download/{filename}')
+            response.close()
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'download failed: {response.status_code}')
+        return samples
+
+    quiet = downloads(min(seconds, 3))
+
+    statuses = Counter()
+    statuses_lock = threading.Lock()
+    stop = threading.Event()
+
+    def attacker(index: int):
+        client = app.test_client()
+        address = ATTACK_ADDRESSES[index % len(ATTACK_ADDRESSES)]
+        attempt = 0
+        while not stop.is_set():
+            attempt += 1
+            response = client.post('/login', data={
+                'username': 'owner' if attempt % 2 else f'victim{index}',
+                'password': f'guess-{attempt}',
+            }, environ_base={'REMOTE_ADDR': address})
+            with statuses_lock:
+                statuses[response.status_code] += 1
+
+    pool = [threading.Thread(target=attacker, args=(i,)) for i in range(attackers)]
+    for thread in pool:
+        thread.start()
+    time.sleep(0.5)
+    storm = downloads(seconds)
+    stop.set()
+    for thread in pool:
+        thread.join()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'mode': mode,
+        'workers': workers,
+        'attackers': attackers,
+        'seconds': seconds,
+        'quiet': latency_stats(quiet, min(seconds, 3)),
+        'storm': latency_stats(storm, seconds),
+        'login_attempts': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--attackers', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mode', choices=list(MODES),
+                        help='Запустить один режим в текущем процессе')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.workers, args.attackers, args.seconds)))
+        return
+
+    report = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_login_storm', '--workers', str(args.workers),
+             '--attackers', str(args.attackers), '--seconds', str(args.seconds), '--mode', mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
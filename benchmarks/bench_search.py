@@ -0,0 +1,89 @@
+"""
+Бенчмарк поиска по именам файлов: FTS5-индекс против ILIKE '%q%'.
+
+Запуск:
+    python -m benchmarks.bench_search --files 200000 --users 100
+"""
+
+import argparse
+import json
+import random
+import string
+from datetime import datetime
+
+from benchmarks.common import make_app, timed
+
+WORDS = ['report', 'invoice', 'photo', 'scan', 'contract', 'backup', 'draft',
+         'budget', 'notes', 'summary', 'отчет', 'договор', 'счет', 'фото']
+EXTENSIONS = ['pdf', 'txt', 'docx', 'xlsx', 'jpg', 'png']
+
+
+# Редкое слово: на нем ILIKE вынужден читать все строки пользователя,
+# а частые слова он находит быстро за счет LIMIT
+RARE_WORD = 'quarterly'
+
+
+def random_name() -> str:
+    parts = random.sample(WORDS, 2) + [str(random.randint(2000, 2030))]
+    if random.random() < 0.001:
+        parts[0] = RARE_WORD
+    prefix = ''.join(random.choices(string.hexdigits.lower(), k=32))
+    return f"{prefix}_{'_'.join(parts)}.{random.choice(EXTENSIONS)}"
+
+
+def seed(db, files: int, users: int) -> None:
+    from sqlalchemy import text
+    now = datetime.utcnow()
+    db.session.execute(text('INSERT INTO users (id, username, password_hash) VALUES (:id, :u, :p)'),
+                       [{'id': i, 'u': f'user{i}', 'p': '-'} for i in range(1, users + 1)])
+    batch = []
+    for i in range(1, files + 1):
+        batch.append({'id': i, 'name': random_name(), 'path': f'/bench/{i}', 'size': 1,
+                      'user': random.randint(1, users), 'ts': now})
+        if len(batch) == 10000:
+            db.session.execute(text(
+                'INSERT INTO files (id, filename, storage_path, size, user_id, uploaded_at, is_deleted) '
+                'VALUES (:id, :name, :path, :size, :user, :ts, 0)'), batch)
+            batch = []
+    if batch:
+        db.session.execute(text(
+            'INSERT INTO files (id, filename, storage_path, size, user_id, uploaded_at, is_deleted) '
+            'VALUES (:id, :name, :path, :size, :user, :ts, 0)'), batch)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app, workdir = make_app()
+    from app import db
+    from app.models import File
+    from app.search import filter_query, ranked_search, search_backend
+
+    with app.app_context():
+        seed(db, args.files, args.users)
+        result = app.test_cli_runner().invoke(args=['search', 'rebuild'])
+        assert search_backend() == 'sqlite', result.output
+
+        user_id = 1
+        base = File.query.filter(File.user_id == user_id, File.is_deleted == False)
+        report = {'files': args.files, 'users': args.users, 'queries': {}}
+
+        for q in ['rep', 'budget 20', 'отч', 'quart', 'missing']:
+            ilike = base.filter(File.filename.ilike(f'%{q}%')).order_by(File.uploaded_at.desc()).limit(10)
+            fts = filter_query(base, user_id, q).order_by(File.uploaded_at.desc()).limit(10)
+            report['queries'][q] = {
+                'ilike': timed(lambda: ilike.all(), args.repeat),
+                'fts_filter': timed(lambda: fts.all(), args.repeat),
+                'fts_ranked': timed(lambda: ranked_search(user_id, q, 10), args.repeat),
+            }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Бенчмарк холодного старта: время от запуска интерпретатора до готового
+приложения для разных способов его создания.
+
+Режимы (каждый запуск - новый процесс):
+- eager - полное приложение и Flask-Migrate сразу, как раньше
+- web - полное приложение, Alembic загружается только для `flask db`
+- lightweight - create_app(lightweight=True) для воркеров Celery и команд
+- cli - `flask --help` с полным приложением
+- cli-lightweight - `flask --help` с облегченным приложением
+
+Стоимость запуска интерпретатора входит в wall_*, create_median_ms -
+только импорт пакета app и create_app.
+
+Отдельно сравнивается выполнение нескольких задач подряд в одном
+процессе: приложение на каждую задачу против одного на процесс.
+
+Запуск:
+    python -m benchmarks.bench_startup --repeat 10 --tasks 50
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import ROOT
+
+MODES = ('eager', 'web', 'lightweight', 'cli', 'cli-lightweight')
+TASK_MODES = ('per-task', 'cached')
+
+
+def cli_app(lightweight=False):
+    """Фабрика для `flask --app`: приложение с каталогом загрузок бенчмарка"""
+    from config import Config
+    Config.UPLOAD_FOLDER = os.environ['BENCH_UPLOAD_FOLDER']
+    from app import create_app
+    return create_app(lightweight=lightweight)
+
+
+def run_mode(mode: str) -> dict:
+    """Создание приложения в текущем (только что запущенном) процессе"""
+    started = time.perf_counter()
+    from config import Config
+    Config.UPLOAD_FOLDER = os.environ['BENCH_UPLOAD_FOLDER']
+    from app import create_app, init_migrate
+    imported = time.perf_counter()
+    app = create_app(lightweight=mode == 'lightweight')
+    if mode == 'eager':
+        init_migrate(app)
+    created = time.perf_counter()
+    return {
+        'import_ms': round((imported - started) * 1000, 1),
+        'create_ms': round((created - imported) * 1000, 1),
+        'modules': len(sys.modules),
+    }
+
+
+def run_tasks(mode: str, count: int) -> dict:
+    """count задач подряд: каждая пересчитывает счетчики пользователей"""
+    from config import Config
+    Config.UPLOAD_FOLDER = os.environ['BENCH_UPLOAD_FOLDER']
+    from app import create_app, db
+    from app.quota import reconcile_usage
+
+    app = create_app(lightweight=True)
+    with app.app_context():
+        db.create_all()
+
+    started = time.perf_counter()
+    for _ in range(count):
+        if mode == 'per-task':
+            app = create_app(lightweight=True)
+        with app.app_context():
+            reconcile_usage()
+    elapsed = time.perf_counter() - started
+    return {'tasks': count, 'ms_per_task': round(elapsed / count * 1000, 2)}
+
+
+def spawn(args: list, env: dict) -> tuple:
+    started = time.perf_counter()
+    # Рабочий каталог - временный: туда же пишется app.log
+    output = subprocess.run(
+        args, check=True, capture_output=True, text=True, cwd=env['BENCH_WORKDIR'], env=env
+    ).stdout
+    return (time.perf_counter() - started) * 1000, output
+
+
+def measure(mode: str, repeat: int, env: dict) -> dict:
+    walls, inner = [], []
+    for _ in range(repeat):
+        if mode.startswith('cli'):
+            factory = f'benchmarks.bench_startup:cli_app(lightweight={mode == "cli-lightweight"})'
+            wall, _ = spawn([sys.executable, '-m', 'flask', '--app', factory, '--help'], env)
+        else:
+            wall, output = spawn(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--mode', mode], env
+            )
+            inner.append(json.loads(output.strip().splitlines()[-1]))
+        walls.append(wall)
+
+    report = {
+        'wall_median_ms': round(statistics.median(walls), 1),
+        'wall_min_ms': round(min(walls), 1),
+    }
+    if inner:
+        report['create_median_ms'] = round(statistics.median(
+            sample['import_ms'] + sample['create_ms'] for sample in inner
+        ), 1)
+        report['modules'] = inner[-1]['modules']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10, help='Запусков на режим')
+    parser.add_argument('--tasks', type=int, default=50, help='Задач подряд в одном процессе')
+    parser.add_argument('--mode', choices=MODES + TASK_MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode in TASK_MODES:
+        print(json.dumps(run_tasks(args.mode, args.tasks)))
+        return
+    if args.mode:
+        print(json.dumps(run_mode(args.mode)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='filescloud-startup-')
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ROOT),
+        SECRET_KEY='benchmark',
+        DATABASE_URL=f'sqlite:///{workdir}/bench.db',
+        BENCH_WORKDIR=workdir,
+        BENCH_UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+    )
+    # Прогрев: байт-код и файловый кэш ОС
+    spawn([sys.executable, '-m', 'benchmarks.bench_startup', '--mode', 'eager'], env)
+
+    report = {mode: measure(mode, args.repeat, env) for mode in MODES}
+    for mode in TASK_MODES:
+        _, output = spawn(
+            [sys.executable, '-m', 'benchmarks.bench_startup',
+             '--mode', mode, '--tasks', str(args.tasks)], env
+        )
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+"""
+Сквозной бенчмарк приложения: синтетические данные заданного масштаба и
+нагрузка от нескольких клиентов по основным сценариям.
+
+Наполнение (один раз на рабочий каталог):
+- пользователи, файлы (от 10 тыс. до 10 млн строк), общие ссылки и файлы
+  в корзине; содержимое берется из небольшого набора настоящих блобов,
+  так что скачивания отдают реальные данные
+- счетчики занятого места и поисковый индекс пересчитываются командами
+  приложения, как после миграции
+
+Сценарии: upload, list, paginate, search, download, shared, purge.
+Каждый сценарий выполняется в отдельном процессе (честный пиковый RSS)
+на общей базе; изменяющие данные сценарии идут последними. Для каждого
+считаются пропускная способность, задержки p50/p95/p99, ошибки, число
+SQL-запросов на операцию и пиковый RSS процесса.
+
+Отчет - JSON; два отчета сравниваются режимом --compare.
+
+Запуск:
+    python -m benchmarks.bench_suite --files 100000 --users 100 --threads 8 \\
+        --seconds 10 --workdir /tmp/fc-bench --output report.json
+    python -m benchmarks.bench_suite --compare before.json after.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import ROOT, make_app, random_text
+
+SCENARIOS = ('list', 'paginate', 'search', 'download', 'shared', 'upload', 'purge')
+PASSWORD = 'benchmark-password'
+WORDS = ['report', 'invoice', 'photo', 'scan', 'contract', 'backup', 'draft',
+         'budget', 'notes', 'summary', 'отчет', 'договор', 'счет', 'фото']
+BATCH_SIZE = 10000
+# Сколько записей каждого пользователя клиент держит под рукой для операций
+SAMPLE_PER_USER = 200
+# Наполнение не измеряет вход, поэтому хеш пароля дешевый
+APP_OVERRIDES = {
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    'PASSWORD_HASH_WORKERS': 0,
+    'METRICS_QUERY_WARNING': 0,
+}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 2)
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def open_app(args):
+    overrides = dict(APP_OVERRIDES)
+    if args.database_url:
+        overrides['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    app, _ = make_app(args.workdir, **overrides)
+    return app
+
+
+def seed_params(args) -> dict:
+    return {
+        'files': args.files, 'users': args.users, 'share_ratio': args.share_ratio,
+        'trash_ratio': args.trash_ratio, 'blobs': args.blobs, 'blob_kb': args.blob_kb,
+        'seed': args.seed, 'database_url': args.database_url,
+    }
+
+
+def reset_sequences(db, tables) -> None:
+    """
+    Продвигает последовательности id после вставки строк с явными id.
+
+    Иначе в PostgreSQL первая же новая строка (загрузка в сценарии upload)
+    получила бы id, который уже занят. SQLite берет следующий id из
+    максимального, ему это не нужно.
+    """
+    from sqlalchemy import text
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+        ))
+    db.session.commit()
+
+
+def seed(args) -> dict:
+    """Наполняет базу; повторный запуск с теми же параметрами ничего не делает"""
+    marker = Path(args.workdir) / 'seed.json'
+    params = seed_params(args)
+    if marker.exists():
+        saved = json.loads(marker.read_text())
+        if saved['params'] == params:
+            return saved
+        raise SystemExit(f'{args.workdir} наполнен с другими параметрами, укажите другой --workdir')
+
+    app = open_app(args)
+    from sqlalchemy import bindparam, insert, update
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import Blob, File, ShareLink, User
+    from app.quota import reconcile_usage
+    from app.storage import blob_store
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    now = datetime.utcnow()
+
+    with app.app_context():
+        store = blob_store()
+        blobs = []
+        for _ in range(args.blobs):
+            writer = store.open_writer()
+            writer.write(random_text(args.blob_kb * 1024))
+            blobs.append(store.commit(writer))
+
+        # Строки вставляются в порядке внешних ключей (blobs, users, затем
+        # files и share_links), а пачки коммитятся: PostgreSQL проверяет
+        # ссылки при каждом коммите
+        blob_table = Blob.__table__
+        db.session.execute(insert(blob_table), [
+            {'hash': blob.digest, 'size': blob.size, 'ref_count': 0} for blob in blobs
+        ])
+
+        password_hash = generate_password_hash(PASSWORD, method=APP_OVERRIDES['PASSWORD_HASH_METHOD'])
+        db.session.execute(insert(User.__table__), [
+            {'id': i, 'username': f'user{i}', 'password_hash': password_hash}
+            for i in range(1, args.users + 1)
+        ])
+
+        refs = [0] * len(blobs)
+        files, links = [], []
+        shares = 0
+        for file_id in range(1, args.files + 1):
+            index = rng.randrange(len(blobs))
+            blob = blobs[index]
+            refs[index] += 1
+            deleted = rng.random() < args.trash_ratio
+            uploaded_at = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            words = '_'.join(rng.sample(WORDS, 2))
+            files.append({
+                'id': file_id,
+                'filename': f'{rng.getrandbits(128):032x}_{words}_{rng.randint(2000, 2030)}.txt',
+                'storage_path': blob.key,
+                'content_hash': blob.digest,
+                'size': blob.size,
+                'stored_size': blob.stored_size,
+                'codec': blob.codec,
+                'mime_type': 'text/plain',
+                'user_id': rng.randint(1, args.users),
+                'uploaded_at': uploaded_at,
+                'is_deleted': deleted,
+                'deleted_at': uploaded_at + timedelta(seconds=1) if deleted else None,
+            })
+            if not deleted and rng.random() < args.share_ratio:
+                shares += 1
+                links.append({'id': shares, 'token': f'{rng.getrandbits(128):032x}',
+                              'file_id': file_id, 'created_at': now})
+            if len(files) == BATCH_SIZE:
+                db.session.execute(insert(File.__table__), files)
+                files = []
+                if links:
+                    db.session.execute(insert(ShareLink.__table__), links)
+                    links = []
+                db.session.commit()
+        if files:
+            db.session.execute(insert(File.__table__), files)
+        if links:
+            db.session.execute(insert(ShareLink.__table__), links)
+        db.session.execute(
+            update(blob_table).where(blob_table.c.hash == bindparam('digest'))
+            .values(ref_count=bindparam('refs')),
+            [{'digest': blob.digest, 'refs': count} for blob, count in zip(blobs, refs)]
+        )
+        db.session.commit()
+        reset_sequences(db, (User.__table__, File.__table__, ShareLink.__table__))
+
+        reconcile_usage()
+        result = app.test_cli_runner().invoke(args=['search', 'rebuild'])
+        if result.exit_code:
+            raise RuntimeError(result.output)
+
+    saved = {'params': params, 'seconds': round(time.perf_counter() - started, 1)}
+    marker.write_text(json.dumps(saved))
+    return saved
+
+
+class Client:
+    """Клиент одного потока: вошедший пользователь и его выборка данных"""
+
+    def __init__(self, app, user_id: int, rng: random.Random):
+        from sqlalchemy import select
+        from app import db
+        from app.models import File, ShareLink
+        from app.pagination import encode_cursor
+
+        self.http = app.test_client()
+        self.anonymous = app.test_client()
+        self.rng = rng
+        response = self.http.post('/login', data={'username': f'user{user_id}', 'password': PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'login failed for user{user_id}: {response.status_code}')
+
+        with app.app_context():
+            live = db.session.execute(
+                select(File.id, File.filename, File.uploaded_at)
+                .where(File.user_id == user_id, File.is_deleted == False)
+                .order_by(File.id).limit(SAMPLE_PER_USER)
+            ).all()
+            self.filenames = [row.filename for row in live]
+            self.cursors = [encode_cursor(row.uploaded_at, row.id) for row in live]
+            self.trashed = db.session.scalars(
+                select(File.id).where(File.user_id == user_id, File.is_deleted == True)
+                .order_by(File.id).limit(SAMPLE_PER_USER * 10)
+            ).all()
+            self.tokens = db.session.scalars(
+                select(ShareLink.token).join(File, File.id == ShareLink.file_id)
+                .where(File.user_id == user_id).limit(SAMPLE_PER_USER)
+            ).all()
+        self.uploads = 0
+
+    def run(self, scenario: str):
+        """
+        Выполняет одну операцию сценария.
+
+        Returns:
+            bool: успех, None - данных для операции не осталось
+        """
+        rng = self.rng
+        if scenario == 'list':
+            return self._get(self.http, '/')
+        if scenario == 'paginate':
+            if not self.cursors:
+                return None
+            return self._get(self.http, f'/?after={rng.choice(self.cursors)}')
+        if scenario == 'search':
+            return self._get(self.http, f'/api/search?q={rng.choice(WORDS)[:4]}')
+        if scenario == 'download':
+            if not self.filenames:
+                return None
+            return self._get(self.http, f'/download/{rng.choice(self.filenames)}')
+        if scenario == 'shared':
+            if not self.tokens:
+                return None
+            return self._get(self.anonymous, f'/shared/{rng.choice(self.tokens)}')
+        if scenario == 'upload':
+            self.uploads += 1
+            response = self.http.post('/upload', data={
+                'file': (io.BytesIO(random_text(rng.randint(4, 64) * 1024)), f'bench-{self.uploads}.txt')
+            }, content_type='multipart/form-data')
+            return response.status_code == 302
+        if scenario == 'purge':
+            if not self.trashed:
+                return None
+            response = self.http.post(f'/purge/{self.trashed.pop()}')
+            return response.status_code == 302
+        raise ValueError(scenario)
+
+    @staticmethod
+    def _get(http, url: str) -> bool:
+        response = http.get(url)
+        # Тело читается целиком: в задержку входит отдача файла
+        response.get_data()
+        response.close()
+        return response.status_code == 200
+
+
+def run_scenario(args) -> dict:
+    """Один сценарий в текущем процессе"""
+    app = open_app(args)
+    from sqlalchemy import event
+    from app import db
+
+    queries = [0]
+    queries_lock = threading.Lock()
+
+    @event.listens_for(db.Engine, 'after_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        with queries_lock:
+            queries[0] += 1
+
+    rng = random.Random(f'{args.seed}-{args.scenario}')
+    clients = [
+        Client(app, user_id, random.Random(rng.random()))
+        for user_id in rng.sample(range(1, args.users + 1), min(args.threads, args.users))
+    ]
+    queries[0] = 0
+
+    latencies = []
+    errors = [0]
+    exhausted = [0]
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(client: Client):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = client.run(args.scenario)
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with results_lock:
+                if ok is None:
+                    exhausted[0] += 1
+                    return
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'threads': len(clients),
+        'seconds': round(elapsed, 2),
+        'ops': len(latencies),
+        'errors': errors[0],
+        'ops_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'queries_per_op': round(queries[0] / len(latencies), 2) if latencies else None,
+        'peak_rss_mb': max_rss_mb(),
+    }
+    if exhausted[0]:
+        report['clients_out_of_data'] = exhausted[0]
+    if latencies:
+        latencies.sort()
+        report.update({
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': round(latencies[-1], 2),
+            'mean_ms': round(statistics.mean(latencies), 2),
+        })
+    return report
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path: str, after_path: str) -> dict:
+    """Изменение показателей второго отчета относительно первого, в процентах"""
+    before = json.loads(Path(before_path).read_text())['scenarios']
+    after = json.loads(Path(after_path).read_text())['scenarios']
+
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    result = {}
+    for name in sorted(before.keys() & after.keys(), key=SCENARIOS.index):
+        result[name] = {
+            metric: {'before': before[name].get(metric), 'after': after[name].get(metric),
+                     'change_pct': change(before[name].get(metric), after[name].get(metric))}
+            for metric in ('ops_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_op', 'peak_rss_mb')
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--share-ratio', type=float, default=0.05,
+                        help='Доля файлов с общей ссылкой')
+    parser.add_argument('--trash-ratio', type=float, default=0.1,
+                        help='Доля файлов в корзине')
+    parser.add_argument('--blobs', type=int, default=64, help='Количество разных содержимых')
+    parser.add_argument('--blob-kb', type=int, default=64, help='Размер содержимого, КБ')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10, help='Длительность сценария')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='Сценарии через запятую')
+    parser.add_argument('--workdir', help='Каталог базы и файлов; наполненный каталог '
+                                          'используется повторно (по умолчанию временный)')
+    parser.add_argument('--database-url', help='Другая база вместо SQLite в рабочем каталоге')
+    parser.add_argument('--output', help='Файл для JSON-отчета')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Сравнить два отчета')
+    parser.add_argument('--scenario', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2, ensure_ascii=False))
+        return
+    if args.scenario:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(sorted(unknown))}')
+    # Сценарии, изменяющие данные, - после читающих
+    scenarios.sort(key=SCENARIOS.index)
+
+    temporary = args.workdir is None
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix='filescloud-suite-')
+    os.makedirs(args.workdir, exist_ok=True)
+    try:
+        seeded = seed(args)
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'threads': args.threads,
+                'seconds': args.seconds,
+            },
+            'dataset': seeded,
+            'scenarios': {},
+        }
+        common = [
+            '--files', str(args.files), '--users', str(args.users),
+            '--share-ratio', str(args.share_ratio), '--trash-ratio', str(args.trash_ratio),
+            '--blobs', str(args.blobs), '--blob-kb', str(args.blob_kb),
+            '--threads', str(args.threads), '--seconds', str(args.seconds),
+            '--seed', str(args.seed), '--workdir', args.workdir,
+        ]
+        if args.database_url:
+            common += ['--database-url', args.database_url]
+        for scenario in scenarios:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_suite', *common, '--scenario', scenario],
+                check=True, capture_output=True, text=True, cwd=ROOT
+            ).stdout
+            report['scenarios'][scenario] = json.loads(output.strip().splitlines()[-1])
+            print(f'{scenario}: {report["scenarios"][scenario]}', file=sys.stderr)
+    finally:
+        if temporary:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
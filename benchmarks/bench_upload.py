@@ -0,0 +1,142 @@
+"""
+Бенчмарк загрузки через форму: потоковый разбор multipart прямо в
+хранилище блобов (StreamingRequest) против разбора Werkzeug во временный
+файл с последующим копированием в хранилище.
+
+Каждый режим запускается в отдельном процессе, чтобы пиковый RSS
+(ru_maxrss) одного режима не влиял на другой.
+
+Запуск:
+    python -m benchmarks.bench_upload --size-mb 1024
+"""
+
+import argparse
+import io
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+from benchmarks.common import make_app, random_text
+
+BLOCK = 1024 * 1024
+BOUNDARY = 'filescloud-bench-boundary'
+
+
+class MultipartBody(io.RawIOBase):
+    """Тело multipart-запроса с одним файлом, генерируемое на лету"""
+
+    def __init__(self, size: int):
+        self.head = (
+            f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="file"; filename="bench.txt"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode()
+        self.tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+        self.block = random_text(BLOCK)
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # Тестовый клиент Werkzeug определяет длину тела через seek/tell
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.length}[whence]
+        self.position = max(0, min(base + offset, self.length))
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        data_end = len(self.head) + self.size
+        if self.position < len(self.head):
+            chunk = self.head[self.position:]
+        elif self.position < data_end:
+            offset = (self.position - len(self.head)) % BLOCK
+            chunk = self.block[offset:offset + min(BLOCK - offset, data_end - self.position)]
+        else:
+            chunk = self.tail[self.position - data_end:]
+        chunk = chunk[:len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_mode(mode: str, size_mb: int) -> dict:
+    """Одна загрузка в текущем процессе"""
+    size = size_mb * 1024 * 1024
+    app, workdir = make_app(MAX_CONTENT_LENGTH=size + BLOCK)
+    if mode == 'spooled':
+        from flask import Request
+        app.request_class = Request
+
+    client = app.test_client()
+    password = 'benchmark-password'
+    client.post('/register', data={'username': 'bench', 'password': password, 'confirm': password})
+    client.post('/login', data={'username': 'bench', 'password': password})
+
+    body = MultipartBody(size)
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    response = client.post(
+        '/upload',
+        input_stream=io.BufferedReader(body, BLOCK),
+        content_length=body.length,
+        content_type=f'multipart/form-data; boundary={BOUNDARY}'
+    )
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 302, response.status_code
+
+    with app.app_context():
+        from app.models import File
+        stored = File.query.one()
+        assert stored.size == size, stored.size
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'mode': mode,
+        'size_mb': size_mb,
+        'elapsed_s': round(elapsed, 3),
+        'mb_per_s': round(size_mb / elapsed, 1),
+        'max_rss_before_mb': rss_before,
+        'max_rss_mb': max_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--mode', choices=['streaming', 'spooled'],
+                        help='Запустить один режим в текущем процессе')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.size_mb)))
+        return
+
+    report = {}
+    for mode in ('spooled', 'streaming'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_upload',
+             '--size-mb', str(args.size_mb), '--mode', mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
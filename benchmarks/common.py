@@ -0,0 +1,65 @@
+"""
+Общие помощники для бенчмарков FilesCloud.
+
+Каждый бенчмарк работает с отдельной временной базой и каталогом
+загрузок, рабочие данные приложения не затрагиваются.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def make_app(workdir: str = None, **overrides):
+    """
+    Создает приложение с временной SQLite-базой и каталогом загрузок.
+
+    Returns:
+        tuple: (app, workdir)
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='filescloud-bench-')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from config import Config
+    Config.SQLALCHEMY_DATABASE_URI = overrides.pop(
+        'SQLALCHEMY_DATABASE_URI', f"sqlite:///{Path(workdir) / 'bench.db'}"
+    )
+    Config.UPLOAD_FOLDER = str(Path(workdir) / 'uploads')
+    Config.WTF_CSRF_ENABLED = False
+    # Бенчмарки регистрируют много пользователей с одного адреса
+    overrides.setdefault('LOGIN_RATE_LIMIT', False)
+    for key, value in overrides.items():
+        setattr(Config, key, value)
+
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return app, workdir
+
+
+def random_text(size: int) -> bytes:
+    """Случайные данные размером size, которые проходят проверку типа как .txt"""
+    return os.urandom(size // 2 + 1).hex().encode()[:size]
+
+
+def timed(func, repeat: int = 20) -> dict:
+    """Запускает func repeat раз и возвращает статистику времени в мс"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
@@ -6,9 +6,93 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         f"sqlite:///{Path(__file__).parent / 'instance' / 'filescloud.db'}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Реплика для чтения в маршрутах read_only (app/database.py)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_REPLICA_STICKY = 5  # Сколько секунд после записи пользователь читает с основной базы
+    # Пул соединений PostgreSQL
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = 30  # Ожидание свободного соединения, сек
+    DB_POOL_RECYCLE = 1800  # Пересоздание соединений старше, сек
+    # SQLite: WAL и synchronous=NORMAL - запись не блокирует чтение, fsync только на контрольных точках
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = 30  # Ожидание блокировки записи, сек
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
     UPLOAD_FOLDER = str(Path(__file__).parent / 'uploads')
-    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB
+    # Бэкенд хранения: 'local', 'sharded' (несколько каталогов) или 's3'
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    STORAGE_ROOTS = list(filter(None, os.environ.get('STORAGE_ROOTS', '').split(os.pathsep)))
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # MinIO и другие S3-совместимые хранилища
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024  # Файлы больше загружаются multipart
+    S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024  # Размер части multipart-загрузки
+    S3_PRESIGNED_DOWNLOADS = True  # Скачивание по подписанной ссылке в обход приложения
+    S3_PRESIGN_TTL = 300  # Срок действия подписанной ссылки, сек
+    STORAGE_CHUNK_SIZE = 1024 * 1024  # Размер блока при хешировании и копировании
+    # Сжатие блобов на диске: None, 'zstd' или 'gzip'
+    STORAGE_CODEC = os.environ.get('STORAGE_CODEC') or None
+    STORAGE_CODEC_LEVEL = int(os.environ.get('STORAGE_CODEC_LEVEL', 3))
+    # Отдача файлов через прокси: None, 'x-accel' (nginx) или 'x-sendfile'
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD') or None
+    DOWNLOAD_ACCEL_PREFIX = '/protected-files/'  # internal location nginx, указывающий на UPLOAD_FOLDER (sharded: /<номер каталога>/)
+    ARCHIVE_COMPRESS_LEVEL = 1  # Уровень deflate в ZIP-архивах: сжатие не должно тормозить отдачу
+    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB на один запрос (форма или часть файла)
+    MAX_FILE_SIZE = 50 * 1024 * 1024 * 1024  # 50GB при загрузке по частям
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Рекомендуемый размер части для клиентов
+    UPLOAD_SESSION_TTL = 24 * 3600  # Время жизни незавершенной загрузки, сек
+    # Хеширование паролей (app/passwords.py): scrypt:N:r:p, pbkdf2:sha256:итерации или argon2id:t:m:p
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 - в потоке запроса
+    PASSWORD_HASH_QUEUE = 16  # Сверх этого числа ожидающих хеширования запросы сразу получают 429
+    PASSWORD_HASH_TIMEOUT = 10  # сек
+    # Ведра токенов для попыток входа и регистрации: пополнение (токенов/сек) и емкость
+    LOGIN_RATE_LIMIT = True
+    # Число доверенных обратных прокси перед приложением (nginx - 1): адрес клиента
+    # и схема берутся из X-Forwarded-For/-Proto; 0 - заголовкам не доверять
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+    PROXY_FIX_X_PROTO = int(os.environ.get('PROXY_FIX_X_PROTO', 0))
+    LOGIN_IP_RATE = 1.0
+    LOGIN_IP_BURST = 20
+    LOGIN_USER_RATE = 0.1
+    LOGIN_USER_BURST = 5
+    # Метрики Prometheus (app/metrics.py)
+    METRICS_ENABLED = True
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer-токен для /metrics; без него - только администраторам
+    METRICS_DIR = os.environ.get('METRICS_DIR')  # Снимки процессов gunicorn и Celery; None - только текущий процесс
+    METRICS_FLUSH_INTERVAL = 10  # Период записи снимка процесса, сек
+    METRICS_QUERY_WARNING = 30  # Запросы с большим числом SQL-запросов пишутся в лог (N+1); 0 - не писать
+    # Профилирование по требованию (app/profiling.py)
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # Bearer-токен для заголовка и /admin/profiles; без него - только администраторам
+    PROFILING_DIR = os.environ.get('PROFILING_DIR')  # Общий буфер процессов gunicorn и Celery; None - в памяти процесса, без задач
+    PROFILING_HEADER = 'X-Profile'  # Значение заголовка - режим: sampling или cprofile
+    PROFILING_MODE = 'sampling'  # Режим выборочного профилирования
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # Доля запросов, профилируемых без заголовка
+    PROFILING_TASK_SAMPLE_RATE = float(os.environ.get('PROFILING_TASK_SAMPLE_RATE', 0))  # Доля задач Celery
+    PROFILING_INTERVAL = 0.005  # Период снятия стеков, сек
+    PROFILING_BUFFER = 200  # Сколько последних профилей хранится
+    # Общий кэш процессов (Redis, KeyDB, Valkey); без него - кэш внутри процесса
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_KEY_PREFIX = 'filescloud:'
+    USER_CACHE_TTL = 10  # Время жизни снимка пользователя сессии, сек
+    USER_CACHE_LOCAL_TTL = 2  # Внутрипроцессный кэш перед Redis, сек
+    LAST_LOGIN_FLUSH_INTERVAL = 60  # Период записи времени последнего входа, сек
+    SHARE_CACHE_TTL = 60  # Время кэширования общих ссылок в общем кэше (Redis), сек
+    SHARE_CACHE_LOCAL_TTL = 2  # В памяти процесса: столько другие процессы видят старые настройки ссылки, сек
+    SHARE_COUNT_FLUSH_INTERVAL = 10  # Период записи счетчиков скачиваний без лимита, сек
+    THUMBNAIL_SIZES = (64, 256, 1024)  # Размеры превью (по длинной стороне), px
+    PREVIEW_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # Лимит кэша превью на диске
+    PREVIEW_MAX_AGE = 365 * 24 * 3600  # Срок кэширования превью в браузере, сек
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')  # None - фоновые задачи не ставятся
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'txt', 'docx', 'xlsx'}
+    DEFAULT_QUOTA_BYTES = int(os.environ['DEFAULT_QUOTA_BYTES']) \
+        if os.environ.get('DEFAULT_QUOTA_BYTES') else None  # None - без ограничений
+    ADMIN_USERNAMES = set(filter(None, os.environ.get('ADMIN_USERNAMES', '').split(',')))
     ITEMS_PER_PAGE = 10
+    LISTING_SHOW_TOTAL = True  # Показывать общее количество файлов (COUNT кэшируется на 60 сек)
+    API_COMPRESSION = True  # Сжатие JSON-ответов API (gzip, brotli при установленном пакете brotli)
     BABEL_DEFAULT_LOCALE = 'ru'
     BABEL_SUPPORTED_LOCALES = ['ru', 'en']
\ No newline at end of file
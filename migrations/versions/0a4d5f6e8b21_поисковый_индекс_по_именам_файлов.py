@@ -0,0 +1,79 @@
+"""Поисковый индекс по именам файлов.
+
+Revision ID: 0a4d5f6e8b21
+Revises: c7f13b8e2a90
+Create Date: 2026-10-18 14:21:09.641870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a4d5f6e8b21'
+down_revision = 'c7f13b8e2a90'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE files_fts USING fts5(
+        filename, owner, content='', prefix='2 3',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, filename, owner)
+        VALUES (new.id, new.filename, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename, owner)
+        VALUES ('delete', old.id, old.filename, 'u' || old.user_id);
+    END""",
+    """CREATE TRIGGER files_fts_au AFTER UPDATE OF filename, user_id ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename, owner)
+        VALUES ('delete', old.id, old.filename, 'u' || old.user_id);
+        INSERT INTO files_fts(rowid, filename, owner)
+        VALUES (new.id, new.filename, 'u' || new.user_id);
+    END""",
+    """INSERT INTO files_fts(rowid, filename, owner)
+        SELECT id, filename, 'u' || user_id FROM files""",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS files_fts_au",
+    "DROP TRIGGER IF EXISTS files_fts_ad",
+    "DROP TRIGGER IF EXISTS files_fts_ai",
+    "DROP TABLE IF EXISTS files_fts",
+]
+
+POSTGRES_UPGRADE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX ix_files_filename_tsv ON files USING gin (
+        to_tsvector('simple', regexp_replace(filename, '[_.\\-]+', ' ', 'g')))""",
+    "CREATE INDEX ix_files_filename_trgm ON files USING gin (filename gin_trgm_ops)",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_files_filename_trgm",
+    "DROP INDEX IF EXISTS ix_files_filename_tsv",
+]
+
+
+def _run(statements):
+    for statement in statements:
+        op.execute(statement)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _run(SQLITE_UPGRADE)
+    elif dialect == 'postgresql':
+        _run(POSTGRES_UPGRADE)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _run(SQLITE_DOWNGRADE)
+    elif dialect == 'postgresql':
+        _run(POSTGRES_DOWNGRADE)
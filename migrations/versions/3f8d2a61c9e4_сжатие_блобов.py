@@ -0,0 +1,31 @@
+"""Сжатие блобов.
+
+Revision ID: 3f8d2a61c9e4
+Revises: e91b0c3d7a56
+Create Date: 2026-10-18 17:05:12.408317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8d2a61c9e4'
+down_revision = 'e91b0c3d7a56'
+branch_labels = None
+depends_on = None
+
+
+# Колонки добавляются и удаляются без batch-режима: в SQLite пересоздание
+# таблицы files удалило бы триггеры поискового индекса files_fts
+
+
+def upgrade():
+    op.add_column('files', sa.Column('stored_size', sa.BigInteger(), nullable=True))
+    op.add_column('files', sa.Column('codec', sa.String(length=8), nullable=True))
+    op.execute("UPDATE files SET stored_size = size")
+
+
+def downgrade():
+    op.drop_column('files', 'codec')
+    op.drop_column('files', 'stored_size')
@@ -0,0 +1,35 @@
+"""Общий доступ к папкам.
+
+Revision ID: 4d6b8f0a2c17
+Revises: c2a7e5f94d18
+Create Date: 2026-10-18 23:05:41.318902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d6b8f0a2c17'
+down_revision = 'c2a7e5f94d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('share_links', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('folder_id', sa.Integer(), nullable=True))
+        batch_op.alter_column('file_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.create_foreign_key('fk_share_links_folder_id_folders', 'folders',
+                                    ['folder_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_index(batch_op.f('ix_share_links_folder_id'), ['folder_id'], unique=False)
+
+
+def downgrade():
+    # Ссылки на папки в старой схеме не представимы
+    op.execute("DELETE FROM share_links WHERE folder_id IS NOT NULL")
+    with op.batch_alter_table('share_links', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_share_links_folder_id'))
+        batch_op.drop_constraint('fk_share_links_folder_id_folders', type_='foreignkey')
+        batch_op.alter_column('file_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('folder_id')
@@ -0,0 +1,29 @@
+"""MIME-тип файлов.
+
+Revision ID: 6a1c3e9d4b72
+Revises: 4d6b8f0a2c17
+Create Date: 2026-10-18 23:48:17.530614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1c3e9d4b72'
+down_revision = '4d6b8f0a2c17'
+branch_labels = None
+depends_on = None
+
+
+# Без batch-режима: пересоздание таблицы files в SQLite удалило бы
+# триггеры поискового индекса files_fts. Для уже загруженных файлов тип
+# остается NULL и при отдаче определяется по имени, как раньше
+
+
+def upgrade():
+    op.add_column('files', sa.Column('mime_type', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    op.drop_column('files', 'mime_type')
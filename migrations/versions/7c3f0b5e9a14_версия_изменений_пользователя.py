@@ -0,0 +1,26 @@
+"""Версия изменений пользователя.
+
+Revision ID: 7c3f0b5e9a14
+Revises: 6a1c3e9d4b72
+Create Date: 2026-10-19 10:12:41.806327
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3f0b5e9a14'
+down_revision = '6a1c3e9d4b72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('change_version')
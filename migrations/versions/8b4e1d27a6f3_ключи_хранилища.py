@@ -0,0 +1,51 @@
+"""Ключи хранилища вместо абсолютных путей.
+
+Revision ID: 8b4e1d27a6f3
+Revises: 3f8d2a61c9e4
+Create Date: 2026-10-18 18:41:27.113502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e1d27a6f3'
+down_revision = '3f8d2a61c9e4'
+branch_labels = None
+depends_on = None
+
+
+def _prefix() -> str:
+    return current_app.config['UPLOAD_FOLDER'].rstrip('/') + '/'
+
+
+def upgrade():
+    # Ключ блоба однозначно определяется хешем и кодеком, так что он не
+    # зависит от того, где был UPLOAD_FOLDER при загрузке
+    op.execute(
+        "UPDATE files SET storage_path = 'blobs/' || substr(content_hash, 1, 2) || '/' "
+        "|| substr(content_hash, 3, 2) || '/' || content_hash || "
+        "CASE codec WHEN 'gzip' THEN '.gz' WHEN 'zstd' THEN '.zst' ELSE '' END "
+        "WHERE content_hash IS NOT NULL"
+    )
+    # Файлы старого формата: путь относительно UPLOAD_FOLDER
+    prefix = _prefix()
+    op.get_bind().execute(
+        sa.text(
+            "UPDATE files SET storage_path = substr(storage_path, :start) "
+            "WHERE content_hash IS NULL AND substr(storage_path, 1, :length) = :prefix"
+        ),
+        {'start': len(prefix) + 1, 'length': len(prefix), 'prefix': prefix}
+    )
+
+
+def downgrade():
+    op.get_bind().execute(
+        sa.text(
+            "UPDATE files SET storage_path = :prefix || storage_path "
+            "WHERE substr(storage_path, 1, 1) != '/'"
+        ),
+        {'prefix': _prefix()}
+    )
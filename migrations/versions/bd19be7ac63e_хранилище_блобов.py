@@ -0,0 +1,56 @@
+"""Хранилище блобов.
+
+Revision ID: bd19be7ac63e
+Revises: 924c2cc68c4f
+Create Date: 2026-10-18 10:12:03.418521
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd19be7ac63e'
+down_revision = '924c2cc68c4f'
+branch_labels = None
+depends_on = None
+
+# Уникальное ограничение на storage_path в начальной миграции создано без
+# имени; для SQLite его можно снять только через naming_convention
+naming_convention = {
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+}
+
+
+def _storage_path_constraint():
+    if op.get_bind().dialect.name == 'sqlite':
+        return 'uq_files_storage_path'
+    return 'files_storage_path_key'
+
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('hash')
+    )
+
+    with op.batch_alter_table('files', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(_storage_path_constraint(), type_='unique')
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_files_storage_path'), ['storage_path'], unique=False)
+        batch_op.create_index(batch_op.f('ix_files_content_hash'), ['content_hash'], unique=False)
+        batch_op.create_foreign_key('fk_files_content_hash_blobs', 'blobs', ['content_hash'], ['hash'])
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('fk_files_content_hash_blobs', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_files_content_hash'))
+        batch_op.drop_index(batch_op.f('ix_files_storage_path'))
+        batch_op.drop_column('content_hash')
+        batch_op.create_unique_constraint(_storage_path_constraint(), ['storage_path'])
+
+    op.drop_table('blobs')
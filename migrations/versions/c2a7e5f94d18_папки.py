@@ -0,0 +1,63 @@
+"""Папки.
+
+Revision ID: c2a7e5f94d18
+Revises: 8b4e1d27a6f3
+Create Date: 2026-10-18 20:12:53.604218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a7e5f94d18'
+down_revision = '8b4e1d27a6f3'
+branch_labels = None
+depends_on = None
+
+
+# Колонки добавляются и удаляются без batch-режима: в SQLite пересоздание
+# таблицы files удалило бы триггеры поискового индекса files_fts
+
+
+def upgrade():
+    op.create_table('folders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=256), nullable=False),
+    sa.Column('path', sa.String(length=512).with_variant(sa.String(length=512, collation='C'), 'postgresql'), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.Column('file_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('total_size', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('is_deleted', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['parent_id'], ['folders.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_folders_children', 'folders', ['user_id', 'parent_id', 'is_deleted', 'name'], unique=False)
+    op.create_index('ix_folders_path', 'folders', ['user_id', 'path'], unique=False)
+
+    op.add_column('files', sa.Column('folder_id', sa.Integer(), nullable=True))
+    op.create_index('ix_files_folder', 'files', ['user_id', 'folder_id', 'is_deleted', 'uploaded_at', 'id'], unique=False)
+    op.add_column('upload_sessions', sa.Column('folder_id', sa.Integer(), nullable=True))
+    # SQLite не умеет добавлять ограничения к существующей таблице
+    if op.get_bind().dialect.name != 'sqlite':
+        op.create_foreign_key('fk_files_folder_id_folders', 'files', 'folders',
+                              ['folder_id'], ['id'], ondelete='CASCADE')
+        op.create_foreign_key('fk_upload_sessions_folder_id_folders', 'upload_sessions', 'folders',
+                              ['folder_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('fk_upload_sessions_folder_id_folders', 'upload_sessions', type_='foreignkey')
+        op.drop_constraint('fk_files_folder_id_folders', 'files', type_='foreignkey')
+    op.drop_column('upload_sessions', 'folder_id')
+    op.drop_index('ix_files_folder', table_name='files')
+    op.drop_column('files', 'folder_id')
+    op.drop_index('ix_folders_path', table_name='folders')
+    op.drop_index('ix_folders_children', table_name='folders')
+    op.drop_table('folders')
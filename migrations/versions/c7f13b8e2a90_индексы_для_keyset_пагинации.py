@@ -0,0 +1,28 @@
+"""Индексы для keyset-пагинации.
+
+Revision ID: c7f13b8e2a90
+Revises: 5e2a9c71f0d4
+Create Date: 2026-10-18 13:05:52.117304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f13b8e2a90'
+down_revision = '5e2a9c71f0d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.create_index('ix_files_listing', ['user_id', 'is_deleted', 'uploaded_at', 'id'], unique=False)
+        batch_op.create_index('ix_files_trash', ['user_id', 'is_deleted', 'deleted_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index('ix_files_trash')
+        batch_op.drop_index('ix_files_listing')
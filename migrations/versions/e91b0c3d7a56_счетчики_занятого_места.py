@@ -0,0 +1,52 @@
+"""Счетчики занятого места.
+
+Revision ID: e91b0c3d7a56
+Revises: 0a4d5f6e8b21
+Create Date: 2026-10-18 15:47:33.280154
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e91b0c3d7a56'
+down_revision = '0a4d5f6e8b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bytes_used', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('file_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('trash_bytes', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('trash_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('quota_bytes', sa.BigInteger(), nullable=True))
+
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_files_uploaded_at'), ['uploaded_at'], unique=False)
+
+    # Начальные значения счетчиков по существующим файлам
+    op.execute("""
+        UPDATE users SET
+            bytes_used = COALESCE((SELECT SUM(size) FROM files WHERE files.user_id = users.id), 0),
+            file_count = (SELECT COUNT(*) FROM files
+                          WHERE files.user_id = users.id AND files.is_deleted = false),
+            trash_bytes = COALESCE((SELECT SUM(size) FROM files
+                                    WHERE files.user_id = users.id AND files.is_deleted = true), 0),
+            trash_count = (SELECT COUNT(*) FROM files
+                           WHERE files.user_id = users.id AND files.is_deleted = true)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_uploaded_at'))
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('quota_bytes')
+        batch_op.drop_column('trash_count')
+        batch_op.drop_column('trash_bytes')
+        batch_op.drop_column('file_count')
+        batch_op.drop_column('bytes_used')
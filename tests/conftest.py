@@ -0,0 +1,127 @@
+"""
+Общие фикстуры тестов: приложение на временной базе SQLite и каталоге
+загрузок, клиенты с вошедшими пользователями.
+
+Запуск из корня проекта:
+    python -m pytest
+"""
+
+import io
+import logging
+
+import pytest
+
+from config import Config
+
+# create_app пишет лог в app.log, только если корневой логгер не настроен
+logging.basicConfig(level=logging.WARNING)
+
+from app import create_app, db  # noqa: E402
+from app.metrics import registry  # noqa: E402
+from app.pagination import count_cache  # noqa: E402
+from app.ratelimit import login_limiter  # noqa: E402
+from app.sharing import download_counter, share_cache  # noqa: E402
+from app.storage import BlobStore  # noqa: E402
+from app.users import last_login_buffer, local_user_cache  # noqa: E402
+
+PASSWORD = 'password123'
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Настройки тестового приложения; тест может менять их до фикстуры app"""
+    overrides = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/test.db',
+        'DATABASE_REPLICA_URL': None,
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'LOGIN_RATE_LIMIT': False,
+        'CACHE_REDIS_URL': None,
+        'CELERY_BROKER_URL': None,
+        'METRICS_DIR': None,
+        'PROFILING_ENABLED': False,
+        'PROFILING_DIR': None,
+        'STORAGE_BACKEND': 'local',
+        'STORAGE_CODEC': None,
+        'DOWNLOAD_OFFLOAD': None,
+    }
+    for name, value in overrides.items():
+        monkeypatch.setattr(Config, name, value, raising=False)
+    # Пустой app.log создается в текущем каталоге в любом случае
+    monkeypatch.chdir(tmp_path)
+    return Config
+
+
+@pytest.fixture
+def gzip_storage(config, monkeypatch):
+    """Сжатие блобов на диске (до фикстуры app)"""
+    monkeypatch.setattr(config, 'STORAGE_CODEC', 'gzip')
+
+
+@pytest.fixture
+def app(config):
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    yield app
+    download_counter.flusher.stop()
+    last_login_buffer.flusher.stop()
+    registry.flusher.stop()
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # Кэши и буферы уровня модуля переживают приложение
+    for cache in (count_cache, share_cache, local_user_cache):
+        cache.clear()
+    login_limiter._buckets.clear()
+    download_counter._pending.clear()
+    last_login_buffer._pending.clear()
+
+
+@pytest.fixture
+def login(app):
+    """Фабрика клиентов: регистрирует пользователя (если нужно) и входит"""
+    def login(username='alice', password=PASSWORD):
+        client = app.test_client()
+        client.post('/register', data={
+            'username': username, 'password': password, 'confirm': password
+        })
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302, response.status_code
+        return client
+    return login
+
+
+@pytest.fixture
+def client(login):
+    return login()
+
+
+@pytest.fixture
+def upload():
+    """Загрузка файла через форму веб-интерфейса"""
+    def upload(client, filename, data=b'hello', folder_id=None):
+        form = {'file': (io.BytesIO(data), filename)}
+        if folder_id is not None:
+            form['folder_id'] = str(folder_id)
+        return client.post('/upload', data=form, content_type='multipart/form-data')
+    return upload
+
+
+@pytest.fixture
+def writers(monkeypatch):
+    """Счетчик BlobWriter, открытых хранилищем"""
+    opened = []
+    open_writer = BlobStore.open_writer
+
+    def recording(self, *args, **kwargs):
+        writer = open_writer(self, *args, **kwargs)
+        opened.append(writer)
+        return writer
+
+    monkeypatch.setattr(BlobStore, 'open_writer', recording)
+    return opened
@@ -0,0 +1,266 @@
+"""JSON API: списки файлов, выбор полей, ETag и сжатие"""
+
+import gzip
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def tree(client, upload):
+    """
+    Файлы и папки пользователя:
+    a.txt, b.txt в корне; c.txt в папке docs; d.txt в корзине;
+    пустая папка empty и папка old с e.txt - в корзине.
+    """
+    folders = {}
+    for name in ('docs', 'empty', 'old', 'other'):
+        folders[name] = client.post('/api/v1/folders', json={'name': name}).get_json()['id']
+    for name in ('a.txt', 'b.txt', 'd.txt'):
+        upload(client, name)
+    upload(client, 'c.txt', folder_id=folders['docs'])
+    upload(client, 'e.txt', folder_id=folders['old'])
+
+    files = {}
+    for folder_id in (None, folders['docs'], folders['old']):
+        query = f'&folder_id={folder_id}' if folder_id else ''
+        for item in client.get(f'/api/v1/files?fields=id,filename{query}').get_json()['files']:
+            files[item['filename'].split('_', 1)[1]] = item['id']
+
+    client.post('/api/v1/files/bulk/delete', json={'ids': [files['d.txt']]})
+    client.delete(f'/api/v1/folders/{folders["empty"]}')
+    client.delete(f'/api/v1/folders/{folders["old"]}')
+    return {'files': files, 'folders': folders}
+
+
+def chunked_upload(client, data=b'chunked'):
+    upload = client.post('/api/v1/uploads', json={'filename': 'f.txt', 'size': len(data)})
+    upload_id = upload.get_json()['id']
+    client.put(f'/api/v1/uploads/{upload_id}?offset=0', data=data)
+    return client.post(f'/api/v1/uploads/{upload_id}/complete', json={})
+
+
+MUTATIONS = {
+    'web upload': lambda c, t, upload: upload(c, 'new.txt'),
+    'web delete': lambda c, t, _: c.post(f'/delete/{t["files"]["a.txt"]}'),
+    'web restore': lambda c, t, _: c.post(f'/restore/{t["files"]["d.txt"]}'),
+    'web purge': lambda c, t, _: c.post(f'/purge/{t["files"]["d.txt"]}'),
+    'web share': lambda c, t, _: c.post(f'/share/{t["files"]["a.txt"]}',
+                                        data={'expiration': 0, 'download_limit': 0}),
+    'web new folder': lambda c, t, _: c.post('/folders', data={'name': 'web'}),
+    'web rename folder': lambda c, t, _: c.post(f'/folders/{t["folders"]["docs"]}/rename',
+                                                data={'name': 'renamed'}),
+    'web delete folder': lambda c, t, _: c.post(f'/folders/{t["folders"]["docs"]}/delete'),
+    'web restore folder': lambda c, t, _: c.post(f'/folders/{t["folders"]["empty"]}/restore'),
+    'web purge empty folder': lambda c, t, _: c.post(f'/folders/{t["folders"]["empty"]}/purge'),
+    'chunked upload': lambda c, t, _: chunked_upload(c),
+    'bulk delete': lambda c, t, _: c.post('/api/v1/files/bulk/delete',
+                                          json={'ids': [t['files']['a.txt']]}),
+    'bulk restore': lambda c, t, _: c.post('/api/v1/files/bulk/restore',
+                                           json={'ids': [t['files']['d.txt']]}),
+    'bulk purge': lambda c, t, _: c.post('/api/v1/files/bulk/purge',
+                                         json={'ids': [t['files']['d.txt']]}),
+    'bulk share': lambda c, t, _: c.post('/api/v1/files/bulk/share',
+                                         json={'ids': [t['files']['a.txt']]}),
+    'bulk move': lambda c, t, _: c.post('/api/v1/files/bulk/move', json={
+        'ids': [t['files']['a.txt']], 'folder_id': t['folders']['docs']
+    }),
+    'create folder': lambda c, t, _: c.post('/api/v1/folders', json={'name': 'api'}),
+    'rename folder': lambda c, t, _: c.patch(f'/api/v1/folders/{t["folders"]["docs"]}',
+                                             json={'name': 'renamed'}),
+    'move folder': lambda c, t, _: c.patch(f'/api/v1/folders/{t["folders"]["other"]}',
+                                           json={'parent_id': t['folders']['docs']}),
+    'delete folder': lambda c, t, _: c.delete(f'/api/v1/folders/{t["folders"]["docs"]}'),
+    'restore folder': lambda c, t, _: c.post(f'/api/v1/folders/{t["folders"]["empty"]}/restore'),
+    'purge empty folder': lambda c, t, _: c.post(f'/api/v1/folders/{t["folders"]["empty"]}/purge'),
+    'purge folder': lambda c, t, _: c.post(f'/api/v1/folders/{t["folders"]["old"]}/purge'),
+    'share folder': lambda c, t, _: c.post(f'/api/v1/folders/{t["folders"]["docs"]}/share',
+                                           json={}),
+}
+
+
+@pytest.mark.parametrize('mutation', MUTATIONS)
+def test_mutation_changes_etag(client, tree, upload, mutation):
+    urls = ['/api/v1/files', '/api/v1/trash', f'/api/v1/folders/{tree["folders"]["other"]}']
+    etags = {url: client.get(url).headers['ETag'] for url in urls}
+    for url, etag in etags.items():
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    response = MUTATIONS[mutation](client, tree, upload)
+    assert response.status_code < 400, response.get_data(as_text=True)
+
+    for url, etag in etags.items():
+        conditional = client.get(url, headers={'If-None-Match': etag})
+        assert conditional.status_code == 200, url
+        assert conditional.headers['ETag'] != etag
+
+
+def test_bulk_unshare_changes_etag(client, tree):
+    file_id = tree['files']['a.txt']
+    client.post('/api/v1/files/bulk/share', json={'ids': [file_id]})
+    etag = client.get('/api/v1/files').headers['ETag']
+
+    assert client.post('/api/v1/files/bulk/unshare', json={'ids': [file_id]}).get_json() == {
+        'affected': 1
+    }
+    conditional = client.get('/api/v1/files?fields=id,share_url',
+                             headers={'If-None-Match': etag})
+    assert conditional.status_code == 200
+    assert all(item['share_url'] is None for item in conditional.get_json()['files'])
+
+
+def test_purged_empty_folder_leaves_trash_listing(client, tree):
+    empty = tree['folders']['empty']
+    listing = client.get('/api/v1/trash')
+    assert empty in [folder['id'] for folder in listing.get_json()['folders']]
+
+    client.post(f'/api/v1/folders/{empty}/purge')
+    conditional = client.get('/api/v1/trash', headers={'If-None-Match': listing.headers['ETag']})
+    assert conditional.status_code == 200
+    assert empty not in [folder['id'] for folder in conditional.get_json()['folders']]
+
+
+def trash_files(client, upload, count):
+    for index in range(count):
+        upload(client, f'trash{index}.txt')
+    ids = [item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files']]
+    client.post('/api/v1/files/bulk/delete', json={'ids': ids})
+
+
+def test_bulk_purge_filter_runs_in_batches(client, upload, monkeypatch):
+    import app.api
+    trash_files(client, upload, 5)
+    monkeypatch.setattr(app.api, 'BULK_PURGE_BATCH', 2)
+    batches = []
+    purge_rows = app.api.purge_rows
+
+    def recording(rows, *criteria):
+        batches.append(len(rows))
+        return purge_rows(rows, *criteria)
+
+    monkeypatch.setattr(app.api, 'purge_rows', recording)
+    response = client.post('/api/v1/files/bulk/purge', json={'filter': {'q': ''}})
+
+    assert response.get_json() == {'affected': 5, 'bytes': 5 * len(b'hello')}
+    assert batches == [2, 2, 1]
+    assert client.get('/api/v1/trash').get_json()['files'] == []
+
+
+def test_bulk_purge_failed_batch_can_be_retried(client, upload, monkeypatch):
+    import app.api
+    trash_files(client, upload, 3)
+    monkeypatch.setattr(app.api, 'BULK_PURGE_BATCH', 2)
+    purge_rows = app.api.purge_rows
+    calls = []
+
+    def fail_second(rows, *criteria):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError('boom')
+        return purge_rows(rows, *criteria)
+
+    monkeypatch.setattr(app.api, 'purge_rows', fail_second)
+    assert client.post('/api/v1/files/bulk/purge', json={'filter': {'q': ''}}).status_code == 500
+    assert len(client.get('/api/v1/trash').get_json()['files']) == 1
+
+    response = client.post('/api/v1/files/bulk/purge', json={'filter': {'q': ''}})
+    assert response.get_json()['affected'] == 1
+    assert client.get('/api/v1/trash').get_json()['files'] == []
+
+
+
+def trashed_folder(client, upload, count):
+    """Папка в корзине с вложенной подпапкой и count файлами в них"""
+    outer = client.post('/api/v1/folders', json={'name': 'outer'}).get_json()['id']
+    inner = client.post('/api/v1/folders', json={'name': 'inner', 'parent_id': outer}).get_json()['id']
+    for index in range(count):
+        upload(client, f'sub{index}.txt', folder_id=(outer, inner)[index % 2])
+    client.delete(f'/api/v1/folders/{outer}')
+    return outer
+
+
+def test_purge_folder_runs_in_batches(client, upload, monkeypatch):
+    import app.trash
+    outer = trashed_folder(client, upload, 5)
+    monkeypatch.setattr(app.trash, 'BULK_PURGE_BATCH', 2)
+    batches = []
+    purge_rows = app.trash.purge_rows
+
+    def recording(rows, *criteria):
+        batches.append(len(rows))
+        return purge_rows(rows, *criteria)
+
+    monkeypatch.setattr(app.trash, 'purge_rows', recording)
+    response = client.post(f'/api/v1/folders/{outer}/purge')
+
+    assert response.get_json() == {'affected': 5, 'bytes': 5 * len(b'hello')}
+    assert batches == [2, 2, 1]
+    assert client.get('/api/v1/trash').get_json()['folders'] == []
+
+
+def test_purge_folder_failed_batch_can_be_retried(client, upload, monkeypatch):
+    import app.trash
+    outer = trashed_folder(client, upload, 3)
+    monkeypatch.setattr(app.trash, 'BULK_PURGE_BATCH', 2)
+    purge_rows = app.trash.purge_rows
+    calls = []
+
+    def fail_second(rows, *criteria):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError('boom')
+        return purge_rows(rows, *criteria)
+
+    monkeypatch.setattr(app.trash, 'purge_rows', fail_second)
+    assert client.post(f'/api/v1/folders/{outer}/purge').status_code == 500
+    # Первая пачка удалена, папка осталась в корзине
+    assert [item['id'] for item in client.get('/api/v1/trash').get_json()['folders']] == [outer]
+
+    response = client.post(f'/api/v1/folders/{outer}/purge')
+    assert response.get_json()['affected'] == 1
+    assert client.get('/api/v1/trash').get_json()['folders'] == []
+
+
+def test_etag_is_per_user(login, tree, client):
+    etag = client.get('/api/v1/files').headers['ETag']
+    other = login('bobby')
+    assert other.get('/api/v1/files', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_fields_selection(client, tree):
+    files = client.get('/api/v1/files?fields=id,size').get_json()['files']
+    assert files and all(set(item) == {'id', 'size'} for item in files)
+
+    response = client.get('/api/v1/files?fields=id,bogus')
+    assert response.status_code == 400
+    assert 'bogus' in response.get_json()['error']
+
+
+def test_cursor_pages_cover_listing(client, upload):
+    for index in range(5):
+        upload(client, f'page{index}.txt')
+    seen, cursor = [], None
+    while True:
+        query = f'&after={cursor}' if cursor else ''
+        page = client.get(f'/api/v1/files?limit=2&fields=id{query}').get_json()
+        seen.extend(item['id'] for item in page['files'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert sorted(seen, reverse=True) == seen and len(set(seen)) == 5
+
+
+def test_legacy_prefix_serves_same_listing(client, tree):
+    assert client.get('/api/files').get_json() == client.get('/api/v1/files').get_json()
+
+
+def test_large_listing_is_gzipped(client, upload):
+    for index in range(20):
+        upload(client, f'file{index}.txt')
+    response = client.get('/api/v1/files?limit=20', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(gzip.decompress(response.data)) > len(response.data)
+
+    plain = client.get('/api/v1/files?limit=20')
+    assert 'Content-Encoding' not in plain.headers
@@ -0,0 +1,95 @@
+"""ZIP-архивы папок и выбранных файлов"""
+
+import io
+import random
+import zipfile
+import zlib
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import archives, db
+from app.archives import _unique_name
+from app.models import File
+
+TEXT = b'compressible text ' * 200
+# Сигнатура PNG и несжимаемые данные
+PNG = b'\x89PNG\r\n\x1a\n' + random.Random(0).randbytes(4096)
+
+
+def test_unique_name_adds_counter():
+    used = {'docs'}
+    names = [_unique_name(name, used) for name in
+             ('a.txt', 'a.txt', 'A.TXT', 'docs', 'docs/a.txt', 'docs/a.txt', 'README')]
+    assert names == ['a.txt', 'a (1).txt', 'A (2).TXT', 'docs (1)',
+                     'docs/a.txt', 'docs/a (1).txt', 'README']
+
+
+def folder_archive(app, client, upload):
+    """Папка docs: два файла с одним именем, вложенная папка data и файл data"""
+    docs = client.post('/api/v1/folders', json={'name': 'docs'}).get_json()['id']
+    client.post('/api/v1/folders', json={'name': 'data', 'parent_id': docs})
+    upload(client, 'a.txt', TEXT, folder_id=docs)
+    upload(client, 'b.txt', TEXT, folder_id=docs)
+    upload(client, 'c.png', PNG, folder_id=docs)
+    with app.app_context():
+        rows = db.session.scalars(db.select(File).order_by(File.id)).all()
+        names = {rows[0].id: 'same.txt', rows[1].id: 'same.txt', rows[2].id: 'data'}
+        for file_id, name in names.items():
+            db.session.execute(update(File).where(File.id == file_id).values(filename=name))
+        db.session.commit()
+
+    response = client.get(f'/api/v1/folders/{docs}/download')
+    assert response.status_code == 200
+    return zipfile.ZipFile(io.BytesIO(response.data))
+
+
+def test_folder_archive_dedupes_names(app, client, upload):
+    archive = folder_archive(app, client, upload)
+    assert sorted(archive.namelist()) == [
+        'docs/', 'docs/data (1)', 'docs/data/', 'docs/same (1).txt', 'docs/same.txt'
+    ]
+    assert archive.read('docs/same.txt') == TEXT
+    assert archive.read('docs/same (1).txt') == TEXT
+    assert archive.testzip() is None
+
+
+def test_archive_compression_follows_content(app, client, upload, config, monkeypatch):
+    monkeypatch.setattr(config, 'ARCHIVE_COMPRESS_LEVEL', 1)
+    archive = folder_archive(app, client, upload)
+    text = archive.getinfo('docs/same.txt')
+    assert text.compress_type == zipfile.ZIP_DEFLATED
+    assert text.compress_size < len(TEXT)
+    # Случайные данные не сжимаются повторно
+    assert archive.getinfo('docs/data (1)').compress_type == zipfile.ZIP_STORED
+
+
+def test_large_entries_use_zip64(app, client, upload, monkeypatch):
+    monkeypatch.setattr(archives, 'ZIP64_THRESHOLD', 100)
+    archive = folder_archive(app, client, upload)
+    info = archive.getinfo('docs/same.txt')
+    raw = archive.fp.getvalue()
+    # Локальный заголовок записи: имя (длина - в байтах 26-27) и за ним поле ZIP64 (0x0001)
+    name_length = int.from_bytes(raw[info.header_offset + 26:info.header_offset + 28], 'little')
+    extra_start = info.header_offset + 30 + name_length
+    assert raw[extra_start:extra_start + 2] == b'\x01\x00'
+    # Распаковка проверяет CRC и размеры из дескриптора данных ZIP64
+    assert archive.read('docs/same.txt') == TEXT
+
+
+def test_entries_keep_upload_date_and_level(app, client, upload):
+    app.config['ARCHIVE_COMPRESS_LEVEL'] = 1
+    upload(client, 'a.txt', TEXT)
+    with app.app_context():
+        db.session.execute(update(File).values(uploaded_at=datetime(2024, 5, 17, 10, 30, 12)))
+        db.session.commit()
+        file_id = db.session.scalar(db.select(File.id))
+
+    response = client.post('/api/v1/files/bulk/download', json={'ids': [file_id]})
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    info = archive.infolist()[0]
+    assert info.date_time == (2024, 5, 17, 10, 30, 12)
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    # Сжато с уровнем из настроек, а не с уровнем zlib по умолчанию
+    deflate = zlib.compressobj(1, zlib.DEFLATED, -15)
+    assert info.compress_size == len(deflate.compress(TEXT) + deflate.flush())
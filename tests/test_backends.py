@@ -0,0 +1,229 @@
+"""Бэкенды хранения: локальный каталог, несколько каталогов и S3"""
+
+import io
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import app.backends
+from app.backends import LocalBackend, S3Backend, ShardedLocalBackend
+
+MB = 1024 * 1024
+
+
+def make_source(tmp_path, data=b'0123456789', name='source'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_local_put_link_and_move(tmp_path):
+    backend = LocalBackend(tmp_path / 'store')
+    source = make_source(tmp_path)
+
+    backend.put_file('blobs/ab/one', source)
+    assert source.exists()
+    assert backend.exists('blobs/ab/one')
+    assert backend.stat('blobs/ab/one').size == 10
+    # Повторная запись того же ключа - не ошибка
+    backend.put_file('blobs/ab/one', source)
+
+    backend.put_file('blobs/ab/two', source, move=True)
+    assert not source.exists()
+    with backend.open('blobs/ab/two') as fh:
+        fh.seek(4)
+        assert fh.read(3) == b'456'
+
+
+def test_local_put_copies_across_filesystems(tmp_path, monkeypatch):
+    def cross_device(*args):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(app.backends.os, 'link', cross_device)
+    backend = LocalBackend(tmp_path / 'store')
+    source = make_source(tmp_path)
+
+    backend.put_file('blobs/key', source)
+    assert source.exists()
+    assert backend.local_path('blobs/key').read_bytes() == b'0123456789'
+    # Временный файл копии не остается рядом с целью
+    assert [p.name for p in backend.local_path('blobs/key').parent.iterdir()] == ['key']
+
+
+def test_local_stat_missing_and_delete(tmp_path):
+    backend = LocalBackend(tmp_path / 'store')
+    with pytest.raises(FileNotFoundError):
+        backend.stat('missing')
+
+    for index in range(4):
+        backend.put_file(f'k{index}', make_source(tmp_path, name=f's{index}'), move=True)
+    assert backend.delete(['k0', 'k1', 'k2', 'k3', 'missing'], workers=4) == 4
+    assert backend.delete(['k0']) == 0
+    assert backend.presigned_url('k0') is None
+
+
+def test_sharded_places_key_on_primary_shard(tmp_path):
+    roots = [tmp_path / 'a', tmp_path / 'b', tmp_path / 'c']
+    backend = ShardedLocalBackend(roots)
+    keys = [f'blobs/{index:02d}' for index in range(30)]
+    for key in keys:
+        backend.put_file(key, make_source(tmp_path))
+
+    used = set()
+    for key in keys:
+        holders = [i for i, shard in enumerate(backend.shards) if shard.exists(key)]
+        assert holders == [backend._primary(key)]
+        assert backend.accel_path(key) == f'{holders[0]}/{key}'
+        used.add(holders[0])
+    assert len(used) > 1
+    assert backend.delete(keys) == len(keys)
+    assert not any(backend.exists(key) for key in keys)
+
+
+def test_sharded_finds_key_not_yet_moved(tmp_path):
+    old = ShardedLocalBackend([tmp_path / 'a'])
+    keys = [f'blobs/{index:02d}' for index in range(30)]
+    for key in keys:
+        old.put_file(key, make_source(tmp_path))
+
+    grown = ShardedLocalBackend([tmp_path / 'a', tmp_path / 'b'])
+    moved = [key for key in keys if grown._primary(key) == 1]
+    assert moved
+    for key in moved:
+        # Новый основной каталог пуст, объект читается со старого места
+        assert grown.exists(key)
+        assert grown.local_path(key) == tmp_path / 'a' / key
+        assert grown.stat(key).size == 10
+        with grown.open(key) as fh:
+            assert fh.read() == b'0123456789'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_SESSION_TOKEN', 'testing'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        backend = S3Backend('files', prefix='data/', region='us-east-1',
+                            multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+        backend.client.create_bucket(Bucket='files')
+        yield backend
+
+
+def test_s3_put_stat_and_get(s3, tmp_path):
+    source = make_source(tmp_path)
+    s3.put_file('blobs/one', source)
+    assert source.exists()
+
+    head = s3.client.head_object(Bucket='files', Key='data/blobs/one')
+    assert head['ContentLength'] == 10
+    assert s3.exists('blobs/one')
+    assert s3.stat('blobs/one').size == 10
+    assert s3.local_path('blobs/one') is None
+    with s3.open('blobs/one') as fh:
+        assert fh.read() == b'0123456789'
+
+    s3.put_file('blobs/two', source, move=True)
+    assert not source.exists()
+    assert s3.exists('blobs/two')
+
+
+def test_s3_missing_object(s3):
+    assert not s3.exists('missing')
+    with pytest.raises(FileNotFoundError):
+        s3.stat('missing')
+
+
+def test_s3_range_reads(s3, tmp_path):
+    s3.put_file('blob', make_source(tmp_path))
+    with s3.open('blob') as fh:
+        assert fh.read(2) == b'01'
+        fh.seek(6)
+        assert fh.read(2) == b'67'
+        assert fh.seek(-3, io.SEEK_END) == 7
+        assert fh.read() == b'789'
+        fh.seek(2)
+        # Поток BufferedReader поверх S3Reader, как у io.open
+        assert io.BufferedReader(fh).read(3) == b'234'
+
+    with s3.open('blob') as fh:
+        fh.seek(20)
+        assert fh.read() == b''
+
+
+def test_s3_multipart_upload(s3, tmp_path):
+    data = os.urandom(5 * MB + 1)
+    s3.put_file('large', make_source(tmp_path, data))
+
+    head = s3.client.head_object(Bucket='files', Key='data/large')
+    assert head['ETag'].strip('"').endswith('-2')
+    with s3.open('large') as fh:
+        fh.seek(5 * MB - 1)
+        assert fh.read() == data[-2:]
+
+
+def test_s3_presigned_url(s3, tmp_path):
+    s3.put_file('blob', make_source(tmp_path))
+    url = s3.presigned_url('blob', ResponseContentDisposition='attachment; filename="a.txt"')
+
+    parsed = urlsplit(url)
+    params = parse_qs(parsed.query)
+    assert parsed.path.endswith('/data/blob')
+    assert params['response-content-disposition'] == ['attachment; filename="a.txt"']
+    if 'X-Amz-Expires' in params:
+        assert params['X-Amz-Expires'] == ['300']
+    else:
+        assert abs(int(params['Expires'][0]) - time.time() - 300) < 30
+
+
+def test_s3_delete_in_batches(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(app.backends, 'S3_DELETE_BATCH', 2)
+    keys = [f'k{index}' for index in range(5)]
+    for key in keys:
+        s3.put_file(key, make_source(tmp_path))
+
+    assert s3.delete(keys + ['missing']) == 6
+    listing = s3.client.list_objects_v2(Bucket='files', Prefix='data/')
+    assert listing['KeyCount'] == 0
+
+
+@pytest.fixture
+def s3_app(s3, config, monkeypatch, request):
+    for name, value in (('STORAGE_BACKEND', 's3'), ('S3_BUCKET', 'files'),
+                        ('S3_PREFIX', 'data/'), ('S3_REGION', 'us-east-1')):
+        monkeypatch.setattr(config, name, value)
+    return request.getfixturevalue('app')
+
+
+def test_s3_download_redirects_to_presigned_url(s3_app, login, upload):
+    client = login()
+    upload(client, 'a.txt', b'stored in s3')
+    filename = client.get('/api/v1/files?fields=filename').get_json()['files'][0]['filename']
+
+    response = client.get(f'/download/{filename}')
+    assert response.status_code == 302
+    assert 'X-Amz-Signature=' in response.location or 'Signature=' in response.location
+    assert 'response-content-disposition=' in response.location
+
+    listing = s3_app.extensions['blob_store'].backend.client.list_objects_v2(
+        Bucket='files', Prefix='data/blobs/'
+    )
+    assert listing['KeyCount'] == 1
+
+
+def test_s3_ranged_compressed_download_is_served_whole(gzip_storage, s3_app, login, upload):
+    client = login()
+    upload(client, 'a.txt', b'0123456789' * 200)
+    filename = client.get('/api/v1/files?fields=filename').get_json()['files'][0]['filename']
+
+    # Без Range сжатый файл отдает хранилище с Content-Encoding
+    assert client.get(f'/download/{filename}', headers={'Accept-Encoding': 'gzip'}).status_code == 302
+    # Хранилище отдало бы диапазон сжатых байтов - файл отдается целиком
+    response = client.get(f'/download/{filename}', headers={
+        'Accept-Encoding': 'gzip', 'Range': 'bytes=100-'
+    })
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
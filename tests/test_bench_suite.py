@@ -0,0 +1,71 @@
+"""Сквозной бенчмарк: наполнение, отчет и сравнение отчетов"""
+
+import json
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.bench_suite import compare
+from benchmarks.common import ROOT
+
+SMALL = ['--files', '300', '--users', '4', '--blobs', '4', '--blob-kb', '4',
+         '--threads', '2', '--seconds', '0.3']
+
+
+def run_suite(*args):
+    return subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite', *args],
+                          capture_output=True, text=True, cwd=ROOT)
+
+
+@pytest.fixture(scope='module')
+def suite(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('suite')
+    output = workdir / 'report.json'
+    result = run_suite(*SMALL, '--scenarios', 'purge,list,shared',
+                       '--workdir', str(workdir), '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    return workdir, json.loads(output.read_text())
+
+
+def test_report_has_metrics_per_scenario(suite):
+    _, report = suite
+    assert report['dataset']['params']['files'] == 300
+    # Изменяющие данные сценарии выполняются последними
+    assert list(report['scenarios']) == ['list', 'shared', 'purge']
+    for metrics in report['scenarios'].values():
+        assert metrics['ops'] > 0
+        assert metrics['errors'] == 0
+        assert metrics['p50_ms'] <= metrics['p95_ms'] <= metrics['p99_ms'] <= metrics['max_ms']
+        assert metrics['queries_per_op'] > 0
+        assert metrics['peak_rss_mb'] > 0
+
+
+def test_seed_matches_parameters(suite):
+    workdir, report = suite
+    with sqlite3.connect(workdir / 'bench.db') as connection:
+        users = connection.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        blobs = connection.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        # Сценарий purge удалил часть файлов из корзины
+        files = connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    assert users == 4
+    assert blobs == 4
+    assert 300 - report['scenarios']['purge']['ops'] <= files <= 300
+
+    result = run_suite(*SMALL, '--files', '400', '--workdir', str(workdir), '--scenarios', 'list')
+    assert result.returncode != 0
+    assert 'другими параметрами' in result.stderr
+
+
+def test_compare_reports_change(tmp_path):
+    before, after = tmp_path / 'before.json', tmp_path / 'after.json'
+    before.write_text(json.dumps({'scenarios': {'list': {'ops_per_s': 100, 'p50_ms': 10},
+                                                'upload': {'ops_per_s': 5}}}))
+    after.write_text(json.dumps({'scenarios': {'list': {'ops_per_s': 150, 'p50_ms': 8}}}))
+
+    result = compare(before, after)
+    assert list(result) == ['list']
+    assert result['list']['ops_per_s'] == {'before': 100, 'after': 150, 'change_pct': 50.0}
+    assert result['list']['p50_ms']['change_pct'] == -20.0
+    assert result['list']['p99_ms']['change_pct'] is None
@@ -0,0 +1,56 @@
+"""Настройка подключений: PRAGMA SQLite и чтение с реплики"""
+
+import pytest
+from sqlalchemy import insert, select, text
+
+from app import db
+from app.database import REPLICA_BIND, engine_options
+from app.models import User
+
+
+def test_sqlite_connections_use_wal(app):
+    with app.app_context():
+        pragmas = {name: db.session.execute(text(f'PRAGMA {name}')).scalar()
+                   for name in ('journal_mode', 'synchronous', 'busy_timeout')}
+    assert pragmas == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 30000}
+
+
+def test_postgres_engine_gets_pool_options(app):
+    options = engine_options(app.config, 'postgresql://user@db/files')
+    assert options['pool_pre_ping'] is True
+    assert options['pool_size'] == app.config['DB_POOL_SIZE']
+    assert engine_options(app.config, 'sqlite:///files.db') == {}
+
+
+@pytest.fixture
+def replica(config, monkeypatch, tmp_path, request):
+    """Реплика - отдельная база с копией пользователей, но без файлов"""
+    monkeypatch.setattr(config, 'DATABASE_REPLICA_URL', f'sqlite:///{tmp_path}/replica.db')
+    app = request.getfixturevalue('app')
+    client = request.getfixturevalue('client')
+    with app.app_context():
+        engine = db.engines[REPLICA_BIND]
+        db.metadata.create_all(engine)
+        users = [dict(row._mapping) for row in db.session.execute(select(User.__table__))]
+        with engine.begin() as connection:
+            connection.execute(insert(User.__table__), users)
+    yield client
+    # init_app заводит метаданные для каждого bind в общем объекте db
+    db.metadatas.pop(REPLICA_BIND, None)
+
+
+def listed(client):
+    return len(client.get('/api/v1/files?fields=id').get_json()['files'])
+
+
+def test_reads_go_to_replica_after_sticky_period(replica, upload):
+    upload(replica, 'a.txt')
+    # Сразу после записи пользователь читает с основной базы
+    assert listed(replica) == 1
+
+    with replica.session_transaction() as session:
+        session['db_primary_until'] = 0
+    assert listed(replica) == 0
+    # Новая запись снова закрепляет чтение за основной базой
+    assert replica.post('/api/v1/folders', json={'name': 'docs'}).status_code == 201
+    assert listed(replica) == 1
@@ -0,0 +1,98 @@
+"""Отдача файлов: диапазоны, условные запросы, скачивание по общей ссылке"""
+
+import gzip
+
+import pytest
+
+from app import db
+from app.models import File, ShareLink
+
+CONTENT = b'0123456789' * 100
+# Больше MIN_COMPRESS_SIZE: такой файл хранится сжатым
+LARGE = CONTENT * 10
+
+
+@pytest.fixture
+def shared(app, client, upload):
+    """Общая ссылка с лимитом в два скачивания"""
+    upload(client, 'data.txt', CONTENT)
+    file_id = client.get('/api/v1/files?fields=id').get_json()['files'][0]['id']
+    link = client.post('/api/v1/files/bulk/share', json={
+        'ids': [file_id], 'download_limit': 2
+    }).get_json()['links'][0]
+    return link
+
+
+def download_count(app, token):
+    with app.app_context():
+        return db.session.scalar(db.select(ShareLink.download_count).filter_by(token=token))
+
+
+def test_download_range(client, upload):
+    upload(client, 'data.txt', CONTENT)
+    filename = client.get('/api/v1/files?fields=filename').get_json()['files'][0]['filename']
+
+    response = client.get(f'/download/{filename}', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(CONTENT)}'
+
+    etag = response.headers['ETag']
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_shared_download_counts_only_download_starts(app, shared):
+    anonymous = app.test_client()
+    url = f'/shared/{shared["token"]}'
+
+    assert anonymous.head(url).status_code == 200
+    full = anonymous.get(url)
+    assert full.data == CONTENT
+    assert download_count(app, shared['token']) == 1
+
+    # Повторная проверка, докачка и параллельные диапазоны - то же скачивание
+    assert anonymous.get(url, headers={'If-None-Match': full.headers['ETag']}).status_code == 304
+    for header in ('bytes=500-', 'bytes=100-199', 'bytes=-10'):
+        assert anonymous.get(url, headers={'Range': header}).status_code == 206
+    assert download_count(app, shared['token']) == 1
+
+    first_range = anonymous.get(url, headers={'Range': 'bytes=0-99'})
+    assert first_range.status_code == 206
+    assert download_count(app, shared['token']) == 2
+
+    assert anonymous.get(url).status_code == 410
+    assert download_count(app, shared['token']) == 2
+
+
+def test_shared_download_with_password_is_counted(app, client, upload):
+    upload(client, 'data.txt', CONTENT)
+    file_id = client.get('/api/v1/files?fields=id').get_json()['files'][0]['id']
+    token = client.post('/api/v1/files/bulk/share', json={
+        'ids': [file_id], 'download_limit': 1, 'password': 'secret'
+    }).get_json()['links'][0]['token']
+
+    anonymous = app.test_client()
+    assert anonymous.post(f'/shared/{token}', data={'password': 'wrong'}).status_code == 403
+    assert anonymous.post(f'/shared/{token}', data={'password': 'secret'}).data == CONTENT
+    assert anonymous.post(f'/shared/{token}', data={'password': 'secret'}).status_code == 410
+
+
+@pytest.mark.usefixtures('gzip_storage')
+def test_compressed_file_ignores_range(app, client, upload):
+    upload(client, 'data.txt', LARGE)
+    filename = client.get('/api/v1/files?fields=filename').get_json()['files'][0]['filename']
+    with app.app_context():
+        assert db.session.scalar(db.select(File.codec).filter_by(filename=filename)) == 'gzip'
+
+    response = client.get(f'/download/{filename}', headers={'Range': 'bytes=500-'})
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'none'
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == LARGE
+
+    response = client.get(f'/download/{filename}', headers={
+        'Range': 'bytes=500-', 'Accept-Encoding': 'gzip'
+    })
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == LARGE
@@ -0,0 +1,16 @@
+"""Папки: веб-интерфейс и операции над поддеревом"""
+
+
+def test_index_title_and_single_folder_modal(client):
+    page = client.get('/').get_data(as_text=True)
+    assert '<title>Мои файлы | FilesCloud</title>' in page
+    assert page.count('id="folderModal"') == 1
+
+
+def test_folder_name_is_escaped_in_rename_form(client):
+    name = "it's\"<b>'); alert(1); ('"
+    client.post('/folders', data={'name': name})
+    page = client.get('/').get_data(as_text=True)
+    assert "<b>'); alert(1)" not in page
+    assert 'data-folder-name="it&#39;s&#34;&lt;b&gt;&#39;); alert(1); (&#39;"' in page
+    assert "prompt('Новое имя папки', this.dataset.folderName)" in page
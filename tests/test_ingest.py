@@ -0,0 +1,62 @@
+"""Потоковый прием загрузок: части multipart пишутся сразу в хранилище"""
+
+import hashlib
+import io
+
+from werkzeug.datastructures import FileStorage
+
+from app.codecs import storage_codec
+from app.ingest import uploaded_blob
+from app.storage import BlobWriter, blob_store
+
+CONTENT = b'streamed upload ' * 4096
+
+
+def temporary_files(app):
+    with app.app_context():
+        tmp_dir = blob_store().tmp_dir
+    return sorted(path.name for path in tmp_dir.iterdir()) if tmp_dir.exists() else []
+
+
+def test_upload_is_written_once_into_blob(app, client, upload, writers):
+    upload(client, 'big.txt', CONTENT)
+
+    assert len(writers) == 1
+    writer = writers[0]
+    assert writer.size == len(CONTENT)
+    assert writer.digest == hashlib.sha256(CONTENT).hexdigest()
+    # Временный файл перенесен на место блоба, а не скопирован
+    assert writer.tmp_path is None
+    assert temporary_files(app) == []
+    with app.app_context():
+        key, _ = blob_store().locate(writer.digest)
+        assert blob_store().backend.local_path(key).read_bytes() == CONTENT
+
+
+def test_unsaved_upload_leaves_no_temporary_file(app, client, upload, writers):
+    response = upload(client, 'big.txt', CONTENT, folder_id=12345)
+    assert response.status_code == 302
+    assert len(writers) == 1
+    assert temporary_files(app) == []
+
+
+def test_writer_hashes_and_compresses_in_one_pass(tmp_path):
+    writer = BlobWriter(tmp_path, storage_codec('gzip'))
+    for offset in range(0, len(CONTENT), 1000):
+        writer.write(CONTENT[offset:offset + 1000])
+    writer.close()
+
+    assert writer.size == len(CONTENT)
+    assert writer.digest == hashlib.sha256(CONTENT).hexdigest()
+    assert writer.codec == 'gzip'
+    assert writer.stored_size < len(CONTENT)
+    with open(writer.tmp_path, 'rb') as fh:
+        assert len(fh.read()) == writer.stored_size
+
+
+def test_plain_stream_is_copied_into_store(app):
+    with app.test_request_context():
+        writer = uploaded_blob(FileStorage(io.BytesIO(CONTENT), 'big.txt'))
+        assert writer.mime_type == 'text/plain'
+        assert writer.digest == hashlib.sha256(CONTENT).hexdigest()
+        writer.discard()
@@ -0,0 +1,92 @@
+"""Метрики: снимки процессов в METRICS_DIR"""
+
+import json
+import os
+import time
+
+import pytest
+
+from app.metrics import Registry, STALE_FLUSH_INTERVALS, requests_total, registry
+
+TOKEN = 'metrics-token'
+
+
+def write_snapshot(directory, name, total, age=0):
+    path = directory / name
+    labels = ['main.index', 'GET', '200']
+    path.write_text(json.dumps({requests_total.name: [[labels, total]]}))
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def index_requests(merged):
+    return merged.get(requests_total.name, {}).get(('main.index', 'GET', '200'), 0)
+
+
+def test_reused_pid_keeps_other_snapshot(tmp_path):
+    # Снимок завершенного процесса с тем же pid, но другим временем запуска
+    other = write_snapshot(tmp_path, f'{os.getpid()}-1.json', 5)
+    local = Registry()
+    local.register(requests_total)
+    local.record(requests_total, 2, 'main.index', 'GET', '200')
+
+    local.flush(tmp_path)
+    assert other.exists()
+    assert (tmp_path / local.snapshot_name()).exists()
+    assert index_requests(local.collect(tmp_path)) == 7
+
+
+def test_stale_snapshots_are_removed(tmp_path):
+    fresh = write_snapshot(tmp_path, '100-1.json', 3)
+    stale = write_snapshot(tmp_path, '200-1.json', 5, age=60)
+    abandoned = tmp_path / '.snapshot-abc'
+    abandoned.write_text('{')
+    os.utime(abandoned, (time.time() - 60, time.time() - 60))
+
+    local = Registry()
+    local.register(requests_total)
+    assert index_requests(local.collect(tmp_path, max_age=30)) == 3
+    assert fresh.exists()
+    assert not stale.exists()
+    assert not abandoned.exists()
+
+
+@pytest.fixture
+def metrics_dir(config, monkeypatch, tmp_path):
+    directory = tmp_path / 'metrics'
+    monkeypatch.setattr(config, 'METRICS_DIR', str(directory))
+    monkeypatch.setattr(config, 'METRICS_FLUSH_INTERVAL', 0.05)
+    monkeypatch.setattr(config, 'METRICS_TOKEN', TOKEN)
+    return directory
+
+
+def test_idle_process_refreshes_snapshot(metrics_dir, app):
+    client = app.test_client()
+    client.get('/login')
+    snapshot = metrics_dir / registry.snapshot_name()
+    assert snapshot.exists()
+
+    # Без запросов снимок обновляется, и его не удаляют как оставшийся от завершенного процесса
+    old = time.time() - 60
+    os.utime(snapshot, (old, old))
+    deadline = time.monotonic() + 2
+    while snapshot.stat().st_mtime == old and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert time.time() - snapshot.stat().st_mtime < 0.05 * STALE_FLUSH_INTERVALS
+
+
+def test_metrics_endpoint_drops_stale_snapshots(metrics_dir, app):
+    client = app.test_client()
+    metrics_dir.mkdir(parents=True)
+    write_snapshot(metrics_dir, '999998-1.json', 7)
+    stale = write_snapshot(metrics_dir, '999999-1.json', 1000, age=60)
+
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert not stale.exists()
+    # Только живой снимок (и собственные значения процесса, если он сам обслуживал main.index)
+    line = next(line for line in response.get_data(as_text=True).splitlines()
+                if line.startswith('filescloud_http_requests_total{endpoint="main.index",method="GET"'))
+    assert float(line.rsplit(' ', 1)[1]) < 1000
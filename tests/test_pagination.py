@@ -0,0 +1,49 @@
+"""Keyset-пагинация: курсоры на строках с NULL в колонке сортировки"""
+
+import pytest
+from sqlalchemy import update
+
+from app import db
+from app.models import File
+from app.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips_null_sort_value():
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+    assert decode_cursor('bogus') is None
+
+
+def walk(client, url, direction, cursor=None):
+    """Страницы списка по курсорам next_cursor (after) или prev_cursor (before)"""
+    pages = []
+    while True:
+        query = f'&{direction}={cursor}' if cursor else ''
+        page = client.get(f'{url}{query}').get_json()
+        pages.append([item['id'] for item in page['files']])
+        cursor = page['next_cursor' if direction == 'after' else 'prev_cursor']
+        if not cursor:
+            return pages, page
+
+
+@pytest.mark.parametrize('url, column, trashed', [
+    ('/api/v1/files?fields=id&limit=2', File.uploaded_at, False),
+    ('/api/v1/trash?fields=id&limit=2', File.deleted_at, True),
+])
+def test_pages_cross_null_sort_values(app, client, upload, url, column, trashed):
+    for index in range(7):
+        upload(client, f'n{index}.txt')
+    ids = [item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files']]
+    if trashed:
+        client.post('/api/v1/files/bulk/delete', json={'ids': ids})
+    with app.app_context():
+        db.session.execute(update(File).where(File.id.in_(ids[1::2])).values({column: None}))
+        db.session.commit()
+
+    pages, last = walk(client, url, 'after')
+    assert len(pages) == 4
+    listed = [file_id for page in pages for file_id in page]
+    assert sorted(listed) == sorted(ids)
+
+    # Обратно от последней страницы - те же страницы в обратном порядке
+    back, _ = walk(client, url, 'before', last['prev_cursor'])
+    assert back == pages[-2::-1]
@@ -0,0 +1,99 @@
+"""Превью файлов: кэш на диске, вытеснение и отдача"""
+
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from app import previews
+from app.previews import PreviewCache
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256))
+
+
+def test_concurrent_requests_render_once(tmp_path):
+    cache = PreviewCache(tmp_path, max_bytes=1024 * 1024)
+    calls = []
+
+    def render(size):
+        calls.append(size)
+        time.sleep(0.1)
+        return b'x' * size
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_render('ab12', 64, render)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [64]
+    assert set(results) == {cache.path_for('ab12', 64)}
+    assert cache.get_or_render('ab12', 256, lambda size: None) is None
+
+
+def test_least_recently_used_previews_are_evicted(tmp_path):
+    cache = PreviewCache(tmp_path, max_bytes=350)
+    for index, key in enumerate(('aa01', 'bb02', 'cc03')):
+        path = cache.get_or_render(key, 64, lambda size: b'x' * 100)
+        old = time.time() - 100 + index
+        os.utime(path, (old, old))
+    # Попадание в кэш обновляет время обращения
+    cache.get('aa01', 64)
+
+    path = cache.get_or_render('dd04', 64, lambda size: b'x' * 100)
+    assert path.exists()
+    remaining = {key for key in ('aa01', 'bb02', 'cc03', 'dd04') if cache.get(key, 64)}
+    assert remaining == {'aa01', 'cc03', 'dd04'}
+
+
+@pytest.fixture
+def fake_renderer(monkeypatch):
+    """Рендеринг изображений без Pillow"""
+    calls = []
+
+    def render(source, size):
+        calls.append(size)
+        return b'jpeg %d' % size
+
+    monkeypatch.setattr(previews, 'Image', object())
+    monkeypatch.setitem(previews.RENDERERS, 'image', render)
+    return calls
+
+
+def test_thumbnail_is_served_with_long_cache(client, upload, fake_renderer):
+    upload(client, 'a.png', PNG)
+    upload(client, 'b.png', PNG)
+    ids = [item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files']]
+
+    response = client.get(f'/files/{ids[0]}/thumbnail?size=100')
+    assert response.status_code == 200
+    assert response.data == b'jpeg 256'
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'private' in response.headers['Cache-Control']
+
+    # Файлы с одним содержимым делят превью
+    assert client.get(f'/files/{ids[1]}/thumbnail?size=200').data == b'jpeg 256'
+    assert fake_renderer == [256]
+
+
+def test_no_thumbnail_for_text(client, upload, fake_renderer):
+    upload(client, 'a.txt')
+    file_id = client.get('/api/v1/files?fields=id').get_json()['files'][0]['id']
+    assert client.get(f'/files/{file_id}/thumbnail').status_code == 404
+    assert fake_renderer == []
+
+
+def test_render_image_fits_square(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    source = tmp_path / 'wide.png'
+    Image.new('RGBA', (400, 100), (255, 0, 0, 128)).save(source)
+
+    data = previews.render_image(source, 64)
+    with Image.open(io.BytesIO(data)) as thumbnail:
+        assert thumbnail.format == 'JPEG'
+        assert thumbnail.size == (64, 16)
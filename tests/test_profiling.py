@@ -0,0 +1,60 @@
+"""Профилирование: одновременные профили cprofile"""
+
+import threading
+
+import app.profiling
+from app.profiling import Profile
+
+
+def work():
+    return sum(i * i for i in range(20000))
+
+
+def run_profile(mode, started, release, records):
+    profile = Profile(mode, 0.001)
+    profile.start()
+    started.set()
+    release.wait(5)
+    work()
+    records.append(profile.finish('request', 'test', mode))
+
+
+def test_concurrent_cprofile_falls_back_to_sampling():
+    first_started, second_started, release = threading.Event(), threading.Event(), threading.Event()
+    first, second = [], []
+    threads = [
+        threading.Thread(target=run_profile, args=('cprofile', first_started, release, first)),
+        threading.Thread(target=run_profile, args=('cprofile', second_started, release, second)),
+    ]
+    threads[0].start()
+    assert first_started.wait(5)
+    threads[1].start()
+    assert second_started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert first[0]['mode'] == 'cprofile'
+    assert any(calls for _, _, calls in first[0]['functions'].values())
+    assert second[0]['mode'] == 'sampling'
+    assert second[0]['interval'] == 0.001
+
+    # После завершения первого профиля cprofile снова доступен
+    profile = Profile('cprofile', 0.001)
+    profile.start()
+    work()
+    assert profile.finish('request', 'test', '')['mode'] == 'cprofile'
+
+
+def test_cprofile_busy_with_other_tool(monkeypatch):
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr(app.profiling.cProfile, 'Profile', BusyProfile)
+    profile = Profile('cprofile', 0.001)
+    profile.start()
+    record = profile.finish('request', 'test', '')
+
+    assert record['mode'] == 'sampling'
+    assert not app.profiling._cprofile_lock.locked()
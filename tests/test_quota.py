@@ -0,0 +1,85 @@
+"""Квоты и счетчики занятого места"""
+
+import io
+
+from sqlalchemy import update
+
+from app import db
+from app.models import User
+from app.quota import reconcile_usage
+from app.users import invalidate_user
+
+
+def set_quota(app, quota_bytes, username='alice'):
+    with app.app_context():
+        db.session.execute(update(User).where(User.username == username).values(quota_bytes=quota_bytes))
+        user_id = db.session.scalar(db.select(User.id).filter_by(username=username))
+        invalidate_user(user_id)
+        db.session.commit()
+
+
+def test_over_quota_upload_is_rejected_before_reading_body(app, client, writers):
+    set_quota(app, 10)
+    app.config['WTF_CSRF_ENABLED'] = True
+
+    response = client.post('/upload', data={'file': (io.BytesIO(b'x' * 200 * 1024), 'big.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert writers == []
+
+    # Проверка CSRF по-прежнему выполняется для загрузок в пределах квоты
+    set_quota(app, None)
+    response = client.post('/upload', data={'file': (io.BytesIO(b'small'), 'small.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def usage(app, username='alice'):
+    with app.app_context():
+        user = db.session.scalar(db.select(User).filter_by(username=username))
+        return user.bytes_used, user.file_count, user.trash_bytes, user.trash_count
+
+
+def file_ids(client):
+    return [item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files']]
+
+
+def test_upload_over_quota_keeps_counters(app, client, upload, writers):
+    set_quota(app, 8)
+    upload(client, 'a.txt', b'hello')
+    assert usage(app) == (5, 1, 0, 0)
+
+    # Предварительная проверка по Content-Length пропускает маленькое тело,
+    # точная - после записи файла
+    upload(client, 'b.txt', b'world')
+    assert len(writers) == 2
+    assert usage(app) == (5, 1, 0, 0)
+    assert len(file_ids(client)) == 1
+
+
+def test_counters_follow_delete_restore_and_purge(app, client, upload):
+    upload(client, 'a.txt', b'hello')
+    upload(client, 'b.txt', b'hi')
+    first, second = sorted(file_ids(client))
+    assert usage(app) == (7, 2, 0, 0)
+
+    client.post(f'/delete/{first}')
+    assert usage(app) == (7, 1, 5, 1)
+    client.post(f'/restore/{first}')
+    assert usage(app) == (7, 2, 0, 0)
+
+    client.post(f'/delete/{second}')
+    client.post(f'/purge/{second}')
+    assert usage(app) == (5, 1, 0, 0)
+
+
+def test_reconcile_fixes_drifted_counters(app, client, upload):
+    upload(client, 'a.txt', b'hello')
+    upload(client, 'b.txt', b'hi')
+    client.post(f'/delete/{max(file_ids(client))}')
+    with app.app_context():
+        db.session.execute(update(User).values(bytes_used=999, file_count=0, trash_bytes=0,
+                                               trash_count=7))
+        db.session.commit()
+        assert reconcile_usage(batch_size=1) == 1
+    assert usage(app) == (7, 1, 2, 1)
@@ -0,0 +1,50 @@
+"""Ограничение частоты попыток входа"""
+
+import pytest
+
+
+@pytest.fixture
+def config(config, monkeypatch):
+    monkeypatch.setattr(config, 'LOGIN_RATE_LIMIT', True)
+    monkeypatch.setattr(config, 'LOGIN_IP_RATE', 0.01)
+    monkeypatch.setattr(config, 'LOGIN_IP_BURST', 3)
+    monkeypatch.setattr(config, 'LOGIN_USER_RATE', 0.01)
+    monkeypatch.setattr(config, 'LOGIN_USER_BURST', 100)
+    return config
+
+
+def attempt(client, ip, username='alice', forwarded_for=None):
+    headers = {'X-Forwarded-For': forwarded_for} if forwarded_for else {}
+    return client.post('/login', data={'username': username, 'password': 'wrong'},
+                       headers=headers, environ_base={'REMOTE_ADDR': ip})
+
+
+def test_ip_bucket_throttles_one_address(app):
+    client = app.test_client()
+    for _ in range(3):
+        assert attempt(client, '10.0.0.1').status_code == 200
+    throttled = attempt(client, '10.0.0.1')
+    assert throttled.status_code == 429
+    assert int(throttled.headers['Retry-After']) > 0
+    assert attempt(client, '10.0.0.2').status_code == 200
+
+
+def test_forwarded_for_is_ignored_without_proxy_fix(app):
+    client = app.test_client()
+    for index in range(3):
+        attempt(client, '127.0.0.1', forwarded_for=f'203.0.113.{index}')
+    assert attempt(client, '127.0.0.1', forwarded_for='203.0.113.99').status_code == 429
+
+
+def test_clients_behind_proxy_have_own_buckets(config, monkeypatch, request):
+    monkeypatch.setattr(config, 'PROXY_FIX_X_FOR', 1)
+    client = request.getfixturevalue('app').test_client()
+
+    # Все запросы приходят с адреса nginx
+    for _ in range(3):
+        attempt(client, '127.0.0.1', forwarded_for='203.0.113.1')
+    assert attempt(client, '127.0.0.1', forwarded_for='203.0.113.1').status_code == 429
+    assert attempt(client, '127.0.0.1', forwarded_for='203.0.113.2').status_code == 200
+    # Подделанный клиентом адрес левее доверенного не учитывается
+    assert attempt(client, '127.0.0.1',
+                   forwarded_for='198.51.100.7, 203.0.113.1').status_code == 429
@@ -0,0 +1,63 @@
+"""Поиск по именам файлов через индекс FTS5"""
+
+import pytest
+from sqlalchemy import update
+
+from app import db
+from app.models import File
+from app.search import search_backend
+
+
+@pytest.fixture
+def indexed(app):
+    """Индекс files_fts, созданный командой flask search rebuild"""
+    result = app.test_cli_runner().invoke(args=['search', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert search_backend() == 'sqlite'
+
+
+def found(client, query):
+    results = client.get(f'/api/v1/search?q={query}').get_json()['results']
+    return sorted(item['filename'].split('_', 1)[1] for item in results)
+
+
+def test_prefix_search_in_own_files(indexed, login, upload):
+    alice, bobby = login('alice'), login('bobby')
+    upload(alice, 'annual-report.txt')
+    upload(alice, 'report_draft.txt')
+    upload(alice, 'holiday.png', b'\x89PNG\r\n\x1a\n')
+    upload(bobby, 'report.txt')
+
+    assert found(alice, 'rep') == ['annual-report.txt', 'report_draft.txt']
+    assert found(alice, 'report dra') == ['report_draft.txt']
+    assert found(alice, 'missing') == []
+    assert found(bobby, 'rep') == ['report.txt']
+
+
+def test_index_follows_rename_and_trash(app, indexed, client, upload):
+    upload(client, 'notes.txt')
+    file_id = client.get('/api/v1/files?fields=id').get_json()['files'][0]['id']
+    with app.app_context():
+        db.session.execute(update(File).where(File.id == file_id).values(filename='x_minutes.txt'))
+        db.session.commit()
+    assert found(client, 'notes') == []
+    assert found(client, 'minu') == ['minutes.txt']
+
+    client.post(f'/delete/{file_id}')
+    assert found(client, 'minu') == []
+
+
+def test_index_page_filters_by_search(indexed, client, upload):
+    upload(client, 'budget.txt')
+    upload(client, 'photo.txt')
+    page = client.get('/?q=budg').get_data(as_text=True)
+    assert 'budget.txt' in page
+    assert 'photo.txt' not in page
+
+
+def test_falls_back_to_ilike_without_index(app, client, upload):
+    upload(client, 'budget.txt')
+    with app.app_context():
+        assert search_backend() is None
+    assert found(client, 'udge') == ['budget.txt']
@@ -0,0 +1,100 @@
+"""Общие ссылки: кэш и учет скачиваний"""
+
+import time
+
+import pytest
+
+from app import db
+from app.models import ShareLink
+from app.sharing import download_counter, resolve_share, share_cache
+
+
+class DictCache:
+    """Общий кэш процессов (как RedisCache) без срока жизни записей"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def share(app, client, upload):
+    """Функция, создающая или обновляющая ссылку на загруженный файл"""
+    upload(client, 'data.txt', b'shared content')
+    file_id = client.get('/api/v1/files?fields=id').get_json()['files'][0]['id']
+
+    def share(**settings):
+        return client.post('/api/v1/files/bulk/share', json={
+            'ids': [file_id], **settings
+        }).get_json()['links'][0]['token']
+    return share
+
+
+def download_count(app, token):
+    with app.app_context():
+        return db.session.scalar(db.select(ShareLink.download_count).filter_by(token=token))
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_unlimited_downloads_are_flushed_in_background(app, share):
+    app.config['SHARE_COUNT_FLUSH_INTERVAL'] = 0.05
+    token = share()
+    assert app.test_client().get(f'/shared/{token}').status_code == 200
+    # Больше скачиваний нет, но счетчик все равно попадает в базу
+    assert wait_for(lambda: download_count(app, token) == 1)
+
+
+def test_pending_downloads_are_flushed_on_stop(app, share):
+    app.config['SHARE_COUNT_FLUSH_INTERVAL'] = 3600
+    token = share()
+    for _ in range(3):
+        app.test_client().get(f'/shared/{token}')
+    assert download_count(app, token) == 0
+
+    download_counter.flusher.stop()
+    assert download_count(app, token) == 3
+
+
+def test_shared_cache_is_invalidated_for_other_processes(app, share):
+    app.extensions['shared_cache'] = shared = DictCache()
+    token = share(password='first')
+    with app.test_request_context():
+        assert resolve_share(token).password == 'first'
+    assert f'share:{token}' in shared.data
+
+    # Другой процесс уже закэшировал ссылку в общем кэше, свой кэш у него пуст
+    new_token = share(password='second')
+    share_cache.clear()
+    with app.test_request_context():
+        assert resolve_share(token) is None
+        assert resolve_share(new_token).password == 'second'
+        assert resolve_share(new_token).uploaded_at is not None
+
+
+def test_local_cache_expires_quickly(app, share):
+    app.config['SHARE_CACHE_LOCAL_TTL'] = 0.05
+    token = share(download_limit=5)
+    with app.test_request_context():
+        assert resolve_share(token).download_limit == 5
+        # Изменение из другого процесса: сброс кэша этого процесса не вызывается
+        ShareLink.query.filter_by(token=token).update({'download_limit': 1})
+        db.session.commit()
+        assert resolve_share(token).download_limit == 5
+        time.sleep(0.1)
+        assert resolve_share(token).download_limit == 1
@@ -0,0 +1,50 @@
+"""Проверка содержимого загрузок по сигнатуре"""
+
+import pytest
+
+from app import db
+from app.models import File
+from app.sniffing import DOCX, SNIFF_SIZE
+from app.storage import blob_store
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+TEXT = b'not an image ' * (SNIFF_SIZE // 4)
+
+
+def stored_files(app):
+    """Файлы во временном каталоге и блобы хранилища"""
+    with app.app_context():
+        root = blob_store().root
+    return sorted(str(path.relative_to(root)) for path in root.rglob('*') if path.is_file())
+
+
+def test_web_upload_with_wrong_content_is_rejected(app, client, upload):
+    response = upload(client, 'fake.png', TEXT)
+    assert response.status_code == 302
+    assert stored_files(app) == []
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count(File.id))) == 0
+
+
+def test_chunk_with_wrong_content_is_rejected(app, client):
+    response = client.post('/api/v1/uploads', json={'filename': 'fake.png', 'size': len(TEXT)})
+    upload_id = response.get_json()['id']
+
+    response = client.put(f'/api/v1/uploads/{upload_id}?offset=0', data=TEXT)
+    assert response.status_code == 415
+    assert client.get(f'/api/v1/uploads/{upload_id}').status_code == 404
+    assert stored_files(app) == []
+
+
+@pytest.mark.parametrize('filename, data, mime_type', [
+    ('pic.png', PNG, 'image/png'),
+    ('notes.txt', TEXT, 'text/plain'),
+    ('report.docx', b'PK\x03\x04' + b'\x00' * 26 + b'word/document.xml', DOCX),
+])
+def test_detected_type_is_stored_and_served(client, upload, filename, data, mime_type):
+    upload(client, filename, data)
+    item = client.get('/api/v1/files?fields=filename,mime_type').get_json()['files'][0]
+    assert item['mime_type'] == mime_type
+
+    response = client.get(f'/download/{item["filename"]}')
+    assert response.headers['Content-Type'].split(';')[0] == mime_type
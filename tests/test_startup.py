@@ -0,0 +1,67 @@
+"""Облегченное приложение для воркеров и команд обслуживания"""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from app import create_app, db
+from benchmarks.common import ROOT
+
+# Модули веб-части, которые облегченное приложение не загружает
+HEAVY_MODULES = ('app.routes', 'app.api', 'app.forms', 'flask_wtf', 'flask_babel',
+                 'flask_migrate', 'alembic')
+
+
+@pytest.fixture
+def worker_app(config):
+    app = create_app(lightweight=True)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_lightweight_app_has_no_web_part(worker_app):
+    endpoints = {rule.endpoint for rule in worker_app.url_map.iter_rules()}
+    assert endpoints == {'static'}
+    assert 'csrf' not in worker_app.extensions
+    assert 'blob_store' in worker_app.extensions
+
+
+def test_lightweight_app_runs_maintenance_commands(worker_app):
+    result = worker_app.test_cli_runner().invoke(args=['trash', 'cleanup', '--days', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Удалено файлов: 0' in result.output
+
+
+def test_heavy_imports_are_deferred(tmp_path):
+    script = textwrap.dedent(f'''
+        import json, sys
+        from config import Config
+        Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///{tmp_path}/test.db'
+        Config.UPLOAD_FOLDER = '{tmp_path}/uploads'
+        from app import create_app
+        app = create_app(lightweight=True)
+        loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+        # Flask-Migrate загружается при первом обращении к `flask db`
+        app.test_cli_runner().invoke(args=['db', '--help'])
+        print(json.dumps([loaded, 'flask_migrate' in sys.modules]))
+    ''')
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=tmp_path, env={**os.environ, 'PYTHONPATH': str(ROOT), 'SECRET_KEY': 'test'})
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == [[], True]
+
+
+def test_tasks_reuse_one_app(config, monkeypatch):
+    pytest.importorskip('celery')
+    import app.tasks
+    monkeypatch.setattr(app.tasks, '_app', None)
+    assert app.tasks.get_app() is app.tasks.get_app()
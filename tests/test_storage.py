@@ -0,0 +1,121 @@
+"""Хранилище блобов: дедупликация загрузок, счетчики ссылок, перенос старых файлов"""
+
+import hashlib
+
+from sqlalchemy import update
+
+from app import db
+from app.models import Blob, File, User
+from app.storage import BlobStore, blob_store, migrate_legacy
+
+CONTENT = b'the same installer'
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+def blob_refs(app):
+    with app.app_context():
+        blob = db.session.get(Blob, DIGEST)
+        return blob.ref_count if blob else None
+
+
+def blob_exists(app):
+    with app.app_context():
+        return blob_store().locate(DIGEST) is not None
+
+
+def purge_all(client):
+    ids = [item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files']]
+    for file_id in ids:
+        client.post(f'/delete/{file_id}')
+        client.post(f'/purge/{file_id}')
+
+
+def test_duplicate_uploads_share_one_blob(app, login, upload):
+    alice, bobby = login('alice'), login('bobby')
+    upload(alice, 'setup.txt', CONTENT)
+    upload(alice, 'copy.txt', CONTENT)
+    upload(bobby, 'setup.txt', CONTENT)
+
+    with app.app_context():
+        files = db.session.scalars(db.select(File)).all()
+        assert {file.content_hash for file in files} == {DIGEST}
+        assert len({file.storage_path for file in files}) == 1
+        blobs = [path for path in (blob_store().root / 'blobs').rglob('*') if path.is_file()]
+    assert len(blobs) == 1
+    assert blob_refs(app) == 3
+
+
+def test_blob_is_removed_with_last_reference(app, login, upload):
+    alice, bobby = login('alice'), login('bobby')
+    upload(alice, 'setup.txt', CONTENT)
+    upload(bobby, 'setup.txt', CONTENT)
+
+    purge_all(alice)
+    assert blob_refs(app) == 1
+    assert blob_exists(app)
+    filename = bobby.get('/api/v1/files?fields=filename').get_json()['files'][0]['filename']
+    assert bobby.get(f'/download/{filename}').data == CONTENT
+
+    purge_all(bobby)
+    assert blob_refs(app) is None
+    assert not blob_exists(app)
+
+
+def legacy_files(app, contents, username='alice'):
+    """Файлы старого формата в uploads/<user_id>/ с записями без content_hash"""
+    with app.app_context():
+        user_id = db.session.scalar(db.select(User.id).filter_by(username=username))
+        store = blob_store()
+        for index, data in enumerate(contents):
+            key = f'{user_id}/legacy{index}.txt'
+            if data is not None:
+                path = store.legacy_path(key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(data)
+            db.session.add(File(filename=f'legacy{index}.txt', storage_path=key,
+                                size=len(data or b''), user_id=user_id))
+        db.session.commit()
+        return sorted(db.session.scalars(db.select(File.id)))
+
+
+def test_legacy_files_move_into_blob_store(app, client):
+    ids = legacy_files(app, [CONTENT, b'other', CONTENT, None, b'last'])
+    progress = []
+
+    def check_old_files_remain(stats):
+        # Старые файлы удаляются только по истечении grace
+        progress.append(dict(stats))
+        assert store.legacy_path('1/legacy0.txt').exists()
+
+    with app.app_context():
+        store = blob_store()
+        stats = migrate_legacy(batch_size=2, grace=0.1, progress=check_old_files_remain)
+        assert stats == {'moved': 4, 'missing': 1, 'skipped': 0, 'errors': 0, 'last_id': ids[-1]}
+        assert len(progress) == 3
+        assert not any(store.legacy_path(f'1/legacy{index}.txt').exists() for index in range(5))
+
+        files = {file.filename: file for file in db.session.scalars(db.select(File))}
+        assert files['legacy0.txt'].storage_path == files['legacy2.txt'].storage_path
+        assert files['legacy3.txt'].content_hash is None
+    assert blob_refs(app) == 2
+    assert client.get('/download/legacy1.txt').data == b'other'
+
+
+def test_legacy_migration_resumes_and_skips_changed_rows(app, client, monkeypatch):
+    ids = legacy_files(app, [b'zero', b'one', b'two'])
+    adopt = BlobStore.adopt
+
+    def moved_concurrently(self, path, *args):
+        # Параллельный запрос успел изменить строку, пока файл хешировался
+        if path.name == 'legacy2.txt':
+            db.session.execute(update(File).where(File.id == ids[2]).values(storage_path='1/renamed'))
+        return adopt(self, path, *args)
+    monkeypatch.setattr(BlobStore, 'adopt', moved_concurrently)
+
+    with app.app_context():
+        stats = migrate_legacy(batch_size=1, start_after=ids[0], grace=0)
+        assert (stats['moved'], stats['skipped'], stats['last_id']) == (1, 1, ids[2])
+        hashes = dict(db.session.execute(db.select(File.id, File.content_hash)).all())
+        assert hashes == {ids[0]: None, ids[1]: hashlib.sha256(b'one').hexdigest(), ids[2]: None}
+        # Блоб пропущенной строки не остается в хранилище
+        assert blob_store().locate(hashlib.sha256(b'two').hexdigest()) is None
@@ -0,0 +1,79 @@
+"""Очистка корзины по сроку хранения"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app import db, trash
+from app.models import File
+from app.trash import cleanup_expired
+
+
+@pytest.fixture
+def trashed(app, client, upload):
+    """
+    Пять файлов, удаленных 40 дней назад, и два - вчера.
+
+    Недавно удаленные загружены давно: срок отсчитывается от deleted_at.
+    """
+    for index in range(7):
+        upload(client, f'old{index}.txt', f'content {index}'.encode())
+    ids = sorted(item['id'] for item in client.get('/api/v1/files?fields=id').get_json()['files'])
+    client.post('/api/v1/files/bulk/delete', json={'ids': ids})
+
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.execute(update(File).where(File.id.in_(ids[:5]))
+                           .values(deleted_at=now - timedelta(days=40)))
+        db.session.execute(update(File).where(File.id.in_(ids[5:]))
+                           .values(deleted_at=now - timedelta(days=1),
+                                   uploaded_at=now - timedelta(days=400)))
+        db.session.commit()
+    return ids
+
+
+def remaining(app):
+    with app.app_context():
+        return sorted(db.session.scalars(db.select(File.id)))
+
+
+def test_cleanup_uses_deleted_at_cutoff(app, trashed):
+    with app.app_context():
+        stats = cleanup_expired(days=30, batch_size=2, workers=2)
+    assert stats['files'] == 5
+    assert stats['batches'] == 3
+    assert stats['errors'] == 0
+    assert stats['last_id'] == trashed[4]
+    assert remaining(app) == trashed[5:]
+
+
+def test_failed_batch_does_not_roll_back_others(app, trashed, monkeypatch):
+    purge_rows = trash.purge_rows
+    calls = []
+
+    def fail_second(rows, *criteria):
+        calls.append([row.id for row in rows])
+        if len(calls) == 2:
+            raise RuntimeError('boom')
+        return purge_rows(rows, *criteria)
+
+    monkeypatch.setattr(trash, 'purge_rows', fail_second)
+    with app.app_context():
+        stats = cleanup_expired(days=30, batch_size=2)
+    assert stats['errors'] == 1
+    assert stats['files'] == 3
+    # Пачки до и после ошибки закоммичены, строки упавшей пачки остались
+    assert remaining(app) == calls[1] + trashed[5:]
+
+
+def test_cleanup_resumes_after_start_id(app, trashed):
+    with app.app_context():
+        stats = cleanup_expired(days=30, batch_size=2, start_after=trashed[2])
+    assert stats['files'] == 2
+    assert remaining(app) == trashed[:3] + trashed[5:]
+
+    # Повторный запуск с начала доудаляет остальное
+    with app.app_context():
+        assert cleanup_expired(days=30, batch_size=2)['files'] == 3
+    assert remaining(app) == trashed[5:]
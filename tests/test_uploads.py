@@ -0,0 +1,156 @@
+"""Загрузка по частям: докачка, контрольные суммы, сроки, повторное завершение"""
+
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import UploadSession
+from app.storage import blob_store
+
+CONTENT = b'abcdefghij' * 300
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def start(client, size=len(CONTENT)):
+    response = client.post('/api/v1/uploads', json={'filename': 'big.txt', 'size': size})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def put(client, upload_id, offset, data, checksum=None):
+    headers = {'X-Chunk-SHA256': checksum} if checksum else {}
+    return client.put(f'/api/v1/uploads/{upload_id}?offset={offset}', data=data, headers=headers)
+
+
+def downloaded(client, file_id):
+    filename = next(item['filename'] for item in client.get('/api/v1/files').get_json()['files']
+                    if item['id'] == file_id)
+    return client.get(f'/download/{filename}').data
+
+
+def test_chunks_in_any_order_and_resume(client):
+    upload_id = start(client)
+    assert put(client, upload_id, 1000, CONTENT[1000:]).status_code == 200
+    status = client.get(f'/api/v1/uploads/{upload_id}').get_json()
+    assert status['ranges'] == [[1000, len(CONTENT)]]
+
+    assert client.post(f'/api/v1/uploads/{upload_id}/complete', json={}).status_code == 409
+    assert put(client, upload_id, 0, CONTENT[:1000], sha256(CONTENT[:1000])).status_code == 200
+
+    response = client.post(f'/api/v1/uploads/{upload_id}/complete', json={'sha256': sha256(CONTENT)})
+    assert response.status_code == 201
+    assert downloaded(client, response.get_json()['id']) == CONTENT
+
+
+def test_bad_checksum_does_not_overwrite_received_bytes(client):
+    upload_id = start(client)
+    assert put(client, upload_id, 0, CONTENT[:1000]).status_code == 200
+    assert put(client, upload_id, 1000, CONTENT[1000:]).status_code == 200
+
+    corrupted = b'x' * 1000
+    assert put(client, upload_id, 0, corrupted, sha256(CONTENT[:1000])).status_code == 422
+
+    response = client.post(f'/api/v1/uploads/{upload_id}/complete', json={})
+    assert response.status_code == 201
+    assert downloaded(client, response.get_json()['id']) == CONTENT
+
+
+def test_expired_upload_is_rejected(app, client):
+    upload_id = start(client)
+    with app.app_context():
+        db.session.get(UploadSession, upload_id).expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        staging = blob_store().staging_path(upload_id)
+    assert staging.exists()
+
+    assert put(client, upload_id, 0, CONTENT).status_code == 410
+    assert not staging.exists()
+    assert client.get(f'/api/v1/uploads/{upload_id}').status_code == 404
+
+
+def test_failed_complete_can_be_retried(app, client, monkeypatch):
+    upload_id = start(client)
+    put(client, upload_id, 0, CONTENT)
+
+    from app.api import add_ref
+    calls = []
+
+    def fail_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError('database is unavailable')
+        return add_ref(*args)
+    monkeypatch.setattr('app.api.add_ref', fail_once)
+    assert client.post(f'/api/v1/uploads/{upload_id}/complete', json={}).status_code == 500
+    with app.app_context():
+        assert blob_store().staging_path(upload_id).exists()
+        assert blob_store().locate(sha256(CONTENT)) is None
+
+    response = client.post(f'/api/v1/uploads/{upload_id}/complete', json={})
+    assert response.status_code == 201
+    assert downloaded(client, response.get_json()['id']) == CONTENT
+    with app.app_context():
+        assert not blob_store().staging_path(upload_id).exists()
+
+
+@pytest.mark.parametrize('checksum, status', [(sha256(CONTENT), 201), ('0' * 64, 422)])
+def test_whole_file_checksum(app, client, checksum, status):
+    upload_id = start(client)
+    put(client, upload_id, 0, CONTENT)
+    response = client.post(f'/api/v1/uploads/{upload_id}/complete', json={'sha256': checksum})
+    assert response.status_code == status
+    with app.app_context():
+        assert not blob_store().staging_path(upload_id).exists()
+
+
+def test_chunk_is_refused_while_completing(app, client):
+    upload_id = start(client)
+    put(client, upload_id, 0, CONTENT)
+    with app.app_context():
+        frozen = blob_store().freeze_staging(upload_id)
+
+    # Запись части не меняет файл, который уже хешируется
+    assert put(client, upload_id, 0, b'x' * 1000).status_code == 409
+    assert frozen.read_bytes() == CONTENT
+    with app.app_context():
+        blob_store().thaw_staging(upload_id)
+
+    response = client.post(f'/api/v1/uploads/{upload_id}/complete', json={'sha256': sha256(CONTENT)})
+    assert response.status_code == 201
+
+
+def test_freeze_waits_for_chunk_in_progress(app, client):
+    upload_id = start(client)
+    with app.app_context():
+        store = blob_store()
+        frozen = threading.Event()
+        with store.open_staging(upload_id) as fh:
+            thread = threading.Thread(target=lambda: (store.freeze_staging(upload_id), frozen.set()))
+            thread.start()
+            assert not frozen.wait(0.2)
+            fh.write(CONTENT)
+        thread.join(5)
+        assert frozen.is_set()
+        assert store.completing_path(upload_id).read_bytes() == CONTENT
+
+
+def test_chunk_opened_before_freeze_is_not_written(app, client, monkeypatch):
+    upload_id = start(client)
+    from app.storage import _lock_file
+
+    def freeze_first(fh, exclusive):
+        # Завершение забирает файл между открытием и блокировкой части
+        if not exclusive:
+            blob_store().freeze_staging(upload_id)
+        _lock_file(fh, exclusive)
+    monkeypatch.setattr('app.storage._lock_file', freeze_first)
+
+    assert put(client, upload_id, 0, CONTENT).status_code == 409
+    with app.app_context():
+        assert blob_store().completing_path(upload_id).read_bytes().strip(b'\0') == b''
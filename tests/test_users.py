@@ -0,0 +1,32 @@
+"""Учет времени последнего входа"""
+
+import time
+
+from app import db
+from app.models import User
+from app.users import last_login_buffer
+
+
+def last_login(app, username='alice'):
+    with app.app_context():
+        return db.session.scalar(db.select(User.last_login).filter_by(username=username))
+
+
+def test_last_login_is_flushed_in_background(app, login):
+    app.config['LAST_LOGIN_FLUSH_INTERVAL'] = 0.05
+    login()
+    # Других входов нет, но время входа все равно попадает в базу
+    deadline = time.monotonic() + 5
+    while last_login(app) is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert last_login(app) is not None
+
+
+def test_last_login_is_flushed_on_stop(app, login):
+    app.config['LAST_LOGIN_FLUSH_INTERVAL'] = 3600
+    login()
+    assert last_login(app) is None
+
+    last_login_buffer.flusher.stop()
+    assert last_login(app) is not None
+